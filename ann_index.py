@@ -0,0 +1,102 @@
+import argparse
+import math
+import os
+from typing import Optional
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Defaults for the retrievers, overridable per deployment
+ANN_INDEX_TYPE = os.environ.get("ANN_INDEX_TYPE", "flat")
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "16"))
+ANN_EF_SEARCH = int(os.environ.get("ANN_EF_SEARCH", "64"))
+
+
+def factory_string(index_type: str, num_vectors: int, dimension: int, nlist: Optional[int] = None,
+                   pq_m: Optional[int] = None, hnsw_m: int = 32) -> str:
+    """FAISS index_factory description of an L2 index of `index_type` sized for `num_vectors` vectors"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type}, expected one of {INDEX_TYPES}")
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m}"
+
+    # Roughly 4 * sqrt(n) lists, while keeping the ~39 training points per list FAISS asks for
+    if nlist is None:
+        nlist = max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat"
+
+    if pq_m is None:
+        # About one byte per 8 dimensions, rounded down to a divisor of the dimension
+        pq_m = max(m for m in range(1, max(1, dimension // 8) + 1) if dimension % m == 0)
+    nbits = max(4, min(8, int(math.log2(max(num_vectors // 39, 16)))))
+    return f"IVF{nlist},PQ{pq_m}x{nbits}"
+
+
+def build_index(embeddings: np.ndarray, index_type: str = "flat", **options) -> faiss.Index:
+    """Build (and train if needed) an L2 index of `index_type` over `embeddings`"""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index = faiss.index_factory(embeddings.shape[1], factory_string(index_type, *embeddings.shape, **options))
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+
+def configure_index(index: faiss.Index, nprobe: int = ANN_NPROBE, ef_search: int = ANN_EF_SEARCH):
+    """Apply the query-time tunables that exist for `index`"""
+    ivf = _ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def search_parameters(index: faiss.Index, selector=None) -> faiss.SearchParameters:
+    """
+    Search parameters carrying `selector` for `index`. Explicit parameters replace the ones set on
+    the index, so the configured nprobe/efSearch are copied over.
+    """
+    ivf = _ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _ivf(index: faiss.Index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a FAISS index offline from an embeddings file')
+    parser.add_argument('--embeddings_file', type=str, default='embeddings.npy',
+                        help='Path to the embeddings numpy file')
+    parser.add_argument('--output', type=str, default='text_index.faiss',
+                        help='Path to save the FAISS index to')
+    parser.add_argument('--type', type=str, default=ANN_INDEX_TYPE, choices=INDEX_TYPES,
+                        help='Index type to build')
+    parser.add_argument('--nlist', type=int, default=None,
+                        help='Number of inverted lists for IVF indexes')
+    parser.add_argument('--pq_m', type=int, default=None,
+                        help='Number of PQ sub-quantizers for IVF-PQ')
+    parser.add_argument('--hnsw_m', type=int, default=32,
+                        help='Number of neighbors per node for HNSW')
+
+    args = parser.parse_args()
+    embeddings = np.load(args.embeddings_file, mmap_mode='r')
+    index = build_index(embeddings, args.type, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
+    faiss.write_index(index, args.output)
+    print(f"Saved {args.type} index with {index.ntotal} vectors to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,20 @@
 import asyncio
+import base64
 import json
 import math
 import os
 import sys
+import time
 import traceback
+from contextlib import asynccontextmanager
 from io import BytesIO
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Literal, Tuple
 
 import numpy as np
-import requests
-from fastapi import FastAPI, HTTPException, Response
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from openai import RateLimitError
-from PIL import Image, ImageDraw, ImageFont
 from pydantic import BaseModel
 
 import retriever
@@ -21,8 +23,14 @@ from image_retrieval import ImageRetrieval
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from designer import Designer
-from simple_retrieval import SimpleRetrieval
+from asset_cache import ASSET_MAX_AGE, AssetNotFoundError, asset_cache, etag_matches, parse_range
+from designer import Designer, design_cache, design_cache_key
+from example_bank import example_bank
+from jobs import CANCELLED, Job, JobQueue, QueueFullError
+from room_grid import grid_key, room_grid_png
+from llm_client import llm_client
+from simple_retrieval import SimpleRetrieval, rewrite_cache
+from timing import StageTimer
 
 # Initialize retrieval system
 retrieval_system = SimpleRetrieval()
@@ -34,6 +42,14 @@ except FileNotFoundError as e:
     print(f"Warning: {e}")
     print("Please run simple_retrieval.py first to create the necessary index files")
 
+# Load the in-context examples once for every design request
+example_bank().preload()
+
+# Bounded pool every design runs in, see DESIGN_WORKERS and DESIGN_QUEUE_MAX
+design_jobs = JobQueue("design")
+# How often requests waiting on a design check whether their client is still there
+DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", "1.0"))
+
 # Initialize image retrieval system
 image_retrieval_system = ImageRetrieval()
 try:
@@ -68,6 +84,7 @@ class DesignItem(BaseModel):
 class DesignResponse(BaseModel):
     items: List[DesignItem]
     wallColor: str
+    designId: str | None = None
 
 class QueryObject(BaseModel):
     selectedItemId: str
@@ -107,189 +124,33 @@ def create_room_grid_image(room_spec: RoomSpec) -> BytesIO:
       - Interior: White (no label)
       - Doors & Windows: Red with labels "door" or "window"
       - Grid lines: Black
-    Each cell is treated as 1 ft x 1 ft.
+    Each cell is treated as 1 ft x 1 ft. Images are memoized by the room's grid geometry.
     """
     
+    return BytesIO(room_grid_png(room_grid_key(room_spec)))
+
+def room_grid_key(room_spec: RoomSpec):
+    """Canonical geometry of the room grid image, see room_grid.grid_key"""
     # Determine grid dimensions (each cell is 1 ft x 1 ft)
     rows = int(math.ceil(room_spec.width))  # vertical cells
     cols = int(math.ceil(room_spec.length))     # horizontal cells
-    
-    # Set cell pixel size and margin (for axis labels)
-    cell_size = 50
-    margin = cell_size  # margin for axis numbers
-    offset_x = margin
-    offset_y = margin
-    
-    # New image dimensions include the margins.
-    img_width = cols * cell_size + offset_x
-    img_height = rows * cell_size + offset_y
-    
-    # Define colors
-    COLOR_WALL = (128, 128, 128)         # Gray
-    COLOR_INTERIOR = (255, 255, 255)     # White
-    COLOR_DOOR_WINDOW = (255, 0, 0)        # Red
-    COLOR_GRID = (0, 0, 0)               # Black
-    
-    # Create a new image with a white background.
-    image = Image.new("RGB", (img_width, img_height), COLOR_INTERIOR)
-    draw = ImageDraw.Draw(image)
-    
-    # 2D list to keep track of labels per cell.
-    cell_labels = [['' for _ in range(cols)] for _ in range(rows)]
-    
-    # 1) Draw the outer wall cells (offset by margin) in gray and label them as "wall"
-    for r in range(rows):
-        for c in range(cols):
-            if r == 0 or r == rows - 1 or c == 0 or c == cols - 1:
-                x1 = offset_x + c * cell_size
-                y1 = offset_y + r * cell_size
-                x2 = x1 + cell_size
-                y2 = y1 + cell_size
-                draw.rectangle([x1, y1, x2, y2], fill=COLOR_WALL, outline=COLOR_GRID)
-                cell_labels[r][c] = "wall"
-    
-    # Fill the interior cells (if any) with white (they remain unlabeled)
-    for r in range(1, rows - 1):
-        for c in range(1, cols - 1):
-            x1 = offset_x + c * cell_size
-            y1 = offset_y + r * cell_size
-            x2 = x1 + cell_size
-            y2 = y1 + cell_size
-            draw.rectangle([x1, y1, x2, y2], fill=COLOR_INTERIOR, outline=COLOR_GRID)
-    
-    # 2) Helper function: given a DoorWindow, compute the grid cells it should occupy.
-    def get_cells_for_dw(dw: DoorWindow) -> List[tuple]:
-        cells = []
-        wall = dw.wall.lower()
-        door_width = int(round(dw.width))
-        door_height = 1
-        
-        # For north and south walls, the wall length is the number of columns.
-        if wall in ["north", "south"]:
-            total_cells = cols  # total cells along the wall
-            center = int(round(dw.position * (total_cells - 1)))
-            start = center - door_width // 2
-            end = start + door_width
-            if wall == "north":
-                for c in range(start, end):
-                    for h in range(door_height):
-                        r = 0 + h  # extends downward from the top wall
-                        if 0 <= c < cols and 0 <= r < rows:
-                            cells.append((r, c))
-            elif wall == "south":
-                for c in range(start, end):
-                    for h in range(door_height):
-                        r = rows - 1 - h  # extends upward from the bottom wall
-                        if 0 <= c < cols and 0 <= r < rows:
-                            cells.append((r, c))
-        # For east and west walls, the wall length is the number of rows.
-        elif wall in ["east", "west"]:
-            total_cells = rows  # total cells along the wall
-            center = int(round(dw.position * (total_cells - 1)))
-            start = center - door_width // 2
-            end = start + door_width
-            if wall == "west":
-                for r in range(start, end):
-                    for h in range(door_height):
-                        c = 0 + h  # extends rightward from the left wall
-                        if 0 <= c < cols and 0 <= r < rows:
-                            cells.append((r, c))
-            elif wall == "east":
-                for r in range(start, end):
-                    for h in range(door_height):
-                        c = cols - 1 - h  # extends leftward from the right wall
-                        if 0 <= c < cols and 0 <= r < rows:
-                            cells.append((r, c))
-        return cells
-
-    # 3) Draw door/window cells in red and label them accordingly.
-    def apply_door_window(dw: DoorWindow, label: str):
-        for (r, c) in get_cells_for_dw(dw):
-            x1 = offset_x + c * cell_size
-            y1 = offset_y + r * cell_size
-            x2 = x1 + cell_size
-            y2 = y1 + cell_size
-            draw.rectangle([x1, y1, x2, y2], fill=COLOR_DOOR_WINDOW, outline=COLOR_GRID)
-            cell_labels[r][c] = label
 
-    for door in room_spec.doors:
-        apply_door_window(door, "door")
-    
-    for window in room_spec.windows:
-        apply_door_window(window, "window")
-    
-    # 4) Draw grid lines over the entire grid area.
-    for r in range(rows + 1):
-        start = (offset_x, offset_y + r * cell_size)
-        end = (offset_x + cols * cell_size, offset_y + r * cell_size)
-        draw.line([start, end], fill=COLOR_GRID)
-    for c in range(cols + 1):
-        start = (offset_x + c * cell_size, offset_y)
-        end = (offset_x + c * cell_size, offset_y + rows * cell_size)
-        draw.line([start, end], fill=COLOR_GRID)
-    
-    # 5) Draw labels in the center of each cell.
-    try:
-        # Attempt to use a truetype font (Arial) if available.
-        font = ImageFont.truetype("arial.ttf", size=14)
-    except IOError:
-        font = ImageFont.load_default()
-    
-    for r in range(rows):
-        for c in range(cols):
-            text = cell_labels[r][c]
-            if text:
-                center_x = offset_x + c * cell_size + cell_size / 2
-                center_y = offset_y + r * cell_size + cell_size / 2
-                # Use textbbox to compute the text size.
-                bbox = draw.textbbox((0, 0), text, font=font)
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
-                text_color = (255, 255, 255) if text == "wall" else (0, 0, 0)
-                draw.text((center_x - text_width / 2, center_y - text_height / 2),
-                          text, font=font, fill=text_color)
-    
-    # For x axis (columns):
-    for c in range(cols):
-        index_text = str(c)
-        # Compute text dimensions
-        bbox = draw.textbbox((0, 0), index_text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        # Center the text in the top margin for this column.
-        center_x = offset_x + c * cell_size + cell_size / 2
-        # Place the text in the middle of the top margin.
-        x_text = center_x - text_width / 2
-        y_text = (margin - text_height) / 2
-        draw.text((x_text, y_text), index_text, font=font, fill=COLOR_GRID)
-    
-    # For y axis (rows):
-    for r in range(rows):
-        index_text = str(r)
-        bbox = draw.textbbox((0, 0), index_text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        # Center the text in the left margin for this row.
-        center_y = offset_y + r * cell_size + cell_size / 2
-        x_text = (margin - text_width) / 2
-        y_text = center_y - text_height / 2
-        draw.text((x_text, y_text), index_text, font=font, fill=COLOR_GRID)
-
-    # Save to BytesIO instead of file
-    img_io = BytesIO()
-    image.save(img_io, format='PNG')
-    img_io.seek(0)
-    return img_io
+    return grid_key(rows, cols,
+                    [(door.wall, door.position, door.width) for door in room_spec.doors],
+                    [(window.wall, window.position, window.width) for window in room_spec.windows])
 
 @app.post("/retrieve-items", response_model=List[SimilarItem])
-async def retrieve_items(query: RetrievalQuery):
+async def retrieve_items(query: RetrievalQuery, response: Response):
     try:
+        timer = StageTimer()
         # Get results using the query object
-        results = await retrieval_system.retrieve_with_query_object(
-            query.query_object.dict(),
-            k=query.k
-        )
-        
+        with timer.stage("retrieve"):
+            results = await retrieval_system.retrieve_with_query_object(
+                query.query_object.dict(),
+                k=query.k
+            )
+        response.headers["Server-Timing"] = timer.server_timing()
+
         return results
         
     except RateLimitError as e:
@@ -301,72 +162,79 @@ async def retrieve_items(query: RetrievalQuery):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/generate-design", response_model=DesignResponse)
-async def generate_design(room_spec: RoomSpec):
-    try:
-        # Convert room dimensions to grid dimensions (1 foot = 1 cell)
-        num_rows = int(room_spec.width)
-        num_cols = int(room_spec.length)
-        
-        # Create the room image with constraints
-        img_io = create_room_grid_image(room_spec)
+def prepare_design(room_spec: RoomSpec):
+    """
+    The cache key of the design of `room_spec` and the coroutine function that designs it,
+    recording its stages in the given timer and passing the wall color and every placed item to
+    `publish` as soon as they are known.
+    """
+    # Convert room dimensions to grid dimensions (1 foot = 1 cell)
+    num_rows = int(room_spec.width)
+    num_cols = int(room_spec.length)
+    
+    # Convert door and window positions to grid constraints
+    constraints = []
+    
+    # Convert doors to constraints
+    for door in room_spec.doors:
+        wall = door.wall
+        position = door.position
+        width = door.width
         
-        # Convert door and window positions to grid constraints
-        constraints = []
+        # Convert wall position to grid coordinates
+        if wall == 'north':
+            start = (0, int(position * num_cols - width/2))
+            end = (0, min(num_cols - 1, int((position + width/room_spec.length) * num_cols - width/2)))
+        elif wall == 'south':
+            start = (num_rows - 1, int(position * num_cols - width/2))
+            end = (num_rows - 1, min(num_cols - 1, int((position + width/room_spec.length) * num_cols - width/2)))
+        elif wall == 'east':
+            start = (int(position * num_rows - width/2), num_cols - 1)
+            end = (min(num_rows - 1, int((position + width/room_spec.width) * num_rows - width/2)), num_cols - 1)
+        else:  # west
+            start = (int(position * num_rows - width/2), 0)
+            end = (min(num_rows - 1, int((position + width/room_spec.width) * num_rows - width/2)), 0)
         
-        # Convert doors to constraints
-        for door in room_spec.doors:
-            wall = door.wall
-            position = door.position
-            width = door.width
-            
-            # Convert wall position to grid coordinates
-            if wall == 'north':
-                start = (0, int(position * num_cols - width/2))
-                end = (0, min(num_cols - 1, int((position + width/room_spec.length) * num_cols - width/2)))
-            elif wall == 'south':
-                start = (num_rows - 1, int(position * num_cols - width/2))
-                end = (num_rows - 1, min(num_cols - 1, int((position + width/room_spec.length) * num_cols - width/2)))
-            elif wall == 'east':
-                start = (int(position * num_rows - width/2), num_cols - 1)
-                end = (min(num_rows - 1, int((position + width/room_spec.width) * num_rows - width/2)), num_cols - 1)
-            else:  # west
-                start = (int(position * num_rows - width/2), 0)
-                end = (min(num_rows - 1, int((position + width/room_spec.width) * num_rows - width/2)), 0)
-            
-            constraints.append({
-                "object": "Door",
-                "start": start,
-                "end": end
-            })
+        constraints.append({
+            "object": "Door",
+            "start": start,
+            "end": end
+        })
+    
+    # Convert windows to constraints
+    for window in room_spec.windows:
+        wall = window.wall
+        position = window.position
+        width = window.width
         
-        # Convert windows to constraints
-        for window in room_spec.windows:
-            wall = window.wall
-            position = window.position
-            width = window.width
-            
-            if wall == 'north':
-                start = (0, int(position * num_cols - width/2))
-                end = (0, min(num_cols - 1, int((position + width/room_spec.length) * num_cols - width/2)))
-            elif wall == 'south':
-                start = (num_rows - 1, int(position * num_cols - width/2))
-                end = (num_rows - 1, min(num_cols - 1, int((position + width/room_spec.length) * num_cols - width/2)))
-            elif wall == 'east':
-                start = (int(position * num_rows - width/2), num_cols - 1)
-                end = (min(num_rows - 1, int((position + width/room_spec.width) * num_rows - width/2)), num_cols - 1)
-            else:  # west
-                start = (int(position * num_rows - width/2), 0)
-                end = (min(num_rows - 1, int((position + width/room_spec.width) * num_rows - width/2)), 0)
-            
-            constraints.append({
-                "object": "Window",
-                "start": start,
-                "end": end
-            })
+        if wall == 'north':
+            start = (0, int(position * num_cols - width/2))
+            end = (0, min(num_cols - 1, int((position + width/room_spec.length) * num_cols - width/2)))
+        elif wall == 'south':
+            start = (num_rows - 1, int(position * num_cols - width/2))
+            end = (num_rows - 1, min(num_cols - 1, int((position + width/room_spec.length) * num_cols - width/2)))
+        elif wall == 'east':
+            start = (int(position * num_rows - width/2), num_cols - 1)
+            end = (min(num_rows - 1, int((position + width/room_spec.width) * num_rows - width/2)), num_cols - 1)
+        else:  # west
+            start = (int(position * num_rows - width/2), 0)
+            end = (min(num_rows - 1, int((position + width/room_spec.width) * num_rows - width/2)), 0)
         
+        constraints.append({
+            "object": "Window",
+            "start": start,
+            "end": end
+        })
+    
+    requirement = f"{room_spec.style} {room_spec.roomType}"
+    design_id = design_cache_key((num_rows, num_cols), room_grid_key(room_spec), constraints, requirement)
+
+    async def run_designer(timer: StageTimer, publish: Callable[[dict], None] = lambda event: None):
+        # Create the room image with constraints
+        with timer.stage("grid"):
+            img_io = create_room_grid_image(room_spec)
+
         # Initialize and run the designer
-        requirement = f"{room_spec.style} {room_spec.roomType}"
         designer = Designer(
             room_dimensions=(num_rows, num_cols),
             scene_image=img_io,
@@ -374,23 +242,212 @@ async def generate_design(room_spec: RoomSpec):
             requirement=requirement,
             verbose=True
         )
-        
-        wall_color, items = await designer.run_with_style()
-        
-        return {"items": items, "wallColor": wall_color}
 
+        try:
+            async for event in designer.stream():
+                if event["type"] == "design":
+                    wall_color, items = event["wallColor"], event["items"]
+                else:
+                    publish(event)
+        finally:
+            timer.merge(designer.timer)
+        with timer.stage("serialize"):
+            render = base64.b64encode(designer.final_image.getvalue()).decode("ascii")
+        return {"items": items, "wallColor": wall_color, "render": render}
+
+    return design_id, run_designer
+
+async def submit_design(room_spec: RoomSpec, refresh: bool = False, pin: bool = False) -> Job:
+    """
+    Queue the design of `room_spec`, join the queued or running design of an identical room, or
+    return a finished job for a cached design. `refresh` bypasses the cached design and stores
+    the newly generated one in its place, `pin` keeps the design running when no request watches
+    it. Raises QueueFullError when the queue is at capacity.
+    """
+    design_id, run_designer = prepare_design(room_spec)
+    if not refresh:
+        start = time.perf_counter()
+        design = await design_cache.get_async(design_id)
+        if design is not None:
+            job = design_jobs.completed(design_id, design_result(design_id, design), design_events(design))
+            job.timer.add("cache", time.perf_counter() - start)
+            return job
+
+    async def work(job: Job):
+        design = await run_designer(job.timer, job.publish)
+        await design_cache.set_async(design_id, design)
+        print("Design cache:", design_cache.stats())
+        return design_result(design_id, design)
+
+    return design_jobs.submit(work, key=design_id, pin=pin)
+
+def design_result(design_id: str, design: dict) -> dict:
+    return {"items": design["items"], "wallColor": design["wallColor"], "designId": design_id}
+
+def design_events(design: dict) -> List[dict]:
+    """The events a cached design would have streamed while it was generated"""
+    total = len(design["items"])
+    return ([{"type": "wallColor", "wallColor": design["wallColor"], "total": total}] +
+            [{"type": "item", "item": item, "index": index, "total": total} for index, item in enumerate(design["items"])])
+
+@asynccontextmanager
+async def watching(request: Request, job: Job):
+    """
+    Keeps `job` attached to `request` until the block exits or the client disconnects. Jobs are
+    cancelled once no request watches them, so LLM calls for a closed tab stop going out.
+    """
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            design_jobs.release(job)
+
+    async def watch():
+        while not job.is_finished:
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+            if await request.is_disconnected():
+                print(f"Client disconnected from design job {job.id}")
+                release()
+                return
+
+    design_jobs.attach(job)
+    watcher = asyncio.create_task(watch())
+    try:
+        yield
+    finally:
+        watcher.cancel()
+        release()
+
+def job_stream(request: Request, job: Job, format: str = "ndjson") -> StreamingResponse:
+    """
+    Every event of `job` as Server-Sent Events or newline-delimited JSON, ending with a `result`
+    event holding the final job state. Events already published are replayed first.
+    """
+    async def events():
+        async with watching(request, job):
+            async for event in job.follow():
+                yield event
+        yield {"type": "result", **job.to_dict()}
+
+    async def encode():
+        async for event in events():
+            if format == "sse":
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            else:
+                yield json.dumps(event) + "\n"
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    # Proxies must pass every event on as soon as it is written
+    return StreamingResponse(encode(), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def queue_full(e: QueueFullError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+@app.post("/generate-design", response_model=DesignResponse)
+async def generate_design(room_spec: RoomSpec, request: Request, response: Response, refresh: bool = False):
+    """
+    Designs the room and waits for the result, see submit_design. The Server-Timing header
+    reports the wall time of every stage, including the wait for a design worker.
+    """
+    try:
+        job = await submit_design(room_spec, refresh)
+        async with watching(request, job):
+            design = await job.wait()
+        if job.status == CANCELLED:
+            # Nobody is left to read the response
+            raise HTTPException(status_code=499, detail="Design cancelled")
+        if job.error is not None:
+            raise RuntimeError(job.error)
+        response.headers["Server-Timing"] = job.timer.server_timing()
+        return design
+
+    except QueueFullError as e:
+        raise queue_full(e)
+    except HTTPException:
+        raise
     except Exception as e:
         print(e)
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate-design/stream")
+async def generate_design_stream(room_spec: RoomSpec, request: Request, refresh: bool = False,
+                                 format: Literal["sse", "ndjson"] = "sse"):
+    """
+    Streaming /generate-design: emits `wallColor` once the room is understood and an `item` event
+    for every piece of furniture as soon as its placement is final, then the `result`.
+    """
+    try:
+        job = await submit_design(room_spec, refresh)
+    except QueueFullError as e:
+        raise queue_full(e)
+    return job_stream(request, job, format)
+
+@app.post("/design-jobs", status_code=202)
+async def submit_design_job(room_spec: RoomSpec, response: Response, refresh: bool = False):
+    """
+    Submits a design and returns its job right away, poll /design-jobs/{jobId} or follow
+    /design-jobs/{jobId}/stream for the result. 429 with Retry-After when the queue is full.
+    The design runs until it finishes or is deleted, whether or not anyone is polling.
+    """
+    try:
+        job = await submit_design(room_spec, refresh, pin=True)
+    except QueueFullError as e:
+        raise queue_full(e)
+    response.headers["Location"] = f"/design-jobs/{job.id}"
+    return job.to_dict()
+
+@app.get("/design-jobs/{job_id}")
+async def design_job(job_id: str):
+    """State of a design job, with the design once it is done"""
+    job = design_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Design job not found or expired")
+    return job.to_dict()
+
+@app.get("/design-jobs/{job_id}/stream")
+async def design_job_stream(job_id: str, request: Request, format: Literal["sse", "ndjson"] = "ndjson"):
+    """Events of a design job as Server-Sent Events or newline-delimited JSON, see job_stream"""
+    job = design_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Design job not found or expired")
+    return job_stream(request, job, format)
+
+@app.delete("/design-jobs/{job_id}")
+async def cancel_design_job(job_id: str):
+    """Cancels a queued or running design job"""
+    job = design_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Design job not found or expired")
+    design_jobs.cancel(job)
+    return job.to_dict()
+
+@app.get("/metrics")
+async def metrics():
+    """Queue depths and throughput of the shared LLM client and the design workers, and hit rates of the result caches"""
+    return {"llm": llm_client().metrics(),
+            "design_jobs": design_jobs.metrics(),
+            "assets": asset_cache().metrics(),
+            "caches": {"designs": design_cache.stats(), "query_rewrites": rewrite_cache.stats()}}
+
+@app.get("/design-render/{design_id}")
+async def design_render(design_id: str):
+    """PNG of the final layout of a design returned by /generate-design"""
+    design = await design_cache.get_async(design_id)
+    if design is None:
+        raise HTTPException(status_code=404, detail="Design not found")
+    return Response(content=base64.b64decode(design["render"]), media_type="image/png")
+
 @app.post("/get-similar-items", response_model=List[SimilarItem])
-async def get_similar_items(item_id: str, liked_items: List[str], disliked_items: List[str]):
+async def get_similar_items(item_id: str, liked_items: List[str], disliked_items: List[str], session_id: str | None = None):
     """
     Get similar items from the database.
     """
     try:
-        items = await retriever.get_similar_items(item_id, liked_items, disliked_items)
+        items = await retriever.get_similar_items(item_id, liked_items, disliked_items, session_id)
         print("get-similar-items", items)
         return [item for item in items if item["item_id"] != item_id]
     except Exception as e:
@@ -399,9 +456,11 @@ async def get_similar_items(item_id: str, liked_items: List[str], disliked_items
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/get-similar-items-with-scene", response_model=List[SimilarItem])
-async def get_similar_items_with_scene(item_id: str, liked_items: List[str], disliked_items: List[str], scene_items: List[str]):
+async def get_similar_items_with_scene(item_id: str, liked_items: List[str], disliked_items: List[str], scene_items: List[str],
+                                       session_id: str | None = None):
     try:
-        items = await retriever.get_similar_items_with_scene(item_id, liked_items, disliked_items, scene_items, retrieval_system.index)
+        items = await retriever.get_similar_items_with_scene(item_id, liked_items, disliked_items, scene_items, retrieval_system.index,
+                                                             session_id=session_id)
         print("get-similar-items-with-scene", items)
         return [item for item in items if item["item_id"] != item_id]
     except Exception as e:
@@ -410,9 +469,11 @@ async def get_similar_items_with_scene(item_id: str, liked_items: List[str], dis
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/scene-goes-with-it", response_model=List[List[SimilarItem]])
-async def goes_with_it(item_id: str, liked_items: List[str], disliked_items: List[str], scene_items: List[str]):
+async def goes_with_it(item_id: str, liked_items: List[str], disliked_items: List[str], scene_items: List[str],
+                       candidates_per_slot: int = 3, beam_width: int = 32):
     try:
-        items = await retriever.goes_with_it(item_id, liked_items, disliked_items, scene_items)
+        items = await retriever.goes_with_it(item_id, liked_items, disliked_items, scene_items,
+                                             candidates_per_slot=candidates_per_slot, beam_width=beam_width)
         print("goes-with-it", items)
         return items
     except Exception as e:
@@ -421,36 +482,60 @@ async def goes_with_it(item_id: str, liked_items: List[str], disliked_items: Lis
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/s3-proxy/{item_id}")
-async def s3_proxy(item_id: str):
+async def s3_proxy(item_id: str, request: Request):
     """
-    Proxy endpoint to fetch 3D models from S3 bucket and handle CORS.
+    Serves the 3D model of an item from the local asset cache, fetching it from ASSET_ORIGIN on a
+    miss. Responses carry a strong ETag and Cache-Control, answer If-None-Match with 304 and a
+    single byte range with 206, and are streamed from disk.
     """
-    s3_url = f"https://interior-data.s3.amazonaws.com/{item_id}.glb"
     try:
-        response = await asyncio.to_thread(requests.get, s3_url)
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail="Failed to fetch model from S3")
-        
-        # Return the content with appropriate headers
-        return Response(
-            content=response.content,
-            media_type="model/gltf-binary",
-            headers={
-                "Content-Disposition": f"attachment; filename={item_id}.glb"
-            }
-        )
+        asset = await asset_cache().get(f"{item_id}.glb")
+    except AssetNotFoundError:
+        raise HTTPException(status_code=404, detail="Model not found")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching model: {str(e)}")
+        print(f"Error fetching model {item_id}: {e}")
+        raise HTTPException(status_code=502, detail=f"Error fetching model: {str(e)}")
+
+    headers = {
+        "ETag": f'"{asset.etag}"',
+        "Cache-Control": f"public, max-age={ASSET_MAX_AGE}",
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename={item_id}.glb",
+    }
+    if etag_matches(request.headers.get("if-none-match"), asset.etag):
+        asset.close()
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    # A stale If-Range means the client's partial copy is outdated, send it the whole asset
+    if request.headers.get("if-range", f'"{asset.etag}"') == f'"{asset.etag}"':
+        try:
+            byte_range = parse_range(request.headers.get("range"), asset.size)
+        except ValueError:
+            asset.close()
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{asset.size}"})
+
+    if byte_range is None:
+        headers["Content-Length"] = str(asset.size)
+        return StreamingResponse(asset.chunks(), media_type="model/gltf-binary", headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{asset.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(asset.chunks(start, end), status_code=206, media_type="model/gltf-binary",
+                             headers=headers)
 
 @app.post("/retrieve-items-image-rnk", response_model=List[SimilarItem])
-async def retrieve_items_image(query: ImageRetrievalQuery):
+async def retrieve_items_image(query: ImageRetrievalQuery, response: Response):
     try:
+        timer = StageTimer()
         # Get results using the query object
-        results = await image_retrieval_system.retrieve_with_query_object(
-            query.query_object.dict(),
-            k=query.k
-        )
-        
+        with timer.stage("retrieve"):
+            results = await image_retrieval_system.retrieve_with_query_object(
+                query.query_object.dict(),
+                k=query.k
+            )
+        response.headers["Server-Timing"] = timer.server_timing()
+
         return results
         
     except RateLimitError as e:
@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+# Where the .glb assets come from: an http(s) base URL, or a local directory standing in for it
+ASSET_ORIGIN = os.environ.get("ASSET_ORIGIN", "https://interior-data.s3.amazonaws.com")
+ASSET_CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", os.path.join(".cache", "assets"))
+ASSET_CACHE_MAX_MB = float(os.environ.get("ASSET_CACHE_MAX_MB", "2048"))
+# max-age browsers may reuse an asset for without revalidating it
+ASSET_MAX_AGE = int(os.environ.get("ASSET_MAX_AGE", "86400"))
+ASSET_CHUNK_SIZE = 256 * 1024
+
+
+class AssetNotFoundError(Exception):
+    pass
+
+
+class Asset:
+    """A cached asset file and its strong ETag (the sha256 of its content)"""
+
+    def __init__(self, name: str, path: str, etag: str, size: int):
+        self.name = name
+        self.path = path
+        self.etag = etag
+        self.size = size
+
+
+class OpenAsset:
+    """
+    A cached asset opened for one response. The file was opened while the asset was still in the
+    cache, so the handle keeps its content readable even if the entry is evicted meanwhile.
+    """
+
+    def __init__(self, asset: Asset, file):
+        self.name = asset.name
+        self.etag = asset.etag
+        self.size = asset.size
+        self.file = file
+
+    async def chunks(self, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Bytes `start` to `end` inclusive, read from disk one chunk at a time, then closes the file"""
+        end = self.size - 1 if end is None else end
+        with self.file:
+            self.file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(self.file.read, min(ASSET_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def close(self):
+        """Release the file of a response that sends no content"""
+        self.file.close()
+
+
+class HTTPOrigin:
+    """Assets under a base URL, fetched over a pooled HTTP client"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+                                        timeout=httpx.Timeout(60.0, connect=10.0))
+
+    async def fetch(self, name: str, file) -> None:
+        """Stream the asset into `file`, written in a worker thread"""
+        async with self.client.stream("GET", f"{self.base_url}/{name}") as response:
+            # S3 answers 403 for keys that do not exist
+            if response.status_code in (403, 404):
+                raise AssetNotFoundError(name)
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(ASSET_CHUNK_SIZE):
+                await asyncio.to_thread(file.write, chunk)
+
+
+class DirectoryOrigin:
+    """Assets in a local directory"""
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+
+    async def fetch(self, name: str, file) -> None:
+        path = os.path.realpath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            raise AssetNotFoundError(name)
+
+        def copy():
+            with open(path, "rb") as source:
+                shutil.copyfileobj(source, file, ASSET_CHUNK_SIZE)
+
+        await asyncio.to_thread(copy)
+
+
+def make_origin(origin: str):
+    if origin.startswith(("http://", "https://")):
+        return HTTPOrigin(origin)
+    return DirectoryOrigin(origin[len("file://"):] if origin.startswith("file://") else origin)
+
+
+class _HashingWriter:
+    def __init__(self, file):
+        self.file = file
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self.file.write(chunk)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+
+
+class AssetCache:
+    """
+    Disk cache of origin assets bounded to `max_bytes`, evicting the least recently used files.
+    A miss streams the asset from the origin into a temporary file that is renamed into place
+    once complete, and concurrent misses for the same asset share one download. Entries survive
+    restarts: the index is rebuilt from the cache directory, whose file names hold each asset's
+    key and ETag, ordered by last use.
+    """
+
+    def __init__(self, origin: str = ASSET_ORIGIN, path: str = ASSET_CACHE_DIR,
+                 max_bytes: int = int(ASSET_CACHE_MAX_MB * 1024 * 1024)):
+        self.origin = make_origin(origin)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Asset]" = OrderedDict()
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        self._downloads: Dict[str, asyncio.Task] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "origin_bytes": 0}
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def _key(name: str) -> str:
+        return hashlib.sha256(name.encode("utf-8")).hexdigest()[:32]
+
+    def _load(self):
+        files = []
+        for file in os.listdir(self.path):
+            key, _, etag = file.partition(".")
+            if len(key) == 32 and etag:
+                full_path = os.path.join(self.path, file)
+                stat = os.stat(full_path)
+                files.append((stat.st_mtime, key, Asset(None, full_path, etag, stat.st_size)))
+            elif file.endswith(".part"):
+                os.remove(os.path.join(self.path, file))
+        for _, key, asset in sorted(files, key=lambda entry: entry[0]):
+            self.entries[key] = asset
+            self.total_bytes += asset.size
+        self._evict()
+
+    async def get(self, name: str) -> OpenAsset:
+        """The cached asset `name` opened for reading, downloaded from the origin on a miss"""
+        key = self._key(name)
+        opened = self._open(key)
+        if opened is not None:
+            self.stats["hits"] += 1
+            return opened
+
+        while True:
+            # Concurrent misses share one download, which finishes even if the client that started it leaves
+            download = self._downloads.get(key)
+            if download is None:
+                download = asyncio.create_task(self._download(name, key))
+                self._downloads[key] = download
+                download.add_done_callback(lambda _: self._downloads.pop(key, None))
+            await asyncio.shield(download)
+            # Evicted again by other downloads before it could be opened, fetch it once more
+            opened = self._open(key)
+            if opened is not None:
+                return opened
+
+    def _open(self, key: str) -> Optional[OpenAsset]:
+        # Opened under the lock, so eviction cannot remove the file between lookup and open
+        with self._lock:
+            asset = self.entries.get(key)
+            if asset is None:
+                return None
+            try:
+                file = open(asset.path, "rb")
+            except FileNotFoundError:
+                return None
+            self.entries.move_to_end(key)
+            # File times record recency across restarts
+            os.utime(asset.path, (time.time(), time.time()))
+        return OpenAsset(asset, file)
+
+    async def _download(self, name: str, key: str) -> Asset:
+        self.stats["misses"] += 1
+        file = tempfile.NamedTemporaryFile(dir=self.path, suffix=".part", delete=False)
+        try:
+            with file:
+                writer = _HashingWriter(file)
+                await self.origin.fetch(name, writer)
+            etag = writer.digest.hexdigest()[:32]
+            path = os.path.join(self.path, f"{key}.{etag}")
+            os.replace(file.name, path)
+        except BaseException:
+            os.remove(file.name)
+            raise
+
+        asset = Asset(name, path, etag, writer.size)
+        with self._lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous.size
+                if previous.path != path and os.path.exists(previous.path):
+                    os.remove(previous.path)
+            self.entries[key] = asset
+            self.total_bytes += asset.size
+            self.stats["origin_bytes"] += asset.size
+            self._evict()
+        return asset
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            _, asset = self.entries.popitem(last=False)
+            self.total_bytes -= asset.size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(asset.path)
+            except FileNotFoundError:
+                pass
+
+    def metrics(self) -> dict:
+        return {"entries": len(self.entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes, **self.stats}
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end) inclusive of a single `bytes=` range, None to serve the whole asset (no header,
+    several ranges or another unit). Raises ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start:
+            start, end = int(start), int(end) if end else size - 1
+        else:
+            # Suffix range: the last `end` bytes
+            start, end = max(0, size - int(end)), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches the strong ETag `etag`"""
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    # Weak comparison, as If-None-Match requires
+    return "*" in tags or any(tag.removeprefix("W/") == f'"{etag}"' for tag in tags)
+
+
+_asset_cache: Optional[AssetCache] = None
+
+
+def asset_cache() -> AssetCache:
+    """Process-wide asset cache behind /s3-proxy"""
+    global _asset_cache
+    if _asset_cache is None:
+        _asset_cache = AssetCache()
+    return _asset_cache
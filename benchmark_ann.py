@@ -0,0 +1,113 @@
+import argparse
+import time
+from typing import List
+
+import faiss
+import numpy as np
+
+from ann_index import INDEX_TYPES, build_index, configure_index
+
+
+def load_embeddings(args) -> np.ndarray:
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        # Clustered data behaves much more like real catalog embeddings than uniform noise
+        centers = rng.normal(size=(max(1, args.synthetic // 100), args.dimension)).astype(np.float32)
+        labels = rng.integers(0, len(centers), size=args.synthetic)
+        return centers[labels] + 0.3 * rng.normal(size=(args.synthetic, args.dimension)).astype(np.float32)
+
+    embeddings = np.load(args.embeddings_file).astype(np.float32)
+    if args.replicate > 1:
+        # Simulate a larger catalog by jittering copies of the real embeddings
+        rng = np.random.default_rng(args.seed)
+        scale = 0.05 * embeddings.std()
+        copies = [embeddings] + [embeddings + scale * rng.normal(size=embeddings.shape).astype(np.float32)
+                                 for _ in range(args.replicate - 1)]
+        embeddings = np.concatenate(copies)
+    return embeddings
+
+
+def make_queries(embeddings: np.ndarray, num_queries: int, seed: int) -> np.ndarray:
+    """Perturbed catalog rows, so queries are realistic but never exact matches"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)
+    noise = 0.1 * embeddings.std() * rng.normal(size=(len(rows), embeddings.shape[1]))
+    return (embeddings[rows] + noise).astype(np.float32)
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int):
+    """Search one query at a time, as the API does, and return the results and per-query latencies in ms"""
+    results = np.zeros((len(queries), k), dtype=np.int64)
+    latencies = np.zeros(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, indices = index.search(query.reshape(1, -1), k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+        results[i] = indices[0]
+    return results, latencies
+
+
+def recall_at_k(results: np.ndarray, ground_truth: np.ndarray) -> float:
+    hits = sum(len(set(found[found >= 0]) & set(truth)) for found, truth in zip(results, ground_truth))
+    return hits / ground_truth.size
+
+
+def parse_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and latency of the ANN index types against the flat index')
+    parser.add_argument('--embeddings_file', type=str, default='embeddings.npy',
+                        help='Path to the embeddings numpy file')
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='Benchmark on this many synthetic vectors instead of the embeddings file')
+    parser.add_argument('--dimension', type=int, default=384,
+                        help='Dimension of the synthetic vectors')
+    parser.add_argument('--replicate', type=int, default=1,
+                        help='Grow the real catalog by this factor with jittered copies')
+    parser.add_argument('--types', type=str, default=",".join(INDEX_TYPES),
+                        help='Comma separated index types to benchmark')
+    parser.add_argument('--nprobe', type=str, default='1,4,16,64',
+                        help='Comma separated nprobe values for IVF indexes')
+    parser.add_argument('--ef_search', type=str, default='16,64,256',
+                        help='Comma separated efSearch values for HNSW')
+    parser.add_argument('--queries', type=int, default=500,
+                        help='Number of queries')
+    parser.add_argument('--k', type=int, default=10,
+                        help='Number of neighbors per query')
+    parser.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+    embeddings = load_embeddings(args)
+    queries = make_queries(embeddings, args.queries, args.seed)
+    print(f"Benchmarking on {embeddings.shape[0]} vectors of dimension {embeddings.shape[1]}, "
+          f"{len(queries)} queries, k={args.k}")
+
+    flat = build_index(embeddings, "flat")
+    ground_truth, _ = measure(flat, queries, args.k)
+
+    print(f"{'index':<10} {'setting':<14} {'build s':>8} {'size MB':>8} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for index_type in args.types.split(","):
+        start = time.perf_counter()
+        index = build_index(embeddings, index_type)
+        build_time = time.perf_counter() - start
+        size = faiss.serialize_index(index).nbytes / 1e6
+
+        if index_type in ("ivf_flat", "ivf_pq"):
+            settings = [("nprobe", value, dict(nprobe=value)) for value in parse_list(args.nprobe)]
+        elif index_type == "hnsw":
+            settings = [("efSearch", value, dict(ef_search=value)) for value in parse_list(args.ef_search)]
+        else:
+            settings = [("exact", "", {})]
+
+        for name, value, options in settings:
+            configure_index(index, **options)
+            results, latencies = measure(index, queries, args.k)
+            print(f"{index_type:<10} {f'{name}={value}' if value != '' else name:<14} {build_time:>8.2f} {size:>8.1f} "
+                  f"{recall_at_k(results, ground_truth):>9.3f} {np.percentile(latencies, 50):>8.3f} "
+                  f"{np.percentile(latencies, 99):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
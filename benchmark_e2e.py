@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+import numpy as np
+
+from ann_index import build_index, configure_index
+from catalog import CATALOG_DIR, CATALOG_SOURCE, build_catalog
+
+STYLES = "modern,minimal,mid-century"
+ROOM_TYPES = "bedroom,livingRoom"
+ROOM_SIZES = "10x12,16x20,30x30"
+# Server-Timing stages reported per endpoint, in pipeline order
+DESIGN_STAGES = ("grid", "understand", "retrieve", "wait_retrieve", "place", "solve", "critic", "render", "serialize")
+QUERIES = ("a comfortable grey fabric sofa", "a solid oak dining table", "a modern floor lamp with a linen shade",
+           "a velvet armchair with wooden legs", "a low white tv stand")
+
+
+def parse_list(value: str) -> List[str]:
+    return [item for item in value.split(",") if item]
+
+
+def room_spec(size: str, style: str, room_type: str) -> dict:
+    length, width = (float(side) for side in size.split("x"))
+    return {"length": length, "width": width, "roomType": room_type, "style": style,
+            "doors": [{"wall": "south", "position": 0.3, "width": 3, "height": 7}],
+            "windows": [{"wall": "north", "position": 0.5, "width": 4, "height": 4}]}
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """Stage durations in milliseconds from a Server-Timing header"""
+    stages = {}
+    for metric in filter(None, (part.strip() for part in header.split(","))):
+        name, *params = metric.split(";")
+        for param in params:
+            if param.startswith("dur="):
+                stages[name] = float(param[4:])
+    return stages
+
+
+def scaled_catalog(data_file: str, factor: int, work_dir: str, seed: int) -> str:
+    """Catalog store grown `factor` times with jittered copies of every item, built once per factor"""
+    path = os.path.join(work_dir, f"catalog_x{factor}")
+    if os.path.exists(os.path.join(path, "header.json")):
+        return path
+    with open(data_file, "r") as f:
+        data = [item for item in json.load(f) if "item_id" in item and "embedding" in item]
+
+    rng = np.random.default_rng(seed)
+    scale = 0.05 * np.std([item["embedding"] for item in data[:1000]])
+    items = list(data)
+    for copy in range(1, factor):
+        for item in data:
+            embedding = np.asarray(item["embedding"]) + scale * rng.normal(size=len(item["embedding"]))
+            items.append({**item, "item_id": f"{item['item_id']}-x{copy}", "embedding": embedding.tolist()})
+
+    scaled_file = os.path.join(work_dir, f"catalog_x{factor}.json")
+    with open(scaled_file, "w") as f:
+        json.dump(items, f)
+    build_catalog(scaled_file, path)
+    os.remove(scaled_file)
+    return path
+
+
+def grow_retrieval(retrieval, factor: int, seed: int):
+    """
+    Grow the vector and inverse indexes of a retrieval system in place with the same jittered copies
+    scaled_catalog adds, so the retrieval endpoints search a catalog as large as the design one
+    """
+    embeddings = np.asarray(retrieval.embeddings, dtype=np.float32)
+    item_ids = [str(item_id) for item_id in retrieval.item_ids]
+    rng = np.random.default_rng(seed)
+    scale = 0.05 * np.std(embeddings[:1000])
+    copies = range(1, factor)
+    embeddings = np.concatenate([embeddings] + [embeddings + (scale * rng.normal(size=embeddings.shape)).astype(np.float32)
+                                                for _ in copies])
+    item_ids += [f"{item_id}-x{copy}" for copy in copies for item_id in item_ids]
+
+    retrieval.index = {word: ids | {f"{item_id}-x{copy}" for copy in copies for item_id in ids}
+                       for word, ids in retrieval.index.items()}
+    retrieval.embeddings = embeddings
+    retrieval.item_ids = np.array(item_ids)
+    retrieval.row_of = {item_id: row for row, item_id in enumerate(item_ids)}
+    retrieval.faiss_index = build_index(embeddings, retrieval.index_type)
+    configure_index(retrieval.faiss_index, retrieval.nprobe, retrieval.ef_search)
+    retrieval.build_posting_index()
+
+
+def summarize(latencies: List[float], stages: List[Dict[str, float]]) -> dict:
+    names = [name for name in DESIGN_STAGES if any(name in stage for stage in stages)]
+    names += sorted({name for stage in stages for name in stage} - set(names))
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99)),
+            "stages_ms": {name: float(np.mean([stage.get(name, 0.0) for stage in stages])) for name in names}}
+
+
+async def measure(client, method: str, url: str, body: dict, repeats: int) -> dict:
+    """Time `repeats` requests, then repeat one under tracemalloc for the allocation peak"""
+    latencies, stages = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        response = await client.request(method, url, json=body)
+        latencies.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+        stages.append(parse_server_timing(response.headers.get("server-timing", "")))
+
+    tracemalloc.start()
+    try:
+        (await client.request(method, url, json=body)).raise_for_status()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {**summarize(latencies, stages), "peak_alloc_mb": peak / 1e6}
+
+
+async def run_worker(args) -> List[dict]:
+    """Every case of the matrix against an in-process app, on the catalog given by CATALOG_DIR"""
+    import httpx
+    import app as server
+
+    if args.catalog_size > 1:
+        for retrieval in (server.retrieval_system, server.image_retrieval_system):
+            if retrieval.faiss_index is not None:
+                grow_retrieval(retrieval, args.catalog_size, seed=args.catalog_size)
+    results = []
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for size in parse_list(args.sizes):
+            for style in parse_list(args.styles):
+                for room_type in parse_list(args.room_types):
+                    result = await measure(client, "POST", "/generate-design?refresh=true",
+                                           room_spec(size, style, room_type), args.repeats)
+                    results.append({"endpoint": "/generate-design", "case": f"{size} {style} {room_type}", **result})
+
+        item_ids = [str(item_id) for item_id in server.retrieval_system.item_ids[:len(QUERIES)]]
+        for endpoint in ("/retrieve-items", "/retrieve-items-image-rnk"):
+            for item_id, query in zip(item_ids, QUERIES):
+                body = {"query_object": {"selectedItemId": item_id, "user_query": query}, "k": 10}
+                result = await measure(client, "POST", endpoint, body, args.repeats)
+                results.append({"endpoint": endpoint, "case": query, **result})
+        results.append({"endpoint": "/metrics", "llm": server.llm_client().metrics()})
+    return results
+
+
+def print_results(catalog_size: int, results: List[dict]):
+    print(f"\nCatalog x{catalog_size}")
+    print(f"{'endpoint':<26} {'case':<42} {'p50 ms':>9} {'p99 ms':>9} {'peak MB':>8}  stages (mean ms)")
+    for result in results:
+        if "case" not in result:
+            continue
+        stages = ", ".join(f"{name} {ms:.1f}" for name, ms in result["stages_ms"].items())
+        print(f"{result['endpoint']:<26} {result['case'][:42]:<42} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+              f"{result['peak_alloc_mb']:>8.1f}  {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end latency and allocations of the API with an offline LLM backend')
+    parser.add_argument('--sizes', type=str, default=ROOM_SIZES,
+                        help='Comma separated room sizes as <length>x<width> in feet')
+    parser.add_argument('--styles', type=str, default=STYLES,
+                        help='Comma separated design styles')
+    parser.add_argument('--room_types', type=str, default=ROOM_TYPES,
+                        help='Comma separated room types')
+    parser.add_argument('--catalog_sizes', type=str, default='1,4',
+                        help='Comma separated factors to grow the design catalog and the retrieval indexes by, '
+                             '1 uses them as is')
+    parser.add_argument('--data_file', type=str, default=CATALOG_SOURCE,
+                        help='Embedded data JSON file the grown catalogs are built from')
+    parser.add_argument('--work_dir', type=str, default='benchmark_catalogs',
+                        help='Directory the grown catalogs are kept in between runs')
+    parser.add_argument('--backend', type=str, default='synthetic', choices=['synthetic', 'replay'],
+                        help='Offline LLM backend, replay needs fixtures recorded with LLM_BACKEND=record')
+    parser.add_argument('--latency_ms', type=float, default=0,
+                        help='Latency injected into every LLM response, 0 measures the local stages only')
+    parser.add_argument('--jitter_ms', type=float, default=0,
+                        help='Uniform jitter around the injected latency')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='Timed requests per case')
+    parser.add_argument('--output', type=str, default='',
+                        help='Also write the results as JSON to this file')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--catalog_size', type=int, default=1, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.worker:
+        results = asyncio.run(run_worker(args))
+        with open(args.output, "w") as f:
+            json.dump(results, f)
+        return
+
+    # The app opens its catalog at import, so every catalog size runs in a fresh process
+    os.makedirs(args.work_dir, exist_ok=True)
+    all_results = {}
+    for factor in (int(value) for value in parse_list(args.catalog_sizes)):
+        catalog_dir = CATALOG_DIR if factor == 1 else scaled_catalog(args.data_file, factor, args.work_dir, seed=factor)
+        # Every run starts from empty result and embedding caches of its own, so no run is served
+        # rewrites or designs cached by an earlier one and the server's caches are left untouched
+        cache_dir = tempfile.mkdtemp(prefix="benchmark_cache_")
+        env = {**os.environ, "CATALOG_DIR": catalog_dir, "LLM_BACKEND": args.backend,
+               "LLM_REPLAY_LATENCY_MS": str(args.latency_ms), "LLM_REPLAY_JITTER_MS": str(args.jitter_ms),
+               "LLM_REPLAY_MISSING": "synthetic", "CACHE_DIR": cache_dir, "EMBEDDING_CACHE_DIR": "",
+               # Offline responses are free, only the local stages should limit throughput
+               "LLM_RPM": "1000000", "LLM_TPM": "1000000000"}
+        output = os.path.join(cache_dir, "results.json")
+        try:
+            command = [sys.executable, __file__, "--worker", "--output", output, "--catalog_size", str(factor),
+                       "--sizes", args.sizes, "--styles", args.styles, "--room_types", args.room_types,
+                       "--repeats", str(args.repeats)]
+            subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+            with open(output) as f:
+                all_results[factor] = json.load(f)
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        print_results(factor, all_results[factor])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(all_results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
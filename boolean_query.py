@@ -0,0 +1,170 @@
+import re
+from typing import Dict, Iterable, List, Sequence, Set
+
+import numpy as np
+
+OPERATORS = {"AND", "OR", "NOT"}
+
+
+class Term:
+    def __init__(self, words: List[str]):
+        self.words = words
+
+    def __repr__(self):
+        return f"Term({' '.join(self.words)})"
+
+
+class Not:
+    def __init__(self, operand):
+        self.operand = operand
+
+    def __repr__(self):
+        return f"Not({self.operand})"
+
+
+class And:
+    def __init__(self, operands: List):
+        self.operands = operands
+
+    def __repr__(self):
+        return f"And({', '.join(map(repr, self.operands))})"
+
+
+class Or:
+    def __init__(self, operands: List):
+        self.operands = operands
+
+    def __repr__(self):
+        return f"Or({', '.join(map(repr, self.operands))})"
+
+
+def tokenize(query: str) -> List[str]:
+    # Stray punctuation such as quotes or dashes carries no words and is dropped
+    return [token for token in re.findall(r'\(|\)|[^\s()]+', query) if token in "()" or re.search(r'\w', token)]
+
+
+class Parser:
+    """
+    Recursive descent parser for boolean search queries with the usual precedence NOT > AND > OR
+    and nested parentheses:
+
+        query   := and_expr ("OR" and_expr)*
+        and_expr:= not_expr (["AND"] not_expr)*
+        not_expr:= "NOT" not_expr | "(" query ")" | term
+
+    Adjacent terms are implicitly AND-ed, so "chair NOT office" means "chair AND NOT office".
+    Operators are case-insensitive, and each term is split into the same lowercase words the
+    inverse index was built from.
+    """
+
+    def __init__(self, query: str):
+        self.tokens = tokenize(query)
+        self.position = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty boolean query")
+        node = self._parse_or()
+        if self.position < len(self.tokens):
+            raise ValueError(f"Unexpected token {self.tokens[self.position]!r} in boolean query")
+        return node
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        self.position += 1
+        return token
+
+    def _is_operator(self, token, operator: str) -> bool:
+        return token is not None and token.upper() == operator
+
+    def _parse_or(self):
+        operands = [self._parse_and()]
+        while self._is_operator(self._peek(), "OR"):
+            self._next()
+            operands.append(self._parse_and())
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+    def _parse_and(self):
+        operands = [self._parse_not()]
+        while True:
+            token = self._peek()
+            if self._is_operator(token, "AND"):
+                self._next()
+            elif token is None or token == ")" or self._is_operator(token, "OR"):
+                break
+            operands.append(self._parse_not())
+        return operands[0] if len(operands) == 1 else And(operands)
+
+    def _parse_not(self):
+        token = self._next()
+        if token is None:
+            raise ValueError("Boolean query ends with an operator")
+        if self._is_operator(token, "NOT"):
+            return Not(self._parse_not())
+        if token == "(":
+            node = self._parse_or()
+            # Tolerate a missing closing parenthesis at the end of the query
+            if self._peek() is not None:
+                if self._next() != ")":
+                    raise ValueError("Unbalanced parentheses in boolean query")
+            return node
+        if token == ")" or token.upper() in OPERATORS:
+            raise ValueError(f"Unexpected token {token!r} in boolean query")
+        return Term(re.findall(r'\w+', token.lower()))
+
+
+def parse(query: str):
+    """Compile a boolean query string to an AST of Term/Not/And/Or nodes"""
+    return Parser(query).parse()
+
+
+class PostingIndex:
+    """
+    Inverse index compiled to sorted int32 row arrays, one per term, over the rows of a vector index.
+    Queries evaluate to a boolean row mask without touching any shared state, so the same
+    PostingIndex can serve concurrent requests.
+    """
+
+    def __init__(self, index: Dict[str, Set[str]], item_ids: Sequence[str]):
+        self.num_rows = len(item_ids)
+        row_of = {str(item_id): row for row, item_id in enumerate(item_ids)}
+        self.postings: Dict[str, np.ndarray] = {}
+        for term, term_item_ids in index.items():
+            rows = [row_of[item_id] for item_id in term_item_ids if item_id in row_of]
+            if rows:
+                self.postings[term] = np.array(sorted(rows), dtype=np.int32)
+
+    def mask(self, query: str) -> np.ndarray:
+        """Boolean mask of the rows matching `query`"""
+        return self.evaluate(parse(query))
+
+    def evaluate(self, node) -> np.ndarray:
+        if isinstance(node, Term):
+            return self._term_mask(node.words)
+        if isinstance(node, Not):
+            return ~self.evaluate(node.operand)
+        if isinstance(node, And):
+            result = self.evaluate(node.operands[0])
+            for operand in node.operands[1:]:
+                result &= self.evaluate(operand)
+            return result
+        if isinstance(node, Or):
+            result = self.evaluate(node.operands[0])
+            for operand in node.operands[1:]:
+                result |= self.evaluate(operand)
+            return result
+        raise TypeError(f"Unknown boolean query node {node!r}")
+
+    def _term_mask(self, words: Iterable[str]) -> np.ndarray:
+        words = list(words)
+        mask = np.zeros(self.num_rows, dtype=bool)
+        # Start from the rarest word, a term made of several words needs all of them
+        rows = sorted((self.postings.get(word, np.zeros(0, dtype=np.int32)) for word in words), key=len)
+        matching = rows[0]
+        for other in rows[1:]:
+            matching = np.intersect1d(matching, other, assume_unique=True)
+        mask[matching] = True
+        return mask
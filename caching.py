@@ -0,0 +1,299 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+import numpy as np
+
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR")
+# Disk tier of the caches that save LLM calls, empty to keep them in memory only
+CACHE_DIR = os.environ.get("CACHE_DIR", ".cache")
+# Reads record their time at most this often per entry, so cache hits rarely write to disk
+ACCESS_RESOLUTION_SECONDS = 60.0
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a text used as a cache key: NFC unicode with collapsed whitespace"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(*parts) -> str:
+    """Stable digest of JSON-serializable key parts"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory cache bounded to `max_entries`, evicting the least recently used entry"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def set(self, key: Hashable, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default=None):
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class DiskCache:
+    """
+    Persistent key/value store backed by a single SQLite file. Entries older than `ttl_seconds`
+    are treated as missing, and the least recently read entries beyond `max_entries` are pruned,
+    in batches once the store has grown a tenth past the bound. Read times are only kept to within
+    ACCESS_RESOLUTION_SECONDS.
+    """
+
+    def __init__(self, path: str, ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(key TEXT PRIMARY KEY, value BLOB, created_at REAL, accessed_at REAL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed_at)")
+        self._connection.commit()
+        # Upper bound of the entry count, every insert counts as new until the next prune recounts
+        self._count = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created_at, accessed_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._connection.commit()
+                return None
+            if now - row[2] > ACCESS_RESOLUTION_SECONDS:
+                self._connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+                self._connection.commit()
+            return row[0]
+
+    def set(self, key: str, value: bytes):
+        now = time.time()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, value, now, now))
+            self._count += 1
+            if self.max_entries is not None and self._count > self.max_entries + self.max_entries // 10:
+                self._prune()
+            self._connection.commit()
+
+    def _prune(self):
+        self._count = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if self._count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY accessed_at LIMIT ?)", (self._count - self.max_entries,))
+            self._count = self.max_entries
+
+    def delete(self, key: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._connection.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+class EmbeddingCache:
+    """
+    Text to embedding cache placed in front of an encoder. Keys are normalized texts, the memory
+    tier is an LRU and, when `persist_dir` is set, embeddings also survive restarts on disk. Callers
+    get copies, so changing a returned embedding never changes the cached one.
+    """
+
+    def __init__(self, name: str, max_entries: int = 10000, persist_dir: Optional[str] = EMBEDDING_CACHE_DIR):
+        self.name = name
+        self.memory = LRUCache(max_entries)
+        self.disk = DiskCache(os.path.join(persist_dir, f"{name}.sqlite")) if persist_dir else None
+        self.disk_hits = 0
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        embedding = self.get_memory(text)
+        return embedding if embedding is not None else self.get_disk(text)
+
+    def get_memory(self, text: str) -> Optional[np.ndarray]:
+        """The embedding of `text` if the memory tier holds it, never touching the disk"""
+        embedding = self.memory.get(normalize_text(text))
+        return None if embedding is None else embedding.copy()
+
+    def get_disk(self, text: str) -> Optional[np.ndarray]:
+        """The embedding of `text` from the disk tier, for a memory miss; blocking, keep it off the event loop"""
+        if self.disk is None:
+            return None
+        key = normalize_text(text)
+        value = self.disk.get(key)
+        if value is None:
+            return None
+        self.disk_hits += 1
+        embedding = np.frombuffer(value, dtype=np.float32)
+        self.memory.set(key, embedding.copy())
+        return embedding.copy()
+
+    def set(self, text: str, embedding: np.ndarray):
+        key = normalize_text(text)
+        # A copy, the caller may hold views of a whole batch of embeddings
+        embedding = np.array(embedding, dtype=np.float32)
+        self.memory.set(key, embedding)
+        if self.disk is not None:
+            self.disk.set(key, embedding.tobytes())
+
+    def stats(self) -> Dict[str, int]:
+        # Memory misses that were found on disk are hits for the cache as a whole
+        return {"entries": len(self.memory),
+                "hits": self.memory.hits + self.disk_hits,
+                "memory_hits": self.memory.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.memory.misses - self.disk_hits}
+
+
+class SingleFlight:
+    """
+    De-duplicates concurrent calls with the same key: the first caller starts the computation and
+    every caller arriving while it is in flight awaits the same result. The computation runs in a
+    task of its own, so it finishes for the others even when the caller that started it gives up.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.deduplicated = 0
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]):
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self.deduplicated += 1
+        # Shielded so a caller giving up does not cancel the shared computation
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Every caller may have given up, do not warn about unretrieved exceptions
+        task.cancelled() or task.exception()
+
+
+class ResultCache:
+    """
+    Cache for the JSON-serializable results of expensive async computations such as LLM calls:
+    an LRU memory tier, an optional disk tier in `persist_dir` whose entries expire after
+    `ttl_seconds`, and single-flight de-duplication of concurrent misses for the same key. Callers
+    get copies of the cached values, and the async methods touch the disk tier in a worker thread.
+    """
+
+    def __init__(self, name: str, max_entries: int = 1024, persist_dir: Optional[str] = CACHE_DIR,
+                 ttl_seconds: Optional[float] = None, max_disk_entries: Optional[int] = None):
+        self.name = name
+        self.memory = LRUCache(max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.disk = DiskCache(os.path.join(persist_dir, f"{name}.sqlite"), ttl_seconds, max_disk_entries) \
+            if persist_dir else None
+        self.single_flight = SingleFlight()
+        self.disk_hits = 0
+
+    def _get_memory(self, key: str):
+        entry = self.memory.get(key)
+        if entry is not None:
+            created_at, value = entry
+            if self.ttl_seconds is None or time.time() - created_at <= self.ttl_seconds:
+                return copy.deepcopy(value)
+            self.memory.pop(key)
+        return None
+
+    def _get_disk(self, key: str):
+        stored = self.disk.get(key)
+        if stored is None:
+            return None
+        self.disk_hits += 1
+        value = json.loads(stored)
+        self.memory.set(key, (time.time(), value))
+        return copy.deepcopy(value)
+
+    def get(self, key: str):
+        value = self._get_memory(key)
+        if value is None and self.disk is not None:
+            value = self._get_disk(key)
+        return value
+
+    async def get_async(self, key: str):
+        """get() for callers on the event loop, reading the disk tier in a worker thread"""
+        value = self._get_memory(key)
+        if value is None and self.disk is not None:
+            value = await asyncio.to_thread(self._get_disk, key)
+        return value
+
+    def _set_memory(self, key: str, value):
+        self.memory.set(key, (time.time(), copy.deepcopy(value)))
+
+    def set(self, key: str, value):
+        self._set_memory(key, value)
+        if self.disk is not None:
+            self.disk.set(key, json.dumps(value).encode("utf-8"))
+
+    async def set_async(self, key: str, value):
+        """set() for callers on the event loop, writing the disk tier in a worker thread"""
+        self._set_memory(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, json.dumps(value).encode("utf-8"))
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]):
+        value = await self.get_async(key)
+        if value is not None:
+            return value
+
+        async def compute_and_store():
+            result = await compute()
+            await self.set_async(key, result)
+            return result
+
+        # Every caller sharing the computation gets its own copy
+        return copy.deepcopy(await self.single_flight.run(key, compute_and_store))
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self.memory),
+                "hits": self.memory.hits + self.disk_hits,
+                "memory_hits": self.memory.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.memory.misses - self.disk_hits,
+                "deduplicated": self.single_flight.deduplicated}
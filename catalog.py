@@ -0,0 +1,313 @@
+import argparse
+import hashlib
+import json
+import os
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+CATALOG_DIR = os.environ.get("CATALOG_DIR", "catalog")
+CATALOG_SOURCE = "image_embedding_data.json"
+CATALOG_VERSION = 1
+
+# Per-item vectors that go into the dense float32 matrices instead of the metadata columns
+VECTOR_FIELDS = ("embedding", "image_embedding")
+
+
+class Catalog(Mapping):
+    """
+    Read-only view over a catalog store written by `build_catalog`.
+
+    Embeddings are memory-mapped from a contiguous float32 `.npy` file and item metadata
+    is decoded lazily from columnar sidecar files, so opening the catalog costs almost
+    nothing regardless of its size. The catalog behaves like the old `data_map`:
+    `catalog[item_id]` returns the item's metadata as a dict.
+    """
+
+    def __init__(self, path: str = CATALOG_DIR):
+        header_file = os.path.join(path, "header.json")
+        if not os.path.exists(header_file):
+            raise FileNotFoundError(f"Catalog {path} not found, run catalog.py first to build it")
+
+        with open(header_file, "r") as f:
+            self.header = json.load(f)
+        if self.header["version"] != CATALOG_VERSION:
+            raise ValueError(f"Catalog {path} has version {self.header['version']}, expected {CATALOG_VERSION}")
+
+        self.path = path
+        # Copy-on-write mapping: the file is never modified, but torch.from_numpy accepts the array
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="c")
+        self._columns = {name: self._open_column(name, kind) for name, kind in self.header["columns"].items()}
+        self.item_ids: List[str] = self._columns["item_id"].tolist()
+        self.row_of: Dict[str, int] = {item_id: row for row, item_id in enumerate(self.item_ids)}
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Identity of this build of the catalog, for caches of results that refer to its items. Stores
+        built before the header recorded a build hash are identified by their embeddings file.
+        """
+        if "build" in self.header:
+            return self.header["build"]
+        stat = os.stat(os.path.join(self.path, "embeddings.npy"))
+        return f"{self.header['count']}-{stat.st_size}-{stat.st_mtime_ns}"
+
+    def _open_column(self, name: str, kind: str):
+        prefix = os.path.join(self.path, f"col.{name}")
+        if kind in ("str", "json"):
+            return _StringColumn(np.load(f"{prefix}.offsets.npy", mmap_mode="r"),
+                                 np.memmap(f"{prefix}.data.bin", dtype=np.uint8, mode="r")
+                                 if os.path.getsize(f"{prefix}.data.bin") > 0 else np.zeros(0, dtype=np.uint8),
+                                 np.load(f"{prefix}.present.npy", mmap_mode="r"),
+                                 kind == "json")
+        return _NumberColumn(np.load(f"{prefix}.values.npy", mmap_mode="r"),
+                             np.load(f"{prefix}.present.npy", mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.item_ids)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.item_ids)
+
+    def __contains__(self, item_id) -> bool:
+        return item_id in self.row_of
+
+    def __getitem__(self, item_id: str) -> Dict:
+        return self.record(self.row_of[item_id])
+
+    def record(self, row: int) -> Dict:
+        """Decode the metadata of the item stored at `row`"""
+        item = {}
+        for name, column in self._columns.items():
+            value = column.get(row)
+            if value is None:
+                continue
+            # Nested fields such as dimensions are flattened to "dimensions.length" columns
+            target = item
+            *parents, leaf = name.split(".")
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[leaf] = value
+        return item
+
+    def vector(self, item_id: str) -> np.ndarray:
+        """Embedding of a single item, as a view into the memory-mapped matrix"""
+        return self.embeddings[self.row_of[item_id]]
+
+    def rows(self, item_ids: List[str]) -> np.ndarray:
+        return np.fromiter((self.row_of[item_id] for item_id in item_ids), dtype=np.int64, count=len(item_ids))
+
+    def neighbors(self) -> Optional["NeighborTable"]:
+        """Precomputed item-to-item neighbor table, or None if `build_neighbor_table` has not been run"""
+        if not hasattr(self, "_neighbors"):
+            ids_file = os.path.join(self.path, "neighbors.ids.npy")
+            self._neighbors = NeighborTable(np.load(ids_file, mmap_mode="r"),
+                                            np.load(os.path.join(self.path, "neighbors.scores.npy"), mmap_mode="r")) \
+                if os.path.exists(ids_file) else None
+        return self._neighbors
+
+
+class NeighborTable:
+    """
+    Top-N most similar catalog rows for every catalog row, as an int32 row table padded
+    with -1 and a matching float16 table of cosine similarities in decreasing order.
+    """
+
+    def __init__(self, ids: np.ndarray, scores: np.ndarray):
+        self.ids = ids
+        self.scores = scores
+
+    @property
+    def top_n(self) -> int:
+        return self.ids.shape[1]
+
+    def lookup(self, row: int, k: int) -> List[Tuple[int, float]]:
+        """Up to `k` (row, score) neighbors of `row`"""
+        ids = self.ids[row, :k]
+        scores = self.scores[row, :k]
+        return [(int(idx), float(score)) for idx, score in zip(ids, scores) if idx >= 0]
+
+
+class _StringColumn:
+    def __init__(self, offsets: np.ndarray, data: np.ndarray, present: np.ndarray, is_json: bool):
+        self.offsets = offsets
+        self.data = data
+        self.present = present
+        self.is_json = is_json
+
+    def get(self, row: int):
+        if not self.present[row]:
+            return None
+        value = self.data[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+        return json.loads(value) if self.is_json else value
+
+    def tolist(self) -> List[str]:
+        return [self.get(row) for row in range(len(self.present))]
+
+
+class _NumberColumn:
+    def __init__(self, values: np.ndarray, present: np.ndarray):
+        self.values = values
+        self.present = present
+
+    def get(self, row: int):
+        if not self.present[row]:
+            return None
+        return self.values[row].item()
+
+
+def _flatten(item: Dict, prefix: str = "") -> Dict:
+    flat = {}
+    for key, value in item.items():
+        if not prefix and key in VECTOR_FIELDS:
+            continue
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def _column_kind(values: List) -> str:
+    present = [value for value in values if value is not None]
+    if present and all(isinstance(value, bool) for value in present):
+        return "json"
+    if present and all(isinstance(value, int) for value in present):
+        return "int"
+    if present and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return "float"
+    if all(isinstance(value, str) for value in present):
+        return "str"
+    return "json"
+
+
+def _write_column(path: str, name: str, kind: str, values: List):
+    prefix = os.path.join(path, f"col.{name}")
+    present = np.array([value is not None for value in values], dtype=bool)
+    np.save(f"{prefix}.present.npy", present)
+
+    if kind in ("int", "float"):
+        dtype = np.int64 if kind == "int" else np.float64
+        np.save(f"{prefix}.values.npy", np.array([0 if value is None else value for value in values], dtype=dtype))
+        return
+
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    with open(f"{prefix}.data.bin", "wb") as f:
+        for row, value in enumerate(values):
+            if value is not None:
+                encoded = (json.dumps(value) if kind == "json" else value).encode("utf-8")
+                f.write(encoded)
+                offsets[row + 1] = offsets[row] + len(encoded)
+            else:
+                offsets[row + 1] = offsets[row]
+    np.save(f"{prefix}.offsets.npy", offsets)
+
+
+def build_catalog(data_file: str = CATALOG_SOURCE, path: str = CATALOG_DIR):
+    """One-time step that converts the embedded data JSON file into a catalog store"""
+    print(f"Building catalog from {data_file}...")
+    with open(data_file, "r") as f:
+        data = json.load(f)
+
+    data = [item for item in data if "item_id" in item and "embedding" in item]
+    os.makedirs(path, exist_ok=True)
+
+    # Stream the embeddings straight into the final file instead of building a list of lists
+    dimension = len(data[0]["embedding"])
+    embeddings = np.lib.format.open_memmap(os.path.join(path, "embeddings.npy"), mode="w+",
+                                           dtype=np.float32, shape=(len(data), dimension))
+    # Content hash of the build: the items and their embeddings
+    build = hashlib.sha256()
+    for row, item in enumerate(data):
+        embeddings[row] = item["embedding"]
+        build.update(str(item["item_id"]).encode("utf-8") + b"\0" + embeddings[row].tobytes())
+    embeddings.flush()
+    del embeddings
+
+    flat_items = [_flatten(item) for item in data]
+    names = ["item_id"] + sorted({name for item in flat_items for name in item} - {"item_id"})
+    columns = {}
+    for name in names:
+        values = [item.get(name) for item in flat_items]
+        columns[name] = _column_kind(values)
+        _write_column(path, name, columns[name], values)
+
+    # Written last so a partially built catalog is never picked up
+    with open(os.path.join(path, "header.json"), "w") as f:
+        json.dump({"version": CATALOG_VERSION, "count": len(data), "dimension": dimension, "columns": columns,
+                   "build": build.hexdigest()[:32]}, f)
+    print(f"Catalog saved to {path} with {len(data)} items and {dimension} dimensions")
+
+
+def build_neighbor_table(catalog: Catalog, top_n: int = 50, max_score: float = 0.99, batch_size: int = 1024):
+    """
+    One-time step that stores the `top_n` cosine neighbors of every catalog item next to the catalog.
+    Like `retriever.simple_retriever`, the item itself and near-duplicates scoring `max_score` or more are skipped.
+    """
+    print(f"Building neighbor table with {top_n} neighbors per item...")
+    embeddings = np.asarray(catalog.embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.maximum(norms, 1e-12)
+
+    count = len(catalog)
+    ids = np.lib.format.open_memmap(os.path.join(catalog.path, "neighbors.ids.npy"), mode="w+",
+                                    dtype=np.int32, shape=(count, top_n))
+    scores = np.lib.format.open_memmap(os.path.join(catalog.path, "neighbors.scores.npy"), mode="w+",
+                                       dtype=np.float16, shape=(count, top_n))
+    ids[:] = -1
+    scores[:] = 0
+
+    for start in range(0, count, batch_size):
+        similarities = normalized[start:start + batch_size] @ normalized.T
+        similarities[similarities >= max_score] = -np.inf
+        keep = min(top_n, count)
+        candidates = np.argpartition(-similarities, keep - 1, axis=1)[:, :keep]
+        candidate_scores = np.take_along_axis(similarities, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+        valid = np.isfinite(candidate_scores)
+        ids[start:start + len(candidates), :keep] = np.where(valid, candidates, -1)
+        scores[start:start + len(candidates), :keep] = np.where(valid, candidate_scores, 0)
+
+    ids.flush()
+    scores.flush()
+    catalog.__dict__.pop("_neighbors", None)
+    print(f"Neighbor table saved to {catalog.path}")
+
+
+_catalogs: Dict[str, Catalog] = {}
+
+
+def open_catalog(path: str = CATALOG_DIR, data_file: Optional[str] = CATALOG_SOURCE) -> Catalog:
+    """
+    Open the catalog store at `path`, shared by every module in the process.
+    If the store does not exist yet but `data_file` does, it is built first.
+    """
+    path = os.path.abspath(path)
+    if path not in _catalogs:
+        if not os.path.exists(os.path.join(path, "header.json")) and data_file and os.path.exists(data_file):
+            build_catalog(data_file, path)
+        _catalogs[path] = Catalog(path)
+    return _catalogs[path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the memory-mapped catalog store from embedded data')
+    parser.add_argument('--data_file', type=str, default=CATALOG_SOURCE,
+                        help='Path to the embedded data JSON file')
+    parser.add_argument('--catalog_dir', type=str, default=CATALOG_DIR,
+                        help='Directory to write the catalog store to')
+    parser.add_argument('--neighbors', type=int, default=50,
+                        help='Number of precomputed neighbors per item, 0 to skip the neighbor table')
+
+    args = parser.parse_args()
+    build_catalog(args.data_file, args.catalog_dir)
+    if args.neighbors > 0:
+        build_neighbor_table(Catalog(args.catalog_dir), args.neighbors)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,138 +1,81 @@
+import asyncio
 import json
 import math
 import os
-from io import BytesIO
+import time
 
-import matplotlib
-
-import utils
-
-matplotlib.use('Agg')
-import matplotlib.image as mpimg
-import matplotlib.patches as patches
-import matplotlib.pyplot as plt
-import numpy as np
-import matplotlib.pyplot as plt
-import numpy as np
 import tqdm
-from PIL import Image
-from PIL import Image
 
-from model import Model
-from retriever import retrieve
-from utils import extract_info
+from caching import ResultCache, cache_key
+from catalog import open_catalog
+from example_bank import example_bank
+from image_payload import ImagePayloadEncoder
+from model import MODEL, Model
+from occupancy import OccupancyGrid
+from placement import footprint, nearest_free_placement
+from renderer import SceneRenderer
 from retriever import retrieve
+from timing import StageTimer
 from utils import extract_info
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+# How overlapping placements are corrected: "solver" moves them locally, "solver+llm" asks the LLM
+# critic when nothing fits, "llm" always asks the LLM critic
+DESIGN_CRITIC = os.environ.get("DESIGN_CRITIC", "solver")
+CRITIC_MODES = ("solver", "solver+llm", "llm")
+
+# Bump whenever the prompts change, so cached designs from older prompts are not reused
+DESIGN_PROMPT_VERSION = 1
+DESIGN_CACHE_MAX_ENTRIES = int(os.environ.get("DESIGN_CACHE_MAX_ENTRIES", "2000"))
+design_cache = ResultCache("designs", max_entries=256, max_disk_entries=DESIGN_CACHE_MAX_ENTRIES)
+
+
+def design_cache_key(room_dimensions, grid_key, constraints, requirement, critic=DESIGN_CRITIC):
+    """
+    Content address of a design: everything the designer's output depends on, with the room in its
+    canonical grid form and the build of the catalog its items come from. Generation runs at
+    temperature 0 with a fixed seed, so equal inputs give equal designs.
+    """
+    constraints = [[constraint["object"], list(constraint["start"]), list(constraint["end"])] for constraint in constraints]
+    return cache_key(list(room_dimensions), grid_key, constraints, requirement, critic,
+                     DESIGN_PROMPT_VERSION, MODEL, open_catalog().fingerprint)
+
+
 class Designer:
-    def __init__(self, room_dimensions, scene_image, constraints, requirement, verbose=False):
-        in_context_examples = self.load_in_context(requirement.replace(" ", "_"))
-        self.model = Model(key=OPENAI_API_KEY, in_context_examples=in_context_examples)
+    def __init__(self, room_dimensions, scene_image, constraints, requirement, verbose=False, critic=DESIGN_CRITIC):
+        if critic not in CRITIC_MODES:
+            raise ValueError(f"Unknown critic {critic}, expected one of {CRITIC_MODES}")
+        self.critic = critic
         self.num_rows = room_dimensions[0]
         self.num_cols = room_dimensions[1]
-        self.scene_image = scene_image  # Now a BytesIO object
+        in_context_examples = self.load_in_context(requirement.replace(" ", "_"))
+        self.model = Model(key=OPENAI_API_KEY, in_context_examples=in_context_examples,
+                           image_encoder=ImagePayloadEncoder((self.num_rows, self.num_cols)))
         self.scene_image = scene_image  # Now a BytesIO object
         self.requirement = requirement
         self.constraints = constraints
 
         self.verbose = verbose
 
-        # Initialize in-memory image buffers instead of file paths
-        self.intermediate_image = BytesIO()
-        self.final_image = BytesIO()
-        
-        # Initial image data is the scene image
-        self.scene_image.seek(0)
-        self.scene_array = np.array(Image.open(self.scene_image))
-        
-        # Initialize in-memory image buffers instead of file paths
-        self.intermediate_image = BytesIO()
-        self.final_image = BytesIO()
-        
-        # Initial image data is the scene image
-        self.scene_image.seek(0)
-        self.scene_array = np.array(Image.open(self.scene_image))
-        
+        # Placed objects are drawn on top of the scene image, encoded only when sent to the model
+        self.renderer = SceneRenderer(self.scene_image, self.num_rows, self.num_cols)
+
         self.list_of_objects = []
         self.design = []
+        self.timer = StageTimer()
 
     def load_in_context(self, folder_name):
-        in_context_examples = []
-        path = "in_context_examples/" + folder_name
-        for file in os.listdir(path):
-            if file.endswith(".jpeg"):
-                encoded_image = utils.encode_image(os.path.join(path, file))
-                in_context_examples.append(encoded_image)
-        return in_context_examples
-
-    def place_object(self, box, name, source_image, target_buffer):
-        """
-        Places an object on the room image.
-        
-        Parameters:
-        - box: Tuple (col_start, row_start, col_end, row_end) of the object's position
-        - name: Name of the object to place
-        - source_image: BytesIO object or numpy array of the source image
-        - target_buffer: BytesIO object to store the resulting image
-        """
-        # Reset the source_image if it's a BytesIO object
-        if isinstance(source_image, BytesIO):
-            source_image.seek(0)
-            image_array = np.array(Image.open(source_image))
-        elif isinstance(source_image, np.ndarray):
-            image_array = source_image
-        else:
-            # If it's a file path (for backward compatibility)
-            image_array = mpimg.imread(source_image)
+        return example_bank().parts(folder_name)
 
-        cell_col = image_array.shape[1] // (self.num_cols+1)
-        cell_row = image_array.shape[0] // (self.num_rows+1)
-        cell_col = image_array.shape[1] // (self.num_cols+1)
-        cell_row = image_array.shape[0] // (self.num_rows+1)
+    @property
+    def intermediate_image(self):
+        """PNG of the design with the candidate placement shown to the critic in green"""
+        return self.renderer.intermediate_image
 
-        bbox = ((box[0]+1) * cell_col, (box[1]+1) * cell_row, (box[2] - box[0]) * cell_col, (box[3] - box[1]) * cell_row)
-        
-        print("placing object", box, name, bbox)
-        bbox = ((box[0]+1) * cell_col, (box[1]+1) * cell_row, (box[2] - box[0]) * cell_col, (box[3] - box[1]) * cell_row)
-        
-        print("placing object", box, name, bbox)
-        fig, ax = plt.subplots()
-
-        if target_buffer == self.intermediate_image:
-        if target_buffer == self.intermediate_image:
-            facecolor = 'green'
-        else:
-            facecolor = 'red'
-
-        rect = patches.Rectangle(
-            (bbox[0], bbox[1]), bbox[2], bbox[3],
-            linewidth=3, edgecolor='black', facecolor=facecolor
-        )
-        ax.add_patch(rect)
-
-        padding = 5
-        ax.text(
-            bbox[0] + padding,
-            bbox[1] + padding,
-            name,
-            fontsize=10,
-            color='yellow',
-            verticalalignment='top',
-        )
-
-        ax.axis('off')
-        plt.imshow(image_array)
-        
-        # Save to the target buffer instead of a file
-        target_buffer.seek(0)
-        target_buffer.truncate(0)  # Clear any existing content
-        plt.savefig(target_buffer, format='png', bbox_inches='tight', pad_inches=0)
-        plt.close(fig)  # Close the figure to avoid memory leaks
-        
-        # Reset buffer position for reading
-        target_buffer.seek(0)
+    @property
+    def final_image(self):
+        """PNG of the design with every placed object in red"""
+        return self.renderer.final_image
 
     async def understand_image_and_task(self):
         introductory = f"""You are an seasoned interior designer. Given this layout of a room. The surrounding gray 
@@ -146,15 +89,12 @@ class Designer:
         #xxxxxx>\nJSON: <[{{"name": "name of the furniture", "color": <color of the furniture>, "description": "a 
         short description"}}, ...]> """
 
-        response = await self.model.query(introductory, self.scene_image, in_context=True)
+        with self.timer.stage("understand"):
+            response = await self.model.query(introductory, self.renderer.base, in_context=True)
         if self.verbose:
             print("understand_image_and_task - Input:", introductory)
             print("understand_image_and_task - Output:", response)
         wall_color = response.split("\n")[0].replace("COLOR: ", "")
-        response = response.split("JSON: ")[1].replace("json", "").replace("```", "").strip()
-            print("understand_image_and_task - Input:", introductory)
-            print("understand_image_and_task - Output:", response)
-        wall_color = response.split("\n")[0].replace("COLOR: ", "")
         response = response.split("JSON: ")[1].replace("json", "").replace("```", "").strip()
         self.list_of_objects = json.loads(response)
 
@@ -162,71 +102,46 @@ class Designer:
             print("list_of_objects:", self.list_of_objects)
         return wall_color
 
-    def detect_overlap(self, blocked_regions, placed_region):
-        blocked_cells = []
-        for region in blocked_regions[:-1]:
-            if region.split(":")[0] == "Walls":
-                cells = list(range(self.num_cols)) + \
-                        list(range(0, self.num_cols*self.num_rows, self.num_cols)) + \
-                        list(range(self.num_cols-1, self.num_rows*self.num_cols, self.num_cols)) + \
-                        list(range((self.num_rows-1)*self.num_cols, self.num_cols*self.num_rows))
-                cells = list(set(cells))
-                blocked_cells.extend(cells)
-                continue
-            row, col = region.split(",")[0].split(":")[1].strip(), region.split(",")[1].strip()
-            row_tokens, col_tokens = row.split(), col.split()
-            if len(row_tokens) == 4:
-                row_start = int(row_tokens[1])
-                row_end = int(row_tokens[3])
-            else:
-                row_start = int(row_tokens[1])
-                row_end = row_start + 1
-
-            if len(col_tokens) == 4:
-                col_start = int(col_tokens[1])
-                col_end = int(col_tokens[3])
-            else:
-                col_start = int(col_tokens[1])
-                col_end = col_start + 1
-
-            object_cells = []
-            for row in range(row_start, row_end):
-                cell_start = row*self.num_cols + col_start
-                cell_end = row*self.num_cols + col_end
-                cells = list(range(cell_start, cell_end))
-                object_cells.extend(cells)
-
-            blocked_cells.extend(object_cells)
-
-        placed_col_start, placed_row_start, placed_col_end, placed_row_end = placed_region
-        object_cells = []
-        for row in range(placed_row_start, placed_row_end):
-            cell_start = row * self.num_cols + placed_col_start
-            cell_end = row * self.num_cols + placed_col_end
-            cells = list(range(cell_start, cell_end))
-            object_cells.extend(cells)
-
-        return len(set(blocked_cells).intersection(set(object_cells))) > 0
-
-    async def run_rule_based_critic(self, name, blocked_cells, item_id, length, width):
+    def detect_overlap(self, placed_region):
+        """Whether `placed_region` (col_start, row_start, col_end, row_end) covers a blocked cell or leaves the room"""
+        col_start, row_start, col_end, row_end = placed_region
+        return self.occupancy.overlaps((row_start, col_start), (row_end, col_end))
+
+    def footprint_box(self, start_row, start_col, orientation, length, width):
+        """(col_start, row_start, col_end, row_end) covered by an object placed at the given start and orientation"""
+        rows, cols = footprint(length, width, orientation)
+        return start_col, start_row, start_col + cols, start_row + rows
+
+    def place_on_grid(self, name, item_id, box, orientation):
+        """Record a placement in the design and block its cells"""
+        col_start, row_start, col_end, row_end = box
+        self.design.append({"object": name, "start": (row_start, col_start), "end": (row_end, col_end),
+                            "facing": orientation.lower(), "item_id": item_id})
+        self.occupancy.insert(name, (row_start, col_start), (row_end, col_end))
+
+    async def run_rule_based_critic(self, name):
         critic_prompt = f"""The current placement of the {name} (shown in green) overlaps with one or more of the 
         blocked cells. Give another set of cells and orientation for the green block in the below format:\nGRID: <Start row number>, <Start column number>\nORIENTATION: 
         <Orientation of the {name}>."""
-        critic_response = await self.model.query(critic_prompt, self.intermediate_image)
+        self.update_context_summary()
+        with self.timer.stage("critic"):
+            critic_response = await self.model.query(critic_prompt, self.renderer.intermediate_frame)
         if self.verbose:
             print("critic_response - Input:", critic_prompt)
             print("critic_response - Output:", critic_response)
         start_row, start_col, orientation = extract_info(critic_response)
-        end_col, end_row = (start_col + width, start_row + length) if orientation.lower() in ["north","south"] else (
-        start_col + length, start_row + width)
+        return start_row, start_col, orientation
 
-        row_str = f"Rows {start_row} to {end_row}" if start_row != end_row else f"Rows {start_row}"
-        col_str = f"Columns {start_col} to {end_col}" if start_col != end_col else f"Columns {start_col}"
-        blocked_cells.append(f"{name}: {row_str}, {col_str}")
-        self.design.pop()
-        self.design.append(
-            {"object": name, "start": (start_row, start_col), "end": (end_row, end_col), "facing": orientation.lower(), "item_id": item_id})
-        return start_col, start_row, end_col, end_row
+    def run_solver(self, name, length, width, start_row, start_col, orientation):
+        """
+        Nearest free (start_row, start_col, orientation) to an overlapping placement, turning it if
+        needed, without another LLM round trip. None when the object fits nowhere.
+        """
+        with self.timer.stage("solve"):
+            placement = nearest_free_placement(self.occupancy.blocked, length, width, start_row, start_col, orientation)
+        if placement is not None:
+            print(f"Solver moved {name} from {(start_row, start_col, orientation.lower())} to {placement}")
+        return placement
 
     async def run_critic(self, name, source_image, item_id, length, width):
         critic_prompt = f"""You are an seasoned interior designer who corrects the placement of the furniture. 
@@ -237,87 +152,73 @@ class Designer:
         orientation for the green block in the below format:\nGRID: <Start row number>, <Start column 
         number>\nORIENTATION: <Orientation of the {name}>. If current position is good, output the same position 
         again. """
-        critic_response = await self.model.query(critic_prompt, self.intermediate_image)
-        again. """
-        critic_response = await self.model.query(critic_prompt, self.intermediate_image)
+        critic_response = await self.model.query(critic_prompt, self.renderer.intermediate_frame)
         if self.verbose:
             print("critic_response - Input:", critic_prompt)
             print("critic_response - Output:", critic_response)
-            print("critic_response - Input:", critic_prompt)
-            print("critic_response - Output:", critic_response)
         start_row, start_col, orientation = extract_info(critic_response)
-        end_col, end_row = (start_col + width, start_row + length) if orientation.lower() in ["north", "south"] else (start_col + length, start_row + width)
-
-        self.design.append({"object": name, "start": (start_row, start_col), "end": (end_row, end_col), "facing": orientation.lower(), "item_id": item_id})
-        self.place_object((start_col, start_row, end_col, end_row), name, source_image, self.final_image)
-
-    async def add_objects(self):
-    async def add_objects(self):
-        blocked_cells = [f"Walls: Entire Rows 1, Rows {self.num_rows - 1}, Columns 1, Columns {self.num_cols - 1}"]
+        box = self.footprint_box(start_row, start_col, orientation, length, width)
+        self.place_on_grid(name, item_id, box, orientation)
+        self.renderer.place(box, name)
+
+    def update_context_summary(self):
+        """Text the model gets in place of the earlier placement turns its context policy leaves out"""
+        placed = "; ".join(f"{item['object']} at rows {item['start'][0]}-{item['end'][0]}, columns "
+                           f"{item['start'][1]}-{item['end'][1]}, facing {item['facing']}" for item in self.design)
+        self.model.context_summary = (
+            f"Earlier placement turns are omitted. Furniture placed so far: {placed or 'none'}. "
+            f"The cells blocked until now are: {self.occupancy.describe()}")
+
+    async def retrieve_object(self, obj):
+        """Best catalog match for a listed object and its footprint in grid cells"""
+        retrieved_object = await retrieve(obj["description"])
+        retrieved_object = retrieved_object[0][0]
+
+        # Convert dimensions from inches to grid cells (12 inches = 1 foot = 1 cell)
+        length = math.ceil(retrieved_object["dimensions"]["length"]/12)  # Convert inches to feet (cells)
+        width = math.ceil(retrieved_object["dimensions"]["width"]/12)    # Convert inches to feet (cells)
+        print("retrieved_object: ", retrieved_object["item_id"], retrieved_object["dimensions"], length, width)
+        return retrieved_object, length, width
+
+    def start_retrieval(self):
+        """
+        Retrieval pre-stage: every listed object is retrieved concurrently as soon as the list is
+        known, so the text encoder embeds all descriptions in one batch and later objects are ready
+        while the first placement call is in flight. Returns one task per object.
+        """
+        start = time.perf_counter()
+        remaining = len(self.list_of_objects)
+
+        async def retrieve_timed(obj):
+            nonlocal remaining
+            try:
+                return await self.retrieve_object(obj)
+            finally:
+                # Recorded by the last retrieval to finish, before the placement awaiting it resumes
+                remaining -= 1
+                if remaining == 0:
+                    self.timer.add("retrieve", time.perf_counter() - start)
+
+        return [asyncio.create_task(retrieve_timed(obj)) for obj in self.list_of_objects]
+
+    async def place_objects(self):
+        """Async generator placing the listed objects one at a time, yielding each design item once it is final"""
+        self.occupancy = OccupancyGrid(self.num_rows, self.num_cols)
         for constraint in self.constraints:
-            object = constraint["object"]
-            start = constraint["start"]
-            end = constraint["end"]
-
-            row_str = f"Rows {start[0]} to {end[0]}" if start[0] != end[0] else f"Rows {start[0]}"
-            col_str = f"Columns {start[1]} to {end[1]}" if start[1] != end[1] else f"Columns {start[1]}"
-
-            blocked_cells.append(f"{object}: {row_str}, {col_str}")
-
-        for i, obj in tqdm.tqdm(enumerate(self.list_of_objects)):
-            name = obj["name"]
-            description = obj["description"]
-            retrieved_object = await retrieve(description)
-            retrieved_object = retrieved_object[0][0]
-
-            # Convert dimensions from inches to grid cells (12 inches = 1 foot = 1 cell)
-            length = math.ceil(retrieved_object["dimensions"]["length"]/12)  # Convert inches to feet (cells)
-            width = math.ceil(retrieved_object["dimensions"]["width"]/12)    # Convert inches to feet (cells)
-            
-            print("retrieved_object: ", retrieved_object["item_id"], retrieved_object["dimensions"], length, width)
-            iterative_prompt = f"""You are an seasoned interior designer who is great at creating the best interior designs by placing the furnitures
-            at their best places according to the requirements and furniture already placed. We want to place the {name} in the room.
-            The {name} is {length} cells long and {width} cells wide respectively. The top wall in the image denotes the North direction. """
-
-            if name != "rug":
-                iterative_prompt += f"""The cells blocked because of already placed furniture until now are: {blocked_cells}\nThen, output your logic to place the {name} by not including any cells that are in 
-                the blocked list. """
-            else:
-                iterative_prompt += f"""Then, output your logic to place the {name} in the best possible way, ideally beneath the bed. """
-            iterative_prompt += f"""In the end, write the following in 2 different lines and nothing else:\nGRID: <Start row number>, 
-                <start column number>\nORIENTATION: <Direction in which the object should face: North/East/South/West> """
-            
-            source_image = self.scene_image if i == 0 else self.final_image
-            
-            response = await self.model.query(iterative_prompt, source_image)
-            if self.verbose:
-                print("add_objects for ", name, " - Input:", iterative_prompt)
-                print("add_objects for ", name, " - Output:", response)
+            self.occupancy.insert(constraint["object"], tuple(constraint["start"]), tuple(constraint["end"]))
 
-            start_row, start_col, orientation = extract_info(response)
-            end_col, end_row = (start_col + width, start_row + length) if orientation.lower() in ["north", "south"] else (start_col + length, start_row + width)
+        retrievals = self.start_retrieval()
+        try:
+            for i, obj in tqdm.tqdm(enumerate(self.list_of_objects)):
+                await self.add_object(i, obj, retrievals[i])
+                yield self.design[-1]
+        finally:
+            for task in retrievals:
+                task.cancel()
 
-            print("Orient", name, orientation, length, width, start_row, end_row, start_col, end_col)
-            row_str = f"Rows {start_row} to {end_row}" if start_row != end_row else f"Rows {start_row}"
-            col_str = f"Columns {start_col} to {end_col}" if start_col != end_col else f"Columns {start_col}"
-            blocked_cells.append(f"{name}: {row_str}, {col_str}")
-
-            box = (start_col, start_row, end_col, end_row)
-            self.place_object(box, name, source_image, self.intermediate_image)
-
-            is_overlapping = self.detect_overlap(blocked_cells, box)
-
-            num_attempts = 0
-            self.design.append({"object": name, "start": (start_row, start_col), "end": (end_row, end_col), "facing": orientation.lower(), "item_id": retrieved_object["item_id"]})
-            while name != "rug" and num_attempts < 3 and is_overlapping:
-                print("Attempt {} - Overlapping object detected!\nBlocked cells: {}\nPlaced cells: {}".format(num_attempts+1, blocked_cells, box))
-                blocked_cells.pop()
-                box = await self.run_rule_based_critic(name, blocked_cells, retrieved_object["item_id"], length, width)
-                is_overlapping = self.detect_overlap(blocked_cells, box)
-                num_attempts += 1
-
-                self.place_object(box, name, source_image, self.intermediate_image)
-            self.place_object(box, name, source_image, self.final_image)
+    async def add_objects(self):
+        async for _ in self.place_objects():
+            pass
 
         # self.final_image.seek(0)
         #
@@ -325,6 +226,63 @@ class Designer:
         # with open(f'{self.requirement.replace(" ", "_")}_output.png', 'wb') as f:
         #     f.write(self.final_image.getvalue())
 
+    async def add_object(self, i, obj, retrieval):
+        name = obj["name"]
+        with self.timer.stage("wait_retrieve"):
+            retrieved_object, length, width = await retrieval
+        item_id = retrieved_object["item_id"]
+
+        iterative_prompt = f"""You are an seasoned interior designer who is great at creating the best interior designs by placing the furnitures
+        at their best places according to the requirements and furniture already placed. We want to place the {name} in the room.
+        The {name} is {length} cells long and {width} cells wide respectively. The top wall in the image denotes the North direction. """
+
+        if name != "rug":
+            iterative_prompt += f"""The cells blocked because of already placed furniture until now are: {self.occupancy.describe()}\nThen, output your logic to place the {name} by not including any cells that are in 
+            the blocked list. """
+        else:
+            iterative_prompt += f"""Then, output your logic to place the {name} in the best possible way, ideally beneath the bed. """
+        iterative_prompt += f"""In the end, write the following in 2 different lines and nothing else:\nGRID: <Start row number>, 
+            <start column number>\nORIENTATION: <Direction in which the object should face: North/East/South/West> """
+        
+        source_image = self.renderer.final_frame
+        
+        self.update_context_summary()
+        with self.timer.stage("place"):
+            response = await self.model.query(iterative_prompt, source_image)
+        if self.verbose:
+            print("add_objects for ", name, " - Input:", iterative_prompt)
+            print("add_objects for ", name, " - Output:", response)
+
+        start_row, start_col, orientation = extract_info(response)
+        box = self.footprint_box(start_row, start_col, orientation, length, width)
+        print("Orient", name, orientation, length, width, box)
+
+        # The rug goes beneath other furniture and is never corrected
+        is_overlapping = name != "rug" and self.detect_overlap(box)
+        if is_overlapping and self.critic != "llm":
+            placement = self.run_solver(name, length, width, start_row, start_col, orientation)
+            if placement is not None:
+                start_row, start_col, orientation = placement
+                box = self.footprint_box(start_row, start_col, orientation, length, width)
+                is_overlapping = False
+            elif self.critic == "solver":
+                print(f"No free position for {name}, keeping the proposed placement")
+                is_overlapping = False
+
+        num_attempts = 0
+        while is_overlapping and num_attempts < 3:
+            print("Attempt {} - Overlapping object detected!\nBlocked cells: {}\nPlaced cells: {}".format(
+                num_attempts+1, self.occupancy.describe(), box))
+            with self.timer.stage("render"):
+                self.renderer.propose(box, name)
+            start_row, start_col, orientation = await self.run_rule_based_critic(name)
+            box = self.footprint_box(start_row, start_col, orientation, length, width)
+            is_overlapping = self.detect_overlap(box)
+            num_attempts += 1
+
+        self.place_on_grid(name, item_id, box, orientation)
+        with self.timer.stage("render"):
+            self.renderer.place(box, name)
 
     def write_to_json(self, save_to_file=False):
         """
@@ -343,31 +301,24 @@ class Designer:
             with open('results/design.json', 'w') as f:
                 json.dump(self.design, f)
         return self.design
-    def write_to_json(self, save_to_file=False):
+
+    async def stream(self):
         """
-        Returns the design as a JSON object and optionally saves it to a file.
-        
-        Args:
-            save_to_file: If True, saves the design to 'results/design.json'
-            
-        Returns:
-            The design as a list of objects
+        Async generator form of `run`: yields the wall color as soon as the task is understood,
+        then every design item as soon as its placement is final, and the whole design last.
         """
-        if save_to_file:
-            os.makedirs('results', exist_ok=True)
-            if os.path.exists('results/design.json'):
-                os.remove('results/design.json')
-            with open('results/design.json', 'w') as f:
-                json.dump(self.design, f)
-        return self.design
+        wall_color = await self.understand_image_and_task()
+        yield {"type": "wallColor", "wallColor": wall_color, "total": len(self.list_of_objects)}
+        async for item in self.place_objects():
+            yield {"type": "item", "item": item, "index": len(self.design) - 1, "total": len(self.list_of_objects)}
+        print("Design stage timings:", self.timer.summary())
+        print("Image payloads:", self.model.image_encoder.stats())
+        yield {"type": "design", "wallColor": wall_color, "items": self.write_to_json()}
 
     async def run(self):
-        wall_color = await self.understand_image_and_task()
-        await self.add_objects()
-        return wall_color, self.write_to_json()
+        async for event in self.stream():
+            pass
+        return event["wallColor"], event["items"]
 
     async def run_with_style(self):
-        wall_color = await self.understand_image_and_task()
-        await self.add_objects()
-        return wall_color, self.write_to_json()
-
+        return await self.run()
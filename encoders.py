@@ -0,0 +1,164 @@
+import asyncio
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from caching import EmbeddingCache, normalize_text
+
+SIGLIP_MODEL = "google/siglip-base-patch16-224"
+MINILM_MODEL = "all-MiniLM-L6-v2"
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+class BatchEncoder:
+    """
+    Micro-batching front end for a text encoder.
+
+    Concurrent `encode` calls are collected for up to `max_wait_ms` (or until `max_batch_size`
+    texts are waiting) and run as a single forward pass in a worker thread, so the event loop
+    is never blocked and concurrent requests share one padded batch. Texts found in `cache`
+    skip the encoder entirely; its disk tier is only read in the worker thread. Callers are batched per event loop, so the encoder can be shared
+    by several loops, one after another or at once in different threads.
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], np.ndarray], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, cache: Optional[EmbeddingCache] = None):
+        self.encode_batch = encode_batch
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # Futures and timers belong to the loop they were created on
+        self._pending: Dict[asyncio.AbstractEventLoop, List[Tuple[str, asyncio.Future]]] = {}
+        self._flush_handles: Dict[asyncio.AbstractEventLoop, asyncio.TimerHandle] = {}
+        # Forward passes are serialized, the model already uses every core for a single batch
+        self._model_lock = threading.Lock()
+        self.stats = {"requests": 0, "batches": 0, "batched_texts": 0}
+
+    async def encode(self, text: str) -> np.ndarray:
+        """Encode a single text, batched together with any other concurrent callers"""
+        text = normalize_text(text)
+        if self.cache is not None:
+            embedding = self.cache.get_memory(text)
+            if embedding is not None:
+                return embedding
+
+        loop = asyncio.get_running_loop()
+        self._forget_closed_loops()
+        future = loop.create_future()
+        pending = self._pending.setdefault(loop, [])
+        pending.append((text, future))
+        self.stats["requests"] += 1
+
+        if len(pending) >= self.max_batch_size:
+            self._flush(loop)
+        elif loop not in self._flush_handles:
+            self._flush_handles[loop] = loop.call_later(self.max_wait, self._flush, loop)
+        return await future
+
+    def encode_sync(self, texts: List[str]) -> np.ndarray:
+        """Encode a list of texts directly, for offline scripts and synchronous callers"""
+        texts = [normalize_text(text) for text in texts]
+        if self.cache is None:
+            return self._run(texts)
+
+        cached = [self.cache.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, cached) if embedding is None))
+        if missing:
+            encoded = dict(zip(missing, self._run(missing)))
+            cached = [encoded[text] if embedding is None else embedding for text, embedding in zip(texts, cached)]
+        return np.stack(cached)
+
+    def _flush(self, loop: asyncio.AbstractEventLoop):
+        handle = self._flush_handles.pop(loop, None)
+        if handle is not None:
+            handle.cancel()
+        batch = self._pending.pop(loop, [])
+        if batch:
+            loop.create_task(self._run_batch(batch))
+
+    def _forget_closed_loops(self):
+        # A loop closed before its batch ran, e.g. at the end of asyncio.run, never flushes it
+        for loop in list(self._pending):
+            if loop.is_closed():
+                self._pending.pop(loop, None)
+                self._flush_handles.pop(loop, None)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        # Identical texts in the same window are encoded once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embeddings = await asyncio.to_thread(self._encode_uncached, texts)
+        except Exception as e:
+            print(f"Error encoding batch of {len(texts)} texts: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        rows = {text: row for row, text in enumerate(texts)}
+        for text, future in batch:
+            if not future.done():
+                future.set_result(embeddings[rows[text]])
+
+    def _encode_uncached(self, texts: List[str]) -> np.ndarray:
+        """Embeddings of texts missing from the memory tier: read from the disk tier, the rest encoded"""
+        if self.cache is None:
+            return self._run(texts)
+        found = [self.cache.get_disk(text) for text in texts]
+        missing = [text for text, embedding in zip(texts, found) if embedding is None]
+        if not missing:
+            return np.stack(found)
+        encoded = dict(zip(missing, self._run(missing)))
+        return np.stack([encoded[text] if embedding is None else embedding for text, embedding in zip(texts, found)])
+
+    def _run(self, texts: List[str]) -> np.ndarray:
+        with self._model_lock:
+            embeddings = self.encode_batch(texts)
+        if self.cache is not None:
+            for text, embedding in zip(texts, embeddings):
+                self.cache.set(text, embedding)
+        self.stats["batches"] += 1
+        self.stats["batched_texts"] += len(texts)
+        return embeddings
+
+
+_siglip_text_encoder: Optional[BatchEncoder] = None
+_minilm_encoder: Optional[BatchEncoder] = None
+
+
+def siglip_text_encoder() -> BatchEncoder:
+    """Process-wide SigLIP text encoder, shared by retriever.py and image_retrieval.py"""
+    global _siglip_text_encoder
+    if _siglip_text_encoder is None:
+        from transformers import AutoTokenizer, SiglipTextModel
+
+        tokenizer = AutoTokenizer.from_pretrained(SIGLIP_MODEL)
+        model = SiglipTextModel.from_pretrained(SIGLIP_MODEL).to(device)
+        model.eval()
+
+        def encode_batch(texts: List[str]) -> np.ndarray:
+            # SigLIP pools the last token, so every text is padded to max_length as during training
+            with torch.no_grad():
+                inputs = tokenizer(texts, padding="max_length", truncation=True, return_tensors="pt").to(device)
+                return model(**inputs).pooler_output.cpu().numpy().astype("float32")
+
+        _siglip_text_encoder = BatchEncoder(encode_batch, cache=EmbeddingCache("siglip_text"))
+    return _siglip_text_encoder
+
+
+def minilm_encoder() -> BatchEncoder:
+    """Process-wide MiniLM sentence encoder used by simple_retrieval.py"""
+    global _minilm_encoder
+    if _minilm_encoder is None:
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(MINILM_MODEL, device=str(device))
+
+        def encode_batch(texts: List[str]) -> np.ndarray:
+            return model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+        _minilm_encoder = BatchEncoder(encode_batch, cache=EmbeddingCache("minilm"))
+    return _minilm_encoder
@@ -0,0 +1,80 @@
+import base64
+import os
+import threading
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+IN_CONTEXT_DIR = "in_context_examples"
+# gpt-4o bills images in 512 px tiles, a 512 px example is a single tile
+EXAMPLE_MAX_SIDE = int(os.environ.get("EXAMPLE_MAX_SIDE", "512"))
+EXAMPLE_JPEG_QUALITY = int(os.environ.get("EXAMPLE_JPEG_QUALITY", "80"))
+
+
+class ExampleBank:
+    """
+    In-context example images of every style folder, downscaled to `max_side`, re-encoded as JPEG
+    and kept as ready-made message content parts. Each folder is read from disk once per process.
+    """
+
+    def __init__(self, root: str = IN_CONTEXT_DIR, max_side: int = EXAMPLE_MAX_SIDE,
+                 quality: int = EXAMPLE_JPEG_QUALITY):
+        self.root = root
+        self.max_side = max_side
+        self.quality = quality
+        self._parts: Dict[str, List[dict]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"folders": 0, "images": 0, "source_bytes": 0, "encoded_bytes": 0}
+
+    def preload(self):
+        """Load every style folder up front, so no request pays for it"""
+        for folder in sorted(os.listdir(self.root)):
+            if os.path.isdir(os.path.join(self.root, folder)):
+                self.parts(folder)
+        print(f"Loaded {self.stats['images']} in-context examples from {self.stats['folders']} folders, "
+              f"{self.stats['source_bytes'] / 1e6:.1f} MB re-encoded to {self.stats['encoded_bytes'] / 1e6:.1f} MB")
+
+    def parts(self, folder: str) -> List[dict]:
+        """image_url content parts of the examples in `folder`"""
+        parts = self._parts.get(folder)
+        if parts is None:
+            with self._lock:
+                parts = self._parts.get(folder)
+                if parts is None:
+                    parts = self._load(folder)
+                    self._parts[folder] = parts
+        return parts
+
+    def _load(self, folder: str) -> List[dict]:
+        path = os.path.join(self.root, folder)
+        parts = []
+        for file in sorted(os.listdir(path)):
+            if file.endswith(".jpeg"):
+                encoded = self._encode(os.path.join(path, file))
+                parts.append({"type": "image_url",
+                              "image_url": {"url": f"data:image/jpeg;base64,{base64.b64encode(encoded).decode('utf-8')}"}})
+        self.stats["folders"] += 1
+        self.stats["images"] += len(parts)
+        return parts
+
+    def _encode(self, file: str) -> bytes:
+        self.stats["source_bytes"] += os.path.getsize(file)
+        with Image.open(file) as image:
+            image = image.convert("RGB")
+            image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+            buffer = BytesIO()
+            image.save(buffer, format="JPEG", quality=self.quality, optimize=True)
+        self.stats["encoded_bytes"] += buffer.tell()
+        return buffer.getvalue()
+
+
+_example_bank: Optional[ExampleBank] = None
+
+
+def example_bank() -> ExampleBank:
+    """Process-wide example bank used by every Designer"""
+    global _example_bank
+    if _example_bank is None:
+        _example_bank = ExampleBank()
+    return _example_bank
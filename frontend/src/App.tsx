@@ -3,7 +3,7 @@ import './App.css'
 import RoomVisualizer from './components/RoomVisualizer'
 import RoomControls from './components/RoomControls'
 import { DoorWindow, RoomSpec } from './types'
-import { generateRoomDesign, RoomDesign, DesignItem, API_URL } from './services/designService'
+import { streamRoomDesign, RoomDesign, DesignItem, API_URL } from './services/designService'
 
 // Define the result type
 interface Result {
@@ -98,6 +98,8 @@ function App() {
   const [showPrompt, setShowPrompt] = useState<boolean>(false);
   const [isReplaced, setIsReplaced] = useState<boolean>(false);
   const [suggestedScenes, setSuggestedScenes] = useState<SearchResult[][]>([]);
+  // Aborting the streams of an earlier submission lets the backend cancel their designs
+  const designRequest = useRef<AbortController | null>(null);
   const [selectedDesignIndex, setSelectedDesignIndex] = useState<number>(-1);
 
   const handleAddDoor = (door: DoorWindow) => {
@@ -245,6 +247,10 @@ function App() {
       roomType
     }
 
+    designRequest.current?.abort()
+    const controller = new AbortController()
+    designRequest.current = controller
+
     setIsLoading(true)
     setDesign(undefined)
     setDesignOptions(undefined)
@@ -252,13 +258,24 @@ function App() {
     setSelectedDesignIndex(-1)
     
     try {
-      // Generate designs for different styles
-      const promises = ROOM_STYLES.map(async (style) => {
+      // Generate designs for different styles, showing each one as its furniture is placed
+      const partialDesigns: RoomDesign[] = ROOM_STYLES.map((style) => ({
+        items: [],
+        wallColor: '#FFFFFF',
+        style: style as 'minimal' | 'mid-century' | 'modern'
+      }));
+      const promises = ROOM_STYLES.map(async (style, index) => {
         const roomSpec = {
           ...baseRoomSpec, 
           style: style as 'minimal' | 'mid-century' | 'modern'
         };
-        return await generateRoomDesign(roomSpec);
+        return await streamRoomDesign(roomSpec, controller.signal, (partialDesign) => {
+          partialDesigns[index] = partialDesign;
+          setDesignOptions([...partialDesigns]);
+          setDesign((current) => current?.style === partialDesign.style ? partialDesign : current);
+          // The first placed furniture is enough to start exploring the designs
+          setIsLoading(false);
+        });
       });
       
       const generatedDesigns = await Promise.all(promises);
@@ -269,13 +286,19 @@ function App() {
         message: 'Successfully generated design options. Please select a style.'
       });
     } catch (error) {
+      if (controller.signal.aborted) {
+        // Superseded by a newer submission
+        return
+      }
       console.error('Error generating recommendations:', error)
       setResult({
         success: false,
         message: 'An error occurred while generating recommendations.'
       })
     } finally {
-      setIsLoading(false)
+      if (!controller.signal.aborted) {
+        setIsLoading(false)
+      }
     }
   }, [roomLength, roomWidth, doors, windows, roomType])
 
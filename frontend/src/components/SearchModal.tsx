@@ -1,6 +1,6 @@
 import React, { useState, useRef, useEffect } from 'react';
 import "../App.css"
-import { API_URL } from '../services/designService';
+import { API_URL, SESSION_ID } from '../services/designService';
 
 // Type for individual search result (adjust properties as needed)
 type SearchResult = {
@@ -140,7 +140,7 @@ const SearchModal: React.FC<SearchModalProps> = ({ isOpen, onClose, selectedItem
   }
 
   const getSimilarItems = async () => {
-    const similarItemsResult = await fetch(`${API_URL}/get-similar-items?item_id=${selectedItemId}`,
+    const similarItemsResult = await fetch(`${API_URL}/get-similar-items?item_id=${selectedItemId}&session_id=${SESSION_ID}`,
       {
         headers: {
           'Content-Type': 'application/json'
@@ -155,7 +155,7 @@ const SearchModal: React.FC<SearchModalProps> = ({ isOpen, onClose, selectedItem
   };
 
   const handleGoesWith = async () => {
-    const goesWithItemsResult = await fetch(`${API_URL}/get-similar-items-with-scene?item_id=${selectedItemId}`,
+    const goesWithItemsResult = await fetch(`${API_URL}/get-similar-items-with-scene?item_id=${selectedItemId}&session_id=${SESSION_ID}`,
       {
         headers: {
           'Content-Type': 'application/json'
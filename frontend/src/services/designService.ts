@@ -16,6 +16,9 @@ export interface RoomDesign {
 
 export const API_URL = 'http://127.0.0.1:5000';
 
+// Identifies this browser tab to the backend, which keeps its like/dislike state between requests
+export const SESSION_ID = crypto.randomUUID();
+
 export async function generateRoomDesign(roomSpec: RoomSpec): Promise<RoomDesign> {
   try {
     const response = await fetch(`${API_URL}/generate-design`, {
@@ -40,4 +43,58 @@ export async function generateRoomDesign(roomSpec: RoomSpec): Promise<RoomDesign
     console.error('Error generating room design:', error);
     throw error;
   }
-} 
\ No newline at end of file
+} 
+
+// Streams a design from /generate-design/stream, calling `onUpdate` with the partial design every time the wall
+// color or another piece of furniture is known, and resolves with the finished design. Aborting `signal` closes
+// the stream, and the backend stops the design unless another request is waiting on it
+export async function streamRoomDesign(roomSpec: RoomSpec, signal: AbortSignal,
+                                       onUpdate: (design: RoomDesign) => void): Promise<RoomDesign> {
+  const response = await fetch(`${API_URL}/generate-design/stream?format=ndjson`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json'
+    },
+    body: JSON.stringify(roomSpec),
+    signal,
+  });
+
+  if (!response.ok || !response.body) {
+    const errorData = await response.json().catch(() => null);
+    console.error("errorData: ", errorData);
+    throw new Error(errorData?.detail || 'Failed to generate room design');
+  }
+
+  const design: RoomDesign = { items: [], wallColor: '#FFFFFF', style: roomSpec.style };
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) {
+      break;
+    }
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop() ?? '';
+    for (const line of lines.filter(line => line.trim())) {
+      const event = JSON.parse(line);
+      if (event.type === 'wallColor') {
+        design.wallColor = event.wallColor;
+      } else if (event.type === 'item') {
+        design.items = [...design.items, event.item];
+      } else if (event.type === 'result') {
+        if (event.status !== 'done') {
+          throw new Error(event.error || 'Failed to generate room design');
+        }
+        design.items = event.result.items;
+        design.wallColor = event.result.wallColor;
+      } else {
+        continue;
+      }
+      onUpdate({ ...design });
+    }
+  }
+  console.log("generated design: ", design);
+  return design;
+}
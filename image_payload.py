@@ -0,0 +1,83 @@
+import base64
+import os
+from io import BytesIO
+from typing import Optional, Tuple, Union
+
+from PIL import Image
+
+# gpt-4o scales every image so its short side is at most 768 px before tiling, more is never seen
+MODEL_SHORT_SIDE = 768
+PAYLOAD_MAX_SIDE = int(os.environ.get("PAYLOAD_MAX_SIDE", "2048"))
+# Smallest grid cell, in pixels, at which the cell labels and axis numbers stay legible
+PAYLOAD_MIN_CELL_PX = int(os.environ.get("PAYLOAD_MIN_CELL_PX", "24"))
+PAYLOAD_JPEG_QUALITY = int(os.environ.get("PAYLOAD_JPEG_QUALITY", "85"))
+PAYLOAD_PNG_COLORS = 64
+
+
+def _open(image: Union[str, BytesIO, Image.Image]) -> Image.Image:
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, BytesIO):
+        image.seek(0)
+    return Image.open(image)
+
+
+def _is_graphic(image: Image.Image) -> bool:
+    """Flat-color renders such as the room grid, as opposed to photos"""
+    return image.getcolors(maxcolors=4096) is not None
+
+
+class ImagePayloadEncoder:
+    """
+    Prepares the images sent to the model. Renders of the room grid are scaled down to what the
+    model actually looks at, but never below `min_cell_px` per grid cell so labels stay legible,
+    and sent as palette PNGs; photos are sent as JPEG. The size of every payload is recorded.
+    """
+
+    def __init__(self, grid: Optional[Tuple[int, int]] = None, max_side: int = PAYLOAD_MAX_SIDE,
+                 min_cell_px: int = PAYLOAD_MIN_CELL_PX, jpeg_quality: int = PAYLOAD_JPEG_QUALITY):
+        self.grid = grid
+        self.max_side = max_side
+        self.min_cell_px = min_cell_px
+        self.jpeg_quality = jpeg_quality
+        self.calls = []
+
+    def scale(self, size: Tuple[int, int]) -> float:
+        width, height = size
+        scale = min(1.0, MODEL_SHORT_SIDE / min(width, height), self.max_side / max(width, height))
+        if self.grid is not None:
+            # Grid images have one extra cell of margin for the axis labels
+            cell_px = min(width / (self.grid[1] + 1), height / (self.grid[0] + 1))
+            scale = max(scale, min(1.0, self.min_cell_px / cell_px))
+        return scale
+
+    def encode(self, image: Union[str, BytesIO, Image.Image]) -> Tuple[str, bytes]:
+        """(mime type, encoded bytes) of the payload for `image`"""
+        image = _open(image)
+        graphic = _is_graphic(image)
+        image = image.convert("RGB")
+
+        scale = self.scale(image.size)
+        if scale < 1.0:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.LANCZOS)
+
+        buffer = BytesIO()
+        if graphic:
+            # Resampling adds in-between shades, a small adaptive palette keeps the PNG compact
+            image.quantize(colors=PAYLOAD_PNG_COLORS).save(buffer, format="PNG", optimize=True)
+            mime = "image/png"
+        else:
+            image.save(buffer, format="JPEG", quality=self.jpeg_quality, optimize=True)
+            mime = "image/jpeg"
+
+        self.calls.append({"format": mime, "width": image.width, "height": image.height, "bytes": buffer.tell()})
+        return mime, buffer.getvalue()
+
+    def content_part(self, image: Union[str, BytesIO, Image.Image]) -> dict:
+        mime, data = self.encode(image)
+        return {"type": "image_url",
+                "image_url": {"url": f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"}}
+
+    def stats(self) -> dict:
+        return {"images": len(self.calls), "bytes": sum(call["bytes"] for call in self.calls)}
@@ -4,8 +4,10 @@ import numpy as np
 from PIL import Image
 import torch
 import faiss
-from transformers import AutoProcessor, AutoModel, AutoTokenizer, SiglipTextModel
+from transformers import AutoProcessor, AutoModel
 from typing import Dict, List, Set, Tuple, Optional
+from ann_index import build_index, configure_index
+from encoders import siglip_text_encoder
 from simple_retrieval import SimpleRetrieval
 
 class ImageRetrieval(SimpleRetrieval):
@@ -38,11 +40,9 @@ class ImageRetrieval(SimpleRetrieval):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.image_processor = AutoProcessor.from_pretrained("google/siglip-base-patch16-224")
         self.image_model = AutoModel.from_pretrained("google/siglip-base-patch16-224").to(self.device)
-        self.text_tokenizer = AutoTokenizer.from_pretrained("google/siglip-base-patch16-224")
-        self.text_model = SiglipTextModel.from_pretrained("google/siglip-base-patch16-224").to(self.device)
+        self.text_encoder = siglip_text_encoder()
         
         self.image_model.eval()
-        self.text_model.eval()
         
         # Load mappings
         try:
@@ -52,18 +52,10 @@ class ImageRetrieval(SimpleRetrieval):
         except Exception as e:
             print(f"Error loading mapping file: {e}")
             self.mapping = {}
-            
-        with open("image_embedding_data.json", "r") as f:
-            data = json.load(f)
-            self.data_map = {item["item_id"]: item for item in data}
         
     def get_text_embedding(self, text: str) -> np.ndarray:
         """Override: Get embedding for text using SIGLIP text model"""
-        with torch.no_grad():
-            inputs = self.text_tokenizer([text], padding="max_length", return_tensors="pt").to(self.device)
-            outputs = self.text_model(**inputs)
-            embedding = outputs.pooler_output.cpu().numpy().astype("float32")
-            return embedding[0]
+        return self.text_encoder.encode_sync([text])[0]
             
     def get_image_embedding(self, image_path: str) -> Optional[np.ndarray]:
         """Get embedding for image using SIGLIP image model"""
@@ -108,11 +100,12 @@ class ImageRetrieval(SimpleRetrieval):
         
     def build_faiss_index(self, embeddings: np.ndarray, item_ids: List[str]):
         """Build FAISS index from embeddings"""
-        dimension = embeddings.shape[1]
-        self.faiss_index = faiss.IndexFlatL2(dimension)
-        self.faiss_index.add(embeddings)
+        self.faiss_index = build_index(embeddings, self.index_type)
+        configure_index(self.faiss_index, self.nprobe, self.ef_search)
         self.item_ids = item_ids
         self.embeddings = embeddings
+        self.row_of = {str(item_id): row for row, item_id in enumerate(item_ids)}
+        self.postings = None
         
     def save_indices(self):
         """Save FAISS index and related data to disk"""
@@ -146,6 +139,7 @@ class ImageRetrieval(SimpleRetrieval):
             # Load item IDs
             if os.path.exists(self.ids_file):
                 self.item_ids = np.load(self.ids_file, allow_pickle=True)
+                self.row_of = {str(item_id): row for row, item_id in enumerate(self.item_ids)}
                 print(f"Loaded {len(self.item_ids)} item IDs")
             else:
                 raise FileNotFoundError(f"Item IDs file {self.ids_file} not found")
@@ -153,6 +147,7 @@ class ImageRetrieval(SimpleRetrieval):
             # Load FAISS index
             if os.path.exists(self.faiss_index_file):
                 self.faiss_index = faiss.read_index(self.faiss_index_file)
+                configure_index(self.faiss_index, self.nprobe, self.ef_search)
                 print(f"Loaded FAISS index with {self.faiss_index.ntotal} vectors")
                 
                 # Verify dimensions match
@@ -160,6 +155,11 @@ class ImageRetrieval(SimpleRetrieval):
                     raise ValueError(f"Mismatch between FAISS index size ({self.faiss_index.ntotal}) and item IDs ({len(self.item_ids)})")
             else:
                 raise FileNotFoundError(f"FAISS index file {self.faiss_index_file} not found")
+
+            # Boolean filtering runs over the rows of the image index
+            if not self.index:
+                self.load_index()
+            self.build_posting_index()
                 
         except Exception as e:
             print(f"Error loading indices: {e}")
@@ -180,41 +180,23 @@ class ImageRetrieval(SimpleRetrieval):
         """Process query object and retrieve results using SIGLIP embeddings"""
         try:
             # Use parent class's process_query to get boolean query and description
-            boolean_query, object_description = await self.process_query(user_input)
+            boolean_query, object_description = await self.process_query(self.build_query_object(user_input))
             
-            # First get items matching boolean query
-            boolean_matches = self.boolean_query(boolean_query)
-            if not boolean_matches:
+            # First get rows matching boolean query
+            mask = self.boolean_mask(boolean_query)
+            if not mask.any():
                 return []
 
             # Get SIGLIP embedding for the description
-            query_embedding = self.get_text_embedding(object_description)
-            
-            # Find indices of items that match boolean query
-            matching_indices = []
-            for i, item_id in enumerate(self.item_ids):
-                if str(item_id) in boolean_matches:
-                    matching_indices.append(i)
-            
-            if not matching_indices:
-                return []
+            query_embedding = await self.text_encoder.encode(object_description)
 
-            # Create a temporary FAISS index with only the matching items
-            dimension = self.embeddings.shape[1]
-            temp_index = faiss.IndexFlatL2(dimension)
-            temp_embeddings = self.embeddings[matching_indices]
-            temp_index.add(temp_embeddings)
-            
-            # Search in filtered index using SIGLIP embedding
-            distances, local_indices = temp_index.search(
-                query_embedding.reshape(1, -1), 
-                min(k, len(matching_indices))
-            )
+            # Search the matching rows of the image index using SIGLIP embedding
+            hits = self.search_filtered(query_embedding, mask, k)
             
             # Map back to original item IDs and create results
             final_results = []
-            for idx, dist in zip(local_indices[0], distances[0]):
-                item_id = str(self.item_ids[matching_indices[idx]])
+            for row, dist in hits:
+                item_id = str(self.item_ids[row])
                 item_description = self.data_map[item_id]["description"]
                 image_id = self.mapping[item_id] if item_id in self.mapping else None
                 final_results.append({
@@ -233,14 +215,13 @@ class ImageRetrieval(SimpleRetrieval):
     def get_item_image_embedding(self, item_id: str) -> Optional[np.ndarray]:
         """Get the SIGLIP image embedding for a given item_id"""
         try:
-            # Find the index of the item_id in our item_ids array
-            item_idx = np.where(self.item_ids == item_id)[0]
-            if len(item_idx) == 0:
+            # Find the row of the item_id in our item_ids array
+            if item_id not in self.row_of:
                 print(f"Item ID {item_id} not found in image embeddings")
                 return None
                 
-            # Get the embedding at that index
-            embedding = self.embeddings[item_idx[0]]
+            # Get the embedding at that row
+            embedding = self.embeddings[self.row_of[item_id]]
             return embedding
             
         except Exception as e:
@@ -0,0 +1,267 @@
+import asyncio
+import math
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+from timing import StageTimer
+
+# Designs running at once; each keeps a Designer, its renders and a stream of LLM calls alive
+DESIGN_WORKERS = int(os.environ.get("DESIGN_WORKERS", "2"))
+# Designs waiting for a worker before new submissions are turned away with 429
+DESIGN_QUEUE_MAX = int(os.environ.get("DESIGN_QUEUE_MAX", "16"))
+# Seconds a finished job and its result can still be polled
+DESIGN_JOB_TTL = float(os.environ.get("DESIGN_JOB_TTL", "3600"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class QueueFullError(Exception):
+    """The job queue is at capacity, retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many designs in progress, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class Job:
+    """
+    One submitted unit of work. Its state changes are published as events, which any number of
+    followers can read from the start while the job is still running. A job is cancelled once the
+    last request watching it goes away, unless it is pinned for clients that poll for the result.
+    """
+
+    def __init__(self, key: Hashable, work: Callable[["Job"], Awaitable]):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.work = work
+        self.status = QUEUED
+        self.result = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.timer = StageTimer()
+        self.watchers = 0
+        self.pinned = False
+        self.task: Optional[asyncio.Task] = None
+        self.events = []
+        self._updated = asyncio.Event()
+        self._done = asyncio.Event()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def publish(self, event: dict):
+        """Append an event and wake every follower"""
+        self.events.append(event)
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    def _set_status(self, status: str):
+        self.status = status
+        self.publish({"type": "status", **self.to_dict(include_result=False)})
+
+    def start(self):
+        self.started = time.time()
+        self.timer.add("queue", self.started - self.created)
+        self._set_status(RUNNING)
+
+    def finish(self, result=None, error: Optional[str] = None, cancelled: bool = False):
+        self.finished = time.time()
+        self.result = result
+        self.error = error
+        self._set_status(CANCELLED if cancelled else FAILED if error is not None else DONE)
+        self._done.set()
+
+    async def wait(self):
+        """Result of the job, once it is finished"""
+        await self._done.wait()
+        return self.result
+
+    async def follow(self) -> AsyncIterator[dict]:
+        """Every event of the job, from the first one until it finishes"""
+        sent = 0
+        while True:
+            updated = self._updated
+            while sent < len(self.events):
+                sent += 1
+                yield self.events[sent - 1]
+            if self.is_finished:
+                return
+            await updated.wait()
+
+    def to_dict(self, include_result: bool = True) -> dict:
+        state = {"jobId": self.id, "status": self.status, "createdAt": self.created,
+                 "startedAt": self.started, "finishedAt": self.finished}
+        if self.error is not None:
+            state["error"] = self.error
+        if include_result and self.status == DONE:
+            state["result"] = self.result
+        return state
+
+
+class JobQueue:
+    """
+    Bounded pool of `workers` coroutines running submitted jobs in order. At most `max_queued` jobs
+    wait for a worker, beyond that `submit` raises QueueFullError with an estimate of when a slot
+    frees up. Jobs with the same key share one run while it is queued or running and not cancelled,
+    and finished jobs are kept for `ttl_seconds`.
+    """
+
+    def __init__(self, name: str, workers: int = DESIGN_WORKERS, max_queued: int = DESIGN_QUEUE_MAX,
+                 ttl_seconds: float = DESIGN_JOB_TTL):
+        self.name = name
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl_seconds = ttl_seconds
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.active: Dict[Hashable, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self.waiting = 0
+        self.running = 0
+        self.mean_seconds: Optional[float] = None
+        self.stats = {"submitted": 0, "deduplicated": 0, "rejected": 0, "completed": 0, "failed": 0,
+                      "cancelled_queued": 0, "cancelled_running": 0, "evicted": 0}
+
+    def _start_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    @property
+    def queued(self) -> int:
+        """Jobs waiting for a worker, not counting cancelled ones still in the queue"""
+        return self.waiting
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely to free up, from the mean job duration"""
+        mean = self.mean_seconds if self.mean_seconds is not None else 30.0
+        return max(1, math.ceil(mean * (self.queued - self.max_queued + 1) / self.workers))
+
+    def submit(self, work: Callable[[Job], Awaitable], key: Optional[Hashable] = None, pin: bool = False) -> Job:
+        """
+        Queue `work(job)`, or join the queued or running job with the same key. Pinned jobs run to
+        completion even when no request is watching them.
+        """
+        self._evict()
+        self._start_workers()
+        if key is not None and key in self.active:
+            self.stats["deduplicated"] += 1
+            self.active[key].pinned |= pin
+            return self.active[key]
+        if self.queued >= self.max_queued:
+            self.stats["rejected"] += 1
+            raise QueueFullError(self.retry_after())
+
+        job = Job(key, work)
+        job.pinned = pin
+        self.jobs[job.id] = job
+        if key is not None:
+            self.active[key] = job
+        self.stats["submitted"] += 1
+        job.publish({"type": "status", **job.to_dict(include_result=False)})
+        self.waiting += 1
+        self._queue.put_nowait(job)
+        return job
+
+    def completed(self, key: Hashable, result, events: Iterable[dict] = ()) -> Job:
+        """A job that is already finished, e.g. for a result served from cache, having published `events`"""
+        self._evict()
+        job = Job(key, None)
+        self.jobs[job.id] = job
+        job.start()
+        for event in events:
+            job.publish(event)
+        job.finish(result)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._evict()
+        return self.jobs.get(job_id)
+
+    def attach(self, job: Job):
+        """A request started watching `job`"""
+        job.watchers += 1
+
+    def release(self, job: Job):
+        """A request stopped watching `job`, which is cancelled when nobody else needs its result"""
+        job.watchers -= 1
+        if job.watchers <= 0 and not job.pinned:
+            self.cancel(job)
+
+    def cancel(self, job: Job) -> bool:
+        """
+        Cancel a queued or running job. A queued job is dropped right away, a running one is
+        cancelled at its next await and finishes once its worker has unwound it. Either way new
+        submissions with the same key start a fresh job instead of joining the cancelled one.
+        """
+        if job.is_finished:
+            return False
+        self._deactivate(job)
+        if job.status == QUEUED:
+            self.waiting -= 1
+            self.stats["cancelled_queued"] += 1
+            job.finish(cancelled=True)
+        elif job.task is not None:
+            job.task.cancel()
+        return True
+
+    def _deactivate(self, job: Job):
+        if self.active.get(job.key) is job:
+            del self.active[job.key]
+        job.work = None
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if job.is_finished:
+                # Cancelled while it was queued
+                self._queue.task_done()
+                continue
+            self.waiting -= 1
+            self.running += 1
+            job.start()
+            # Run in a task of its own, so cancelling the job never cancels the worker
+            job.task = asyncio.create_task(job.work(job))
+            await asyncio.wait([job.task])
+            try:
+                result = job.task.result()
+            except asyncio.CancelledError:
+                print(f"{self.name} job {job.id} cancelled after {time.time() - job.started:.1f}s")
+                job.finish(cancelled=True)
+                self.stats["cancelled_running"] += 1
+            except Exception as e:
+                print(f"{self.name} job {job.id} failed: {e}")
+                job.finish(error=str(e))
+                self.stats["failed"] += 1
+            else:
+                job.finish(result)
+                self.stats["completed"] += 1
+                seconds = job.finished - job.started
+                self.mean_seconds = seconds if self.mean_seconds is None else 0.8 * self.mean_seconds + 0.2 * seconds
+            finally:
+                self.running -= 1
+                self._deactivate(job)
+                job.task = None
+                self._queue.task_done()
+
+    def _evict(self):
+        """Drop finished jobs older than the TTL, jobs are kept in submission order"""
+        expired = time.time() - self.ttl_seconds
+        for job_id, job in list(self.jobs.items()):
+            if job.is_finished and job.finished < expired:
+                del self.jobs[job_id]
+                self.stats["evicted"] += 1
+            elif job.created >= expired:
+                break
+
+    def metrics(self) -> dict:
+        return {"workers": self.workers, "running": self.running, "queued": self.queued,
+                "max_queued": self.max_queued, "retained": len(self.jobs),
+                "mean_seconds": round(self.mean_seconds, 2) if self.mean_seconds is not None else None,
+                **self.stats}
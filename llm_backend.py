@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from typing import Dict, Optional
+
+from openai.types.chat import ChatCompletion
+
+from caching import cache_key
+
+# "openai" calls the API, "record" calls it and saves every response to LLM_FIXTURES, "replay"
+# answers from LLM_FIXTURES only, "synthetic" answers every prompt without fixtures
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "openai")
+LLM_FIXTURES = os.environ.get("LLM_FIXTURES", "fixtures/llm_responses.jsonl")
+# Injected into replayed and synthetic responses to stand in for the API round trip
+LLM_REPLAY_LATENCY_MS = float(os.environ.get("LLM_REPLAY_LATENCY_MS", "0"))
+LLM_REPLAY_JITTER_MS = float(os.environ.get("LLM_REPLAY_JITTER_MS", "0"))
+# What replay does with a request missing from the fixtures: "error" or "synthetic"
+LLM_REPLAY_MISSING = os.environ.get("LLM_REPLAY_MISSING", "error")
+
+BACKENDS = ("openai", "record", "replay", "synthetic")
+
+
+def request_key(messages: list, **kwargs) -> str:
+    """Fixture key of a chat completion request: its messages and every parameter"""
+    return cache_key(messages, kwargs)
+
+
+class OpenAIBackend:
+    """Live chat completions"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def create(self, messages: list, **kwargs) -> ChatCompletion:
+        return await self.client.chat.completions.create(messages=messages, **kwargs)
+
+
+class RecordingBackend:
+    """Calls the API and appends every request/response pair to a JSON lines fixture file"""
+
+    def __init__(self, inner, path: str = LLM_FIXTURES):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    async def create(self, messages: list, **kwargs) -> ChatCompletion:
+        response = await self.inner.create(messages, **kwargs)
+        line = json.dumps({"key": request_key(messages, **kwargs), "response": response.model_dump(mode="json")})
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+        return response
+
+
+class _InjectedLatency:
+    def __init__(self, latency_ms: float = LLM_REPLAY_LATENCY_MS, jitter_ms: float = LLM_REPLAY_JITTER_MS,
+                 seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+
+    async def sleep(self):
+        delay = self.latency_ms + (self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+
+class SyntheticBackend(_InjectedLatency):
+    """
+    Offline stand-in that answers the prompts this repo sends in the format their parsers expect:
+    the room understanding call, furniture placements and critic corrections, and search query
+    rewrites. Answers depend only on the request, so runs are repeatable.
+    """
+
+    FURNITURE = {
+        "bedroom": ["bed", "wardrobe", "desk", "chair", "nightstand", "lamp", "rug"],
+        "livingroom": ["sofa", "coffee table", "armchair", "tv stand", "bookshelf", "lamp", "rug"],
+    }
+
+    async def create(self, messages: list, **kwargs) -> ChatCompletion:
+        await self.sleep()
+        prompt = _last_user_text(messages)
+        digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        if "COLOR:" in prompt and "JSON:" in prompt:
+            content = self._understand(prompt)
+        elif "GRID:" in prompt:
+            content = self._place(prompt, digest)
+        elif "Boolean" in prompt:
+            content = self._rewrite(prompt)
+        else:
+            content = "OK"
+        return _completion(content, kwargs.get("model", "gpt-4o"), prompt)
+
+    def _understand(self, prompt: str) -> str:
+        room = "livingroom" if "living" in prompt.lower() else "bedroom"
+        items = [{"name": name, "color": "white", "description": f"a {name} for a {room}"} for name in self.FURNITURE[room]]
+        return f"COLOR: #A3C1AD\nJSON: {json.dumps(items)}"
+
+    def _place(self, prompt: str, digest: int) -> str:
+        # Placement prompts list the walls as "Rows 1, Rows <last row>, Columns 1, Columns <last column>"
+        walls = re.search(r"Walls: Entire Rows \d+, Rows (\d+), Columns \d+, Columns (\d+)", prompt)
+        last_row, last_col = (int(walls.group(1)), int(walls.group(2))) if walls else (8, 8)
+        row = 1 + digest % max(1, last_row - 1)
+        col = 1 + (digest // 97) % max(1, last_col - 1)
+        orientation = ("North", "East", "South", "West")[(digest // 7) % 4]
+        return f"Placing it along the wall.\nGRID: {row}, {col}\nORIENTATION: {orientation}"
+
+    def _rewrite(self, prompt: str) -> str:
+        conversation = re.search(r"User Conversation: (.*)", prompt)
+        words = re.findall(r"[a-z]+", (conversation.group(1) if conversation else "").lower())
+        words = [word for word in words if len(word) > 3][:3] or ["furniture"]
+        description = f"A {' '.join(words)} matching the requested material and style, suited to the room."
+        return f"Boolean Query: {' AND '.join(words)}\nObject Description: {description}"
+
+
+class ReplayBackend(_InjectedLatency):
+    """Answers from a fixture file written by RecordingBackend, after the injected latency"""
+
+    def __init__(self, path: str = LLM_FIXTURES, missing: str = LLM_REPLAY_MISSING, **latency):
+        super().__init__(**latency)
+        self.path = path
+        self.responses: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.responses[entry["key"]] = entry["response"]
+        self.fallback = SyntheticBackend(latency_ms=0) if missing == "synthetic" else None
+        self.stats = {"replayed": 0, "synthetic": 0}
+        print(f"Replaying {len(self.responses)} recorded LLM responses from {path}")
+
+    async def create(self, messages: list, **kwargs) -> ChatCompletion:
+        await self.sleep()
+        response = self.responses.get(request_key(messages, **kwargs))
+        if response is not None:
+            self.stats["replayed"] += 1
+            return ChatCompletion.model_validate(response)
+        if self.fallback is None:
+            raise KeyError(f"No recorded response for this request in {self.path}, record it with "
+                           f"LLM_BACKEND=record or set LLM_REPLAY_MISSING=synthetic")
+        self.stats["synthetic"] += 1
+        return await self.fallback.create(messages, **kwargs)
+
+
+def _last_user_text(messages: list) -> str:
+    for message in reversed(messages):
+        if message["role"] == "user":
+            content = message["content"]
+            if isinstance(content, str):
+                return content
+            return "\n".join(part["text"] for part in content if part["type"] == "text")
+    return ""
+
+
+def _completion(content: str, model: str, prompt: str) -> ChatCompletion:
+    prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-offline", "object": "chat.completion", "created": 0, "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    })
+
+
+def make_backend(client, name: Optional[str] = None):
+    """The chat completion backend selected by `name`, LLM_BACKEND by default"""
+    name = name or LLM_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend {name}, expected one of {BACKENDS}")
+    if name == "record":
+        return RecordingBackend(OpenAIBackend(client))
+    if name == "replay":
+        return ReplayBackend()
+    if name == "synthetic":
+        return SyntheticBackend()
+    return OpenAIBackend(client)
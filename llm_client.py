@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI, RateLimitError
+
+from llm_backend import LLM_BACKEND, make_backend
+
+# Budgets of the whole process, set them to the organization's limits for the model
+LLM_RPM = int(os.environ.get("LLM_RPM", "500"))
+LLM_TPM = int(os.environ.get("LLM_TPM", "30000"))
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_RETRIES = 5
+
+# Priority classes, lower goes first
+INTERACTIVE = 0   # a user is waiting on this single call, e.g. search query rewrites
+BATCH = 1         # one of many calls of a long pipeline such as /generate-design
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+
+class TokenBucket:
+    """Budget of `per_minute` units refilled continuously, holding at most one minute's worth"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.available >= amount else (amount - self.available) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        """Return over-estimated units, or charge more with a negative amount"""
+        self._refill()
+        self.available = min(self.capacity, self.available + amount)
+
+
+class RateLimiter:
+    """
+    Process-wide requests/tokens per minute limiter. Callers queue by priority class and are
+    admitted strictly in order, so interactive calls overtake queued batch calls, and a rate limit
+    reported by the API pauses every caller instead of each one retrying on its own.
+    """
+
+    def __init__(self, rpm: int = LLM_RPM, tpm: int = LLM_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._queue: List[list] = []
+        self._sequence = itertools.count()
+        self._changed: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {name: {"queued": 0, "admitted": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+                      for name in PRIORITY_NAMES.values()}
+
+    def _condition(self) -> asyncio.Condition:
+        # A condition only works on the loop it was first used on, e.g. a new one after asyncio.run
+        loop = asyncio.get_running_loop()
+        if self._changed is None or self._loop is not loop:
+            if self._loop is not None and self._loop.is_closed():
+                # Callers queued on a closed loop never run again and would block the queue
+                self._queue.clear()
+            self._changed = asyncio.Condition()
+            self._loop = loop
+        return self._changed
+
+    async def _notify(self):
+        changed = self._condition()
+        async with changed:
+            changed.notify_all()
+
+    def _wait_time(self, tokens: float) -> float:
+        return max(self.paused_until - time.monotonic(), self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    async def acquire(self, tokens: float, priority: int = BATCH):
+        """Wait for a request slot and `tokens` tokens of budget"""
+        entry = [priority, next(self._sequence), tokens]
+        stats = self.stats[PRIORITY_NAMES[priority]]
+        start = time.monotonic()
+        changed = self._condition()
+        async with changed:
+            heapq.heappush(self._queue, entry)
+            stats["queued"] += 1
+            try:
+                while True:
+                    timeout = None
+                    if self._queue[0] is entry:
+                        timeout = self._wait_time(tokens)
+                        if timeout <= 0:
+                            break
+                    try:
+                        await asyncio.wait_for(changed.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                changed.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            changed.notify_all()
+
+        waited = time.monotonic() - start
+        stats["admitted"] += 1
+        stats["wait_seconds"] += waited
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+
+    def settle(self, estimated: float, used: float):
+        """Correct the token budget once the actual usage of a call is known"""
+        self.tokens.give_back(estimated - used)
+
+    async def pause(self, seconds: float):
+        """Hold back every caller, after the API reported that a limit was hit"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        await self._notify()
+        # Wake every waiter again once the pause is over, to re-check its turn
+        asyncio.get_running_loop().call_later(seconds, lambda: asyncio.ensure_future(self._notify()))
+
+    def queue_depth(self) -> Dict[str, int]:
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, _ in self._queue:
+            depth[PRIORITY_NAMES[priority]] += 1
+        return depth
+
+
+def _retry_after(error: RateLimitError, attempt: int) -> float:
+    """Seconds to back off after a 429, from the response headers when the API sends them"""
+    headers = error.response.headers if error.response is not None else {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers[header]) * scale + random.uniform(0, 0.5)
+        except (KeyError, TypeError, ValueError):
+            pass
+    return 2 ** attempt + random.uniform(0, 1)
+
+
+class LLMClient:
+    """One AsyncOpenAI client with a pooled HTTP connection, shared by every LLM caller in the process"""
+
+    def __init__(self, api_key: Optional[str] = None, limiter: Optional[RateLimiter] = None,
+                 max_connections: int = LLM_MAX_CONNECTIONS, backend: str = LLM_BACKEND):
+        http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=max_connections,
+                                                            max_keepalive_connections=max_connections),
+                                        timeout=httpx.Timeout(120.0, connect=10.0))
+        # Retries go through the limiter below, not the SDK's own backoff
+        # Replay and synthetic backends never reach the API and run without a key
+        offline = backend in ("replay", "synthetic")
+        self.client = AsyncOpenAI(api_key=api_key or ("offline" if offline else None), http_client=http_client,
+                                  max_retries=0)
+        self.backend_name = backend
+        self.backend = make_backend(self.client, backend)
+        self.limiter = limiter or RateLimiter()
+        self.in_flight = 0
+        self.stats = {"calls": 0, "rate_limited": 0, "errors": 0, "cancelled_queued": 0, "cancelled_in_flight": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0}
+
+    async def chat(self, messages: list, estimated_tokens: int, priority: int = BATCH, **kwargs):
+        """
+        chat.completions.create through the shared limiter. `estimated_tokens` should include the
+        prompt and max_tokens; the budget is corrected with the usage the API reports.
+        """
+        for attempt in range(LLM_MAX_RETRIES):
+            try:
+                await self.limiter.acquire(estimated_tokens, priority)
+            except asyncio.CancelledError:
+                # The caller went away before the call was sent, nothing was spent
+                self.stats["cancelled_queued"] += 1
+                raise
+            self.in_flight += 1
+            try:
+                response = await self.backend.create(messages, **kwargs)
+            except asyncio.CancelledError:
+                # The request is abandoned, but the API may still bill its prompt
+                self.stats["cancelled_in_flight"] += 1
+                raise
+            except RateLimitError as e:
+                self.stats["rate_limited"] += 1
+                # A rejected request spends no tokens, give its budget back before the next attempt takes it again
+                self.limiter.settle(estimated_tokens, 0)
+                if attempt == LLM_MAX_RETRIES - 1:
+                    raise
+                delay = _retry_after(e, attempt)
+                print(f"Rate limit hit. Pausing LLM calls for {delay:.2f} seconds (attempt {attempt + 1}/{LLM_MAX_RETRIES})...")
+                await self.limiter.pause(delay)
+                continue
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Error during API call: {e}")
+                raise
+            finally:
+                self.in_flight -= 1
+
+            self.stats["calls"] += 1
+            if response.usage is not None:
+                self.stats["prompt_tokens"] += response.usage.prompt_tokens
+                self.stats["completion_tokens"] += response.usage.completion_tokens
+                self.limiter.settle(estimated_tokens, response.usage.total_tokens)
+            return response
+
+    def metrics(self) -> dict:
+        return {"backend": self.backend_name,
+                "queue_depth": self.limiter.queue_depth(),
+                "in_flight": self.in_flight,
+                "priorities": self.limiter.stats,
+                "available_requests": round(self.limiter.requests.available, 1),
+                "available_tokens": round(self.limiter.tokens.available),
+                **self.stats}
+
+
+_llm_client: Optional[LLMClient] = None
+
+
+def llm_client(api_key: Optional[str] = None) -> LLMClient:
+    """Process-wide LLM client used by model.Model and SimpleRetrieval"""
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = LLMClient(api_key=api_key)
+    return _llm_client
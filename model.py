@@ -1,15 +1,137 @@
-import asyncio
-import random
-import time
+import base64
+import hashlib
+import json
+import math
+from abc import ABC, abstractmethod
+from io import BytesIO
 
-from openai import OpenAI, RateLimitError
+from PIL import Image
 
-from utils import encode_image
+from caching import LRUCache
+from image_payload import ImagePayloadEncoder
+from llm_client import BATCH, llm_client
+
+MODEL = "gpt-4o"
+MAX_TOKENS = 500
+
+
+def _text_only(message):
+    """Copy of a message without its image parts, the message itself when it has none"""
+    if isinstance(message["content"], str) or all(part["type"] != "image_url" for part in message["content"]):
+        return message
+    return {"role": message["role"],
+            "content": [part for part in message["content"] if part["type"] != "image_url"]}
+
+
+class ContextPolicy(ABC):
+    """Decides which part of the conversation history is sent with each query"""
+
+    @abstractmethod
+    def select(self, messages, summary=None):
+        """The messages to send for the query in the last message of `messages`"""
+
+    def prune(self, messages):
+        """Drop in place the parts of `messages` no later query sends, by default none"""
+
+
+class FullHistory(ContextPolicy):
+    """Sends every message, including every earlier image"""
+
+    def select(self, messages, summary=None):
+        return messages
+
+
+class LatestRenderOnly(ContextPolicy):
+    """
+    Sends the system prompt, the task turn and its answer (text only), the last `keep_recent`
+    messages as text, and the current turn with its render. Everything in between is replaced by
+    `summary`, which the caller keeps up to date with the placements made so far. Earlier images are
+    never sent again, so they are pruned from the history once the next turn starts.
+    """
+
+    def __init__(self, keep_recent=2):
+        self.keep_recent = keep_recent
+
+    def select(self, messages, summary=None):
+        # The first query carries the task and the in-context examples, and is sent as is
+        if len(messages) <= 3:
+            return messages
+
+        system, task, task_answer = messages[:3]
+        history, current = messages[3:-1], messages[-1]
+        recent = history[len(history) - self.keep_recent:] if self.keep_recent else []
+        selected = [system, _text_only(task), task_answer]
+        if summary and len(history) > len(recent):
+            selected.append({"role": "user", "content": [{"type": "text", "text": summary}]})
+        selected.extend(_text_only(message) for message in recent)
+        selected.append(current)
+        return selected
+
+    def prune(self, messages):
+        # Past the first query only the current turn is sent with its images
+        if len(messages) > 3:
+            for index in range(1, len(messages) - 1):
+                messages[index] = _text_only(messages[index])
+
+
+# Token estimates of recent images, keyed by a digest so the data URLs themselves are not kept alive
+_image_token_cache = LRUCache(256)
+
+
+def _url_key(url):
+    return hashlib.sha1(url.encode("ascii")).digest()
+
+
+def _image_tokens(url):
+    """Vision token estimate of a data URL image"""
+    key = _url_key(url)
+    tokens = _image_token_cache.get(key)
+    if tokens is None:
+        try:
+            tokens = image_tokens(*Image.open(BytesIO(base64.b64decode(url.split(",", 1)[1]))).size)
+        except Exception:
+            tokens = 765
+        _image_token_cache.set(key, tokens)
+    return tokens
+
+
+def image_tokens(width, height):
+    """Vision tokens of a `width` x `height` image, following the gpt-4o tiling rules"""
+    scale = min(1, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def estimate_tokens(messages):
+    """Rough prompt size of `messages`, about 4 characters per text token plus the image tiles"""
+    tokens = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for part in content:
+            if part["type"] == "text":
+                tokens += len(part["text"]) // 4
+            else:
+                tokens += _image_tokens(part["image_url"]["url"])
+    return tokens
 
 
 class Model:
-    def __init__(self, key, in_context_examples):
+    def __init__(self, key, in_context_examples, context_policy=None, image_encoder=None, priority=BATCH):
         self.in_context_examples = in_context_examples
+        self.image_encoder = image_encoder or ImagePayloadEncoder()
+        self.context_policy = context_policy or LatestRenderOnly()
+        # Text standing in for the turns the context policy leaves out, kept up to date by the caller
+        self.context_summary = None
+        self.context_stats = {"queries": 0, "full_bytes": 0, "sent_bytes": 0,
+                              "full_tokens": 0, "sent_tokens": 0, "prompt_tokens": 0}
+        # Size of the whole conversation as added, before any image is pruned from it
+        self.history_bytes = 0
+        self.history_tokens = 0
         content = [
                       {"type": "text",
                        "text": "You are a professional and experienced interior designer with a strong math "
@@ -21,79 +143,62 @@ class Model:
                                "to beds\n4. There must be enough space left around the door to allow passing "
                                "through the door.\nAttached are a few examples of how the room might look like."},
                   ]
-        self.client = OpenAI(api_key=key)
-        self.messages = [{"role": "system",
-                          "content": content}]
+        # Shared, rate limited client; design calls queue behind interactive ones
+        self.llm = llm_client(key)
+        self.priority = priority
+        self.messages = []
+        self._append({"role": "system", "content": content})
+
+    def _append(self, message):
+        # As json.dumps(self.messages) counts it: the brackets for the first message, a separator for the others
+        self.history_bytes += len(json.dumps(message)) + 2
+        self.messages.append(message)
+        self.history_tokens += estimate_tokens([message])
+        self.context_policy.prune(self.messages)
 
     def add_message(self, role, prompt, image_path, in_context=False):
         content = [{"type": "text", "text": prompt}]
         if image_path is not None:
-            base64_image = encode_image(image_path)
-            content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_image}"
-                }
-            }
-            )
+            # A path, an encoded image or a PIL image, re-encoded for the model
+            part = self.image_encoder.content_part(image_path)
+            content.append(part)
+            payload = self.image_encoder.calls[-1]
+            # The encoder knows the size, so the image is never decoded again to estimate it
+            _image_token_cache.set(_url_key(part["image_url"]["url"]), image_tokens(payload["width"], payload["height"]))
+            print(f"Image payload: {payload['format']} {payload['width']}x{payload['height']}, "
+                  f"{payload['bytes'] / 1024:.0f} KB")
         if in_context:
-            content.extend([{
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{example}"
-                }
-            } for example in self.in_context_examples]
-            )
-        self.messages.append({"role": role, "content": content})
-
-    async def _execute_query_with_retry(self, prompt, image_path):
-        max_retries = 5
-        base_delay = 1  # Start with 1 second delay
-
-        for attempt in range(max_retries):
-            try:
-                return await asyncio.to_thread(
-                    self.client.chat.completions.create,
-                    model="gpt-4o",
-                    messages=self.messages,
-                    seed=42,
-                    max_tokens=500,
-                    temperature=0,
-                )
-            except RateLimitError as e:
-                if attempt == max_retries - 1:
-                    # If this was the last attempt, re-raise the exception
-                    raise
-
-                # Extract wait time from error message if available
-                wait_time = None
-                error_msg = str(e)
-                if "Please try again in" in error_msg and "s." in error_msg:
-                    try:
-                        wait_time_str = error_msg.split("Please try again in")[1].split("s.")[0].strip()
-                        wait_time = float(wait_time_str)
-                    except (IndexError, ValueError):
-                        pass
-
-                # Calculate backoff with jitter
-                if wait_time is None:
-                    # If no explicit wait time, use exponential backoff
-                    delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                else:
-                    # If the API suggests a wait time, use that plus a small buffer
-                    delay = wait_time + 0.5
-
-                print(f"Rate limit hit. Retrying in {delay:.2f} seconds (attempt {attempt + 1}/{max_retries})...")
-                await asyncio.sleep(delay)
-            except Exception as e:
-                # For other exceptions, don't retry
-                print(f"Error during API call: {e}")
-                raise
+            # Ready-made image_url parts from the example bank
+            content.extend(self.in_context_examples)
+        self._append({"role": role, "content": content})
+
+    def _select_context(self):
+        messages = self.context_policy.select(self.messages, self.context_summary)
+
+        full_bytes, sent_bytes = self.history_bytes, len(json.dumps(messages))
+        full_tokens, sent_tokens = self.history_tokens, estimate_tokens(messages)
+        self.context_stats["queries"] += 1
+        self.context_stats["full_bytes"] += full_bytes
+        self.context_stats["sent_bytes"] += sent_bytes
+        self.context_stats["full_tokens"] += full_tokens
+        self.context_stats["sent_tokens"] += sent_tokens
+        self.context_stats["last_sent_tokens"] = sent_tokens
+        print(f"Context: sending {sent_bytes / 1024:.0f} of {full_bytes / 1024:.0f} KB, "
+              f"~{sent_tokens} of ~{full_tokens} tokens ({len(messages)} of {len(self.messages)} messages)")
+        return messages
+
+    async def _execute_query(self):
+        messages = self._select_context()
+        estimated_tokens = self.context_stats["last_sent_tokens"] + MAX_TOKENS
+        return await self.llm.chat(messages, estimated_tokens, priority=self.priority,
+                                   model=MODEL, seed=42, max_tokens=MAX_TOKENS, temperature=0)
 
     async def query(self, prompt, image_path, in_context=False):
         self.add_message("user", prompt, image_path, in_context)
 
-        response = await self._execute_query_with_retry(prompt, image_path)
+        response = await self._execute_query()
+        if response.usage is not None:
+            self.context_stats["prompt_tokens"] += response.usage.prompt_tokens
 
         response_content = response.choices[0].message.content
         self.add_message("assistant", response_content, None)
@@ -0,0 +1,85 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+WALLS = 1
+
+
+def region_bounds(start: Tuple[int, int], end: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    """
+    (row_start, row_end, col_start, col_end) slice bounds of a region given as the (row, col) start
+    and end used by the design records and door/window constraints. Ends are exclusive, except that
+    an end equal to its start stands for that single row or column.
+    """
+    row_end = end[0] if end[0] != start[0] else start[0] + 1
+    col_end = end[1] if end[1] != start[1] else start[1] + 1
+    return start[0], row_end, start[1], col_end
+
+
+def region_text(name: str, start: Tuple[int, int], end: Tuple[int, int]) -> str:
+    """Prompt description of a blocked region, e.g. "Sofa: Rows 3 to 5, Columns 2 to 4\""""
+    row_str = f"Rows {start[0]} to {end[0]}" if start[0] != end[0] else f"Rows {start[0]}"
+    col_str = f"Columns {start[1]} to {end[1]}" if start[1] != end[1] else f"Columns {start[1]}"
+    return f"{name}: {row_str}, {col_str}"
+
+
+class OccupancyGrid:
+    """
+    Labelled occupancy grid of a room. Every cell holds 0 when free or the label of the region
+    covering it, walls being label 1 around the border. Inserts, removals and overlap queries are
+    array slices over the region's footprint, and the prompt text is only built by `describe`.
+    """
+
+    def __init__(self, num_rows: int, num_cols: int):
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.labels = np.zeros((num_rows, num_cols), dtype=np.int32)
+        self.labels[[0, -1], :] = WALLS
+        self.labels[:, [0, -1]] = WALLS
+        self.regions: Dict[int, Tuple[str, Tuple[int, int], Tuple[int, int]]] = {}
+        self._next_label = WALLS + 1
+
+    @property
+    def blocked(self) -> np.ndarray:
+        return self.labels != 0
+
+    def _slices(self, start, end):
+        row_start, row_end, col_start, col_end = region_bounds(start, end)
+        return slice(max(row_start, 0), max(row_end, 0)), slice(max(col_start, 0), max(col_end, 0))
+
+    def in_room(self, start: Tuple[int, int], end: Tuple[int, int]) -> bool:
+        row_start, row_end, col_start, col_end = region_bounds(start, end)
+        return 0 <= row_start < row_end <= self.num_rows and 0 <= col_start < col_end <= self.num_cols
+
+    def insert(self, name: str, start: Tuple[int, int], end: Tuple[int, int]) -> int:
+        """Block the region and return its label. Cells already covered keep their first label"""
+        label = self._next_label
+        self._next_label += 1
+        self.regions[label] = (name, tuple(start), tuple(end))
+        rows, cols = self._slices(start, end)
+        footprint = self.labels[rows, cols]
+        footprint[footprint == 0] = label
+        return label
+
+    def remove(self, label: int):
+        """Free the region with `label`, cells it shares with other regions stay blocked"""
+        _, start, end = self.regions.pop(label)
+        rows, cols = self._slices(start, end)
+        footprint = self.labels[rows, cols]
+        footprint[footprint == label] = 0
+        for other, (_, other_start, other_end) in self.regions.items():
+            other_rows, other_cols = self._slices(other_start, other_end)
+            cells = self.labels[other_rows, other_cols]
+            cells[cells == 0] = other
+
+    def overlaps(self, start: Tuple[int, int], end: Tuple[int, int]) -> bool:
+        """Whether the region covers a blocked cell or leaves the room"""
+        if not self.in_room(start, end):
+            return True
+        rows, cols = self._slices(start, end)
+        return bool(self.labels[rows, cols].any())
+
+    def describe(self) -> List[str]:
+        """Blocked regions in the text form used in the prompts"""
+        walls = f"Walls: Entire Rows 1, Rows {self.num_rows - 1}, Columns 1, Columns {self.num_cols - 1}"
+        return [walls] + [region_text(name, start, end) for name, start, end in self.regions.values()]
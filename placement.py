@@ -0,0 +1,71 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def footprint(length: int, width: int, orientation: str) -> Tuple[int, int]:
+    """(rows, cols) covered by an object facing `orientation`, as laid out by Designer.add_objects"""
+    return (length, width) if orientation.lower() in ("north", "south") else (width, length)
+
+
+def free_positions(blocked: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    """
+    Boolean mask over start cells: True where a rows x cols footprint starting there stays in the
+    room and covers no blocked cell. Uses a summed-area table, so every start is checked at once.
+    """
+    num_rows, num_cols = blocked.shape
+    valid = np.zeros(blocked.shape, dtype=bool)
+    if rows < 1 or cols < 1 or rows > num_rows or cols > num_cols:
+        return valid
+    table = np.zeros((num_rows + 1, num_cols + 1), dtype=np.int32)
+    table[1:, 1:] = blocked.astype(np.int32).cumsum(axis=0).cumsum(axis=1)
+    covered = table[rows:, cols:] - table[:-rows, cols:] - table[rows:, :-cols] + table[:-rows, :-cols]
+    valid[:num_rows - rows + 1, :num_cols - cols + 1] = covered == 0
+    return valid
+
+
+def _facing_room(orientation_axis: str, center: float, size: int) -> str:
+    """Orientation facing into the room, away from the nearest wall on `orientation_axis`"""
+    if orientation_axis == "vertical":
+        return "south" if center < size / 2 else "north"
+    return "east" if center < size / 2 else "west"
+
+
+def nearest_free_placement(blocked: np.ndarray, length: int, width: int, start_row: int, start_col: int,
+                           orientation: str, rotation_penalty: float = 1.0) -> Optional[Tuple[int, int, str]]:
+    """
+    Closest non-overlapping (start_row, start_col, orientation) to a proposed placement of a
+    `length` x `width` object, or None when it fits nowhere in the room.
+
+    Distance is the Manhattan distance between start cells. Turning the object by 90 degrees costs
+    `rotation_penalty` extra cells, so the proposed orientation wins ties; a turned object faces
+    into the room.
+    """
+    orientation = orientation.lower()
+    num_rows, num_cols = blocked.shape
+    best = None
+    for turned in (False, True):
+        if turned and length == width:
+            break
+        if turned:
+            axis = "horizontal" if orientation in ("north", "south") else "vertical"
+            rows, cols = footprint(length, width, "east" if axis == "horizontal" else "north")
+        else:
+            rows, cols = footprint(length, width, orientation)
+
+        candidates = np.argwhere(free_positions(blocked, rows, cols))
+        if len(candidates) == 0:
+            continue
+        distances = np.abs(candidates[:, 0] - start_row) + np.abs(candidates[:, 1] - start_col)
+        closest = int(np.argmin(distances))
+        cost = distances[closest] + (rotation_penalty if turned else 0)
+        if best is None or cost < best[0]:
+            row, col = (int(value) for value in candidates[closest])
+            if not turned:
+                facing = orientation
+            elif axis == "horizontal":
+                facing = _facing_room(axis, col + cols / 2, num_cols)
+            else:
+                facing = _facing_room(axis, row + rows / 2, num_rows)
+            best = (cost, (row, col, facing))
+    return best[1] if best is not None else None
@@ -0,0 +1,103 @@
+from io import BytesIO
+from typing import Optional, Tuple, Union
+
+from PIL import Image, ImageDraw, ImageFont
+
+COLOR_PLACED = (255, 0, 0)       # Red
+COLOR_CANDIDATE = (0, 128, 0)    # Green
+COLOR_OUTLINE = (0, 0, 0)        # Black
+COLOR_LABEL = (255, 255, 0)      # Yellow
+OUTLINE_WIDTH = 3
+LABEL_PADDING = 5
+
+
+def _load_font(size: int = 14):
+    try:
+        return ImageFont.truetype("arial.ttf", size=size)
+    except IOError:
+        return ImageFont.load_default()
+
+
+class SceneRenderer:
+    """
+    Layered renderer of a design in progress. The room grid is decoded once, placed objects are
+    drawn onto a persistent layer as they are committed, and the candidate placement shown to the
+    critic is drawn on a copy of that layer. Images are only PNG encoded when an LLM call asks for
+    them, and each encoding is reused until its layer changes.
+
+    Grid cells map to pixels as in the room grid image: a cell is `size // (cells + 1)` pixels and
+    the first row and column of cells hold the axis labels.
+    """
+
+    def __init__(self, scene_image: Union[BytesIO, Image.Image], num_rows: int, num_cols: int):
+        if isinstance(scene_image, BytesIO):
+            scene_image.seek(0)
+            scene_image = Image.open(scene_image)
+        self.base = scene_image.convert("RGB")
+        self.cell_col = self.base.width // (num_cols + 1)
+        self.cell_row = self.base.height // (num_rows + 1)
+        self.placed = self.base.copy()
+        self.candidate: Optional[Tuple[Tuple[int, int, int, int], str]] = None
+        self.font = _load_font()
+        self._final_png: Optional[BytesIO] = None
+        self._intermediate_png: Optional[BytesIO] = None
+
+    def bbox(self, box: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        """Pixel rectangle (x0, y0, x1, y1) of a (col_start, row_start, col_end, row_end) box"""
+        return ((box[0] + 1) * self.cell_col, (box[1] + 1) * self.cell_row,
+                (box[2] + 1) * self.cell_col, (box[3] + 1) * self.cell_row)
+
+    def _draw(self, image: Image.Image, box, name: str, fill):
+        x0, y0, x1, y1 = self.bbox(box)
+        draw = ImageDraw.Draw(image)
+        if x1 > x0 and y1 > y0:
+            draw.rectangle([x0, y0, x1, y1], fill=fill, outline=COLOR_OUTLINE, width=OUTLINE_WIDTH)
+        draw.text((x0 + LABEL_PADDING, y0 + LABEL_PADDING), name, font=self.font, fill=COLOR_LABEL)
+
+    def place(self, box, name: str):
+        """Commit an object to the placed layer"""
+        self._draw(self.placed, box, name, COLOR_PLACED)
+        self.candidate = None
+        self._final_png = None
+        self._intermediate_png = None
+
+    def propose(self, box, name: str):
+        """Show a candidate placement on top of the placed objects, replacing any previous one"""
+        self.candidate = (box, name)
+        self._intermediate_png = None
+
+    def _encode(self, image: Image.Image) -> BytesIO:
+        buffer = BytesIO()
+        image.save(buffer, format="PNG")
+        buffer.seek(0)
+        return buffer
+
+    @property
+    def final_frame(self) -> Image.Image:
+        """The room with every placed object"""
+        return self.placed
+
+    @property
+    def intermediate_frame(self) -> Image.Image:
+        """The room with every placed object and the candidate placement"""
+        if self.candidate is None:
+            return self.placed
+        image = self.placed.copy()
+        self._draw(image, *self.candidate, COLOR_CANDIDATE)
+        return image
+
+    @property
+    def final_image(self) -> BytesIO:
+        """PNG of the final frame"""
+        if self._final_png is None:
+            self._final_png = self._encode(self.final_frame)
+        self._final_png.seek(0)
+        return self._final_png
+
+    @property
+    def intermediate_image(self) -> BytesIO:
+        """PNG of the intermediate frame"""
+        if self._intermediate_png is None:
+            self._intermediate_png = self._encode(self.intermediate_frame)
+        self._intermediate_png.seek(0)
+        return self._intermediate_png
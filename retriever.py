@@ -1,25 +1,28 @@
-import itertools
 import json
 import random
 
 import torch
-from sentence_transformers import SentenceTransformer, util
-from transformers import AutoModel, AutoProcessor, AutoTokenizer, SiglipTextModel
+from sentence_transformers import util
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-text_tokenizer = AutoTokenizer.from_pretrained("google/siglip-base-patch16-224")
-text_model = SiglipTextModel.from_pretrained("google/siglip-base-patch16-224").to(device)
+from caching import LRUCache
+from catalog import open_catalog
+from encoders import siglip_text_encoder
+
+text_encoder = siglip_text_encoder()
 LIKED_BOOST = 0.25
 DISLIKED_BOOST = -0.25
 
-with open("image_embedding_data.json", "r") as f:
-    data = json.load(f)
-    data_map = {item["item_id"]: item for item in data}
+catalog = open_catalog()
+data_map = catalog
 
 with open("mapping_3d_spins.json", "r") as f:
     image_mapping = json.load(f)
 
-stored_embeddings = torch.tensor([item["embedding"] for item in data])
+# Zero-copy view over the memory-mapped catalog embeddings
+stored_embeddings = torch.from_numpy(catalog.embeddings)
+
+def embeddings_of(item_ids: list[str]) -> torch.Tensor:
+    return stored_embeddings[torch.from_numpy(catalog.rows(item_ids))]
 
 async def simple_retriever(query_embedding, item_embeddings, top_k: int = 1):
     
@@ -31,44 +34,88 @@ async def simple_retriever(query_embedding, item_embeddings, top_k: int = 1):
         idx = hit['corpus_id']  # index of the stored item
         score = hit['score']
         if score < 0.99:
-            results.append((data[idx], score))
+            results.append((catalog.record(idx), score))
     return results
 
 async def retrieve(query: str = "a yellow sofa", top_k: int = 1):
     print("simple_retriever: ", query)
-    inputs = text_tokenizer([query], padding="max_length", truncation=True, return_tensors="pt").to(device)
-    query_embedding = text_model(**inputs)
-    query_embedding = query_embedding.pooler_output.cpu().detach().numpy().astype("float32")[0]
-    # query_embedding = text_model.encode(query, convert_to_tensor=True)
+    query_embedding = await text_encoder.encode(query)
     
     return await simple_retriever(query_embedding, stored_embeddings, top_k)
 
-async def rerank_items(retrieved_items, liked_items: list[str], disliked_items: list[str]):
-    retrieved_items_embeddings = [data_map[item[0]["item_id"]]["embedding"] for item in retrieved_items]
-    if len(liked_items) > 0:
-        liked_embeddings = torch.mean(torch.stack([torch.tensor(data_map[item]["embedding"]) for item in liked_items]), dim=0) 
-        liked_scores = [score[0] for score in util.cos_sim(retrieved_items_embeddings, liked_embeddings).tolist()]
-    else:
-        liked_scores = [0] * len(retrieved_items)
-    if len(disliked_items) > 0:
-        disliked_embeddings = torch.mean(torch.stack([torch.tensor(data_map[item]["embedding"]) for item in disliked_items]), dim=0) 
-        disliked_scores = [score[0] for score in util.cos_sim(retrieved_items_embeddings, disliked_embeddings).tolist()]
+class PreferenceCentroids:
+    """
+    Sums of the liked and disliked item embeddings of one user session. The client sends its full
+    liked/disliked lists on every request, and only the items added or removed since the previous
+    request touch the sums. A sum points the same way as the mean, so it is all cosine scoring needs.
+    """
+
+    def __init__(self):
+        self.liked: set[str] = set()
+        self.disliked: set[str] = set()
+        self.liked_sum = torch.zeros(stored_embeddings.shape[1])
+        self.disliked_sum = torch.zeros(stored_embeddings.shape[1])
+
+    def sync(self, liked_items: list[str], disliked_items: list[str]):
+        self.liked = self._update(self.liked, self.liked_sum, liked_items)
+        self.disliked = self._update(self.disliked, self.disliked_sum, disliked_items)
+
+    @staticmethod
+    def _update(current: set[str], total: torch.Tensor, items: list[str]) -> set[str]:
+        wanted = {item for item in items if item in catalog}
+        added, removed = wanted - current, current - wanted
+        if not wanted:
+            # Start again from an exact zero instead of accumulating rounding errors
+            total.zero_()
+            return wanted
+        if added:
+            total += embeddings_of(list(added)).sum(dim=0)
+        if removed:
+            total -= embeddings_of(list(removed)).sum(dim=0)
+        return wanted
+
+# Norms of every stored embedding, computed once for cosine scoring
+embedding_norms = torch.linalg.norm(stored_embeddings, dim=1)
+preference_sessions = LRUCache(max_entries=10000)
+
+def get_preferences(liked_items: list[str], disliked_items: list[str], session_id: str | None = None) -> PreferenceCentroids:
+    if session_id is None:
+        preferences = PreferenceCentroids()
     else:
-        disliked_scores = [0] * len(retrieved_items)
-    # print(liked_scores, disliked_scores)
-    results = [(retrieved_items[i][0], retrieved_items[i][1] 
-                + LIKED_BOOST * liked_scores[i] 
-                + DISLIKED_BOOST * disliked_scores[i]) 
-                for i in range(len(retrieved_items))]
+        preferences = preference_sessions.get(session_id)
+        if preferences is None:
+            preferences = PreferenceCentroids()
+            preference_sessions.set(session_id, preferences)
+    preferences.sync(liked_items, disliked_items)
+    return preferences
+
+async def rerank_items(retrieved_items, liked_items: list[str], disliked_items: list[str], session_id: str | None = None):
+    if len(retrieved_items) == 0:
+        return []
+    preferences = get_preferences(liked_items, disliked_items, session_id)
+
+    # One matrix product scores every retrieved item against both centroids
+    rows = torch.from_numpy(catalog.rows([item[0]["item_id"] for item in retrieved_items]))
+    centroids = torch.stack([preferences.liked_sum, preferences.disliked_sum])
+    similarities = (stored_embeddings[rows] @ centroids.T) / \
+        (embedding_norms[rows][:, None] * torch.linalg.norm(centroids, dim=1)[None, :]).clamp_min(1e-12)
+    boosts = (similarities @ torch.tensor([LIKED_BOOST, DISLIKED_BOOST])).tolist()
+
+    results = [(item, score + boost) for (item, score), boost in zip(retrieved_items, boosts)]
     results.sort(key=lambda x: x[1], reverse=True)
     return results
     
 
-async def get_similar_items(item_id: str, liked_items: list[str] = [], disliked_items: list[str] = []):
-    item_description = data_map[item_id]["description"]
-    items = await retrieve(item_description, 10)
+async def get_similar_items(item_id: str, liked_items: list[str] = [], disliked_items: list[str] = [], session_id: str | None = None):
+    neighbors = catalog.neighbors()
+    if neighbors is not None and item_id in catalog:
+        # Served from the precomputed neighbor table, see catalog.build_neighbor_table
+        items = [(catalog.record(row), score) for row, score in neighbors.lookup(catalog.row_of[item_id], 10)]
+    else:
+        item_description = data_map[item_id]["description"]
+        items = await retrieve(item_description, 10)
     print([(item[1], item[0]["item_id"]) for item in items])
-    reranked_items = await rerank_items(items, liked_items, disliked_items)
+    reranked_items = await rerank_items(items, liked_items, disliked_items, session_id)
     print([(item[1], item[0]["item_id"]) for item in reranked_items])
 
     return [{
@@ -79,7 +126,8 @@ async def get_similar_items(item_id: str, liked_items: list[str] = [], disliked_
             } for item in reranked_items
         ]
 
-async def get_similar_items_with_scene(item_id: str, liked_items: list[str] = [], disliked_items: list[str] = [], scene_items: list[str] = [], index: dict[str, set[str]] = {}):
+async def get_similar_items_with_scene(item_id: str, liked_items: list[str] = [], disliked_items: list[str] = [], scene_items: list[str] = [], index: dict[str, set[str]] = {},
+                                       session_id: str | None = None):
     print("get_similar_items_with_scene", item_id)
     if "item_keywords" in data_map[item_id]:
         item_keywords = data_map[item_id]["item_keywords"].split(" ")
@@ -92,9 +140,9 @@ async def get_similar_items_with_scene(item_id: str, liked_items: list[str] = []
     if len(index_items) == 0:
         return []
     # print(item_keywords, index_items)
-    index_items_embeddings = torch.tensor([data_map[item]["embedding"] for item in index_items])
+    index_items_embeddings = embeddings_of(index_items)
 
-    query_embedding = torch.mean(torch.stack([torch.tensor(data_map[item]["embedding"]) for item in scene_items]), dim=0)
+    query_embedding = torch.mean(embeddings_of(scene_items), dim=0)
     # results = await simple_retriever(query_embedding, index_items_embeddings, 10)
     hits = util.semantic_search(query_embedding, index_items_embeddings, top_k=10)
     hits = hits[0]
@@ -105,7 +153,7 @@ async def get_similar_items_with_scene(item_id: str, liked_items: list[str] = []
         score = hit['score']
         if score < 0.99:
             results.append((data_map[index_items[idx]], score))
-    reranked_items = await rerank_items(results, liked_items, disliked_items)
+    reranked_items = await rerank_items(results, liked_items, disliked_items, session_id)
     return [{
                 "item_id": item[0]["item_id"],
                 "description": item[0]["description"],
@@ -114,19 +162,58 @@ async def get_similar_items_with_scene(item_id: str, liked_items: list[str] = []
             } for item in reranked_items
     ]
 
-async def goes_with_it(item_id: str, liked_items: list[str] = [], disliked_items: list[str] = [], scene_items: list[str] = [], index: dict[str, set[str]] = {}):
-    if item_id in scene_items:
-        scene_items.remove(item_id)
+def beam_search_scenes(anchor_embedding: torch.Tensor, slot_embeddings: list[torch.Tensor], beam_width: int = 32,
+                       top_k: int = 10) -> list[tuple[tuple[int, ...], float]]:
+    """
+    Find the combinations of one candidate per slot whose mean embedding is most similar to the anchor,
+    without enumerating the cartesian product of all slots.
+
+    The cosine similarity of a mean only depends on the sum of its members, and the dot product of that
+    sum with the anchor grows additively as slots are filled, so partial scenes are extended one slot at
+    a time and only the `beam_width` best partial scenes are kept. Memory stays at
+    O(beam_width * candidates_per_slot * dimension) however many slots there are.
+    Returns up to `top_k` (candidate index per slot, cosine score) pairs, best first.
+    """
+    if not slot_embeddings:
+        return []
+
+    anchor = anchor_embedding.float() / anchor_embedding.float().norm().clamp_min(1e-12)
+    sums = torch.zeros(1, anchor.shape[0])
+    dots = torch.zeros(1)
+    choices = torch.zeros(1, 0, dtype=torch.long)
+
+    for candidates in slot_embeddings:
+        candidates = candidates.float()
+        num_candidates = candidates.shape[0]
+        extended_sums = (sums[:, None, :] + candidates[None, :, :]).reshape(-1, anchor.shape[0])
+        extended_dots = (dots[:, None] + (candidates @ anchor)[None, :]).reshape(-1)
+        scores = extended_dots / extended_sums.norm(dim=1).clamp_min(1e-12)
+
+        keep = torch.topk(scores, min(beam_width, scores.shape[0])).indices
+        beams, picks = keep // num_candidates, keep % num_candidates
+        sums, dots = extended_sums[keep], extended_dots[keep]
+        choices = torch.cat([choices[beams], picks[:, None]], dim=1)
+
+    scores = dots / sums.norm(dim=1).clamp_min(1e-12)
+    best = torch.topk(scores, min(top_k, scores.shape[0]))
+    return [(tuple(choices[idx].tolist()), score) for idx, score in zip(best.indices.tolist(), best.values.tolist())]
+
+async def goes_with_it(item_id: str, liked_items: list[str] = [], disliked_items: list[str] = [], scene_items: list[str] = [], index: dict[str, set[str]] = {},
+                       candidates_per_slot: int = 3, beam_width: int = 32):
+    scene_items = [scene_item for scene_item in scene_items if scene_item != item_id]
+    if len(scene_items) == 0:
+        return []
+
+    # One batched search for the candidates of every scene slot
+    slot_hits = util.semantic_search(embeddings_of(scene_items), stored_embeddings, top_k=candidates_per_slot+1)
     retrieved_items = []
-    for scene_item in scene_items:
-        print("scene_item", scene_item)
-        items = await simple_retriever(torch.tensor(data_map[scene_item]["embedding"]), stored_embeddings, 3)
-        retrieved_items.append([item[0]["item_id"] for item in items])
-    
-    scenes = list(itertools.product(*retrieved_items))
-    print(scenes)
-    scene_embeddings = torch.stack([torch.mean(torch.stack([torch.tensor(data_map[item]["embedding"]) for item in scene]), dim=0) for scene in scenes])
-    item_embedding = torch.tensor(data_map[item_id]["embedding"])
+    for hits in slot_hits:
+        candidates = [catalog.item_ids[hit['corpus_id']] for hit in hits if hit['score'] < 0.99][:candidates_per_slot]
+        if candidates:
+            retrieved_items.append(candidates)
+    print("goes_with_it candidates", retrieved_items)
+
+    item_embedding = stored_embeddings[catalog.row_of[item_id]]
     item_data = {
                 "item_id": data_map[item_id]["item_id"],
                 "description": data_map[item_id]["description"],
@@ -134,15 +221,12 @@ async def goes_with_it(item_id: str, liked_items: list[str] = [], disliked_items
                 if data_map[item_id]["item_id"] in image_mapping else None
             }
     print(item_data)
-    hits = util.semantic_search(item_embedding, scene_embeddings, top_k=10)
-    hits = hits[0]
-    
-    sample_scores = []
-    for hit in hits:
-        idx = hit['corpus_id']  # index of the stored item
-        score = hit['score']
-        sample_scores.append((idx, score))
-    random_sample = random.sample(sample_scores, 5)
+    hits = beam_search_scenes(item_embedding, [embeddings_of(candidates) for candidates in retrieved_items],
+                              beam_width=beam_width, top_k=10)
+    scenes = [tuple(retrieved_items[slot][pick] for slot, pick in enumerate(picks)) for picks, _ in hits]
+
+    sample_scores = [(idx, score) for idx, (_, score) in enumerate(hits)]
+    random_sample = random.sample(sample_scores, min(5, len(sample_scores)))
     random_sample = sorted(random_sample, key=lambda x: x[1], reverse=True)
     results = []
     for idx, _ in random_sample:
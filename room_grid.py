@@ -0,0 +1,129 @@
+from functools import lru_cache
+from io import BytesIO
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+CELL_SIZE = 50  # pixels per 1 ft x 1 ft cell, the axis margin is one cell wide
+
+COLOR_WALL = (128, 128, 128)         # Gray
+COLOR_INTERIOR = (255, 255, 255)     # White
+COLOR_DOOR_WINDOW = (255, 0, 0)      # Red
+COLOR_GRID = (0, 0, 0)               # Black
+
+INTERIOR, WALL, DOOR, WINDOW = 0, 1, 2, 3
+CELL_COLORS = np.array([COLOR_INTERIOR, COLOR_WALL, COLOR_DOOR_WINDOW, COLOR_DOOR_WINDOW], dtype=np.uint8)
+CELL_LABELS = {WALL: ("wall", (255, 255, 255)), DOOR: ("door", (0, 0, 0)), WINDOW: ("window", (0, 0, 0))}
+
+# (wall, position, width) of a door or window
+Opening = Tuple[str, float, float]
+
+
+def opening_cells(opening: Opening, rows: int, cols: int) -> List[Tuple[int, int]]:
+    """Grid cells covered by a door or window on the given wall"""
+    wall, position, width = opening
+    wall = wall.lower()
+    width = int(round(width))
+    if wall in ["north", "south"]:
+        center = int(round(position * (cols - 1)))
+        start = center - width // 2
+        r = 0 if wall == "north" else rows - 1
+        return [(r, c) for c in range(start, start + width) if 0 <= c < cols and 0 <= r < rows]
+    if wall in ["east", "west"]:
+        center = int(round(position * (rows - 1)))
+        start = center - width // 2
+        c = 0 if wall == "west" else cols - 1
+        return [(r, c) for r in range(start, start + width) if 0 <= c < cols and 0 <= r < rows]
+    return []
+
+
+def grid_key(rows: int, cols: int, doors: Iterable[Opening], windows: Iterable[Opening]) -> Tuple:
+    """
+    Canonical geometry of a room grid: its size and the cells taken by doors and windows. Rooms
+    that only differ in ways the grid cannot show (door height, sub-cell positions) share a key.
+    """
+    window_cells = {cell for window in windows for cell in opening_cells(window, rows, cols)}
+    door_cells = {cell for door in doors for cell in opening_cells(door, rows, cols)} - window_cells
+    return rows, cols, tuple(sorted(door_cells)), tuple(sorted(window_cells))
+
+
+@lru_cache(maxsize=1)
+def _font():
+    try:
+        # Attempt to use a truetype font (Arial) if available.
+        return ImageFont.truetype("arial.ttf", size=14)
+    except IOError:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=1024)
+def _glyph_tile(text: str, x: float, y: float) -> Tuple[Image.Image, int, int]:
+    """
+    Antialiased mask of `text` drawn at (x, y) from an integer origin, cropped to its ink, and the
+    offset at which to paste it. Every cell or axis position with the same text shares one tile.
+    """
+    pad = CELL_SIZE
+    mask = Image.new("L", (4 * CELL_SIZE, 3 * CELL_SIZE), 0)
+    ImageDraw.Draw(mask).text((x + pad, y + pad), text, font=_font(), fill=255)
+    box = mask.getbbox() or (0, 0, 1, 1)
+    return mask.crop(box), box[0] - pad, box[1] - pad
+
+
+@lru_cache(maxsize=1024)
+def _centered_tile(text: str, center_x: float, center_y: float):
+    bbox = _font().getbbox(text)
+    return _glyph_tile(text, center_x - (bbox[2] - bbox[0]) / 2, center_y - (bbox[3] - bbox[1]) / 2)
+
+
+def _stamp(image: Image.Image, text: str, color, origin_x: int, origin_y: int, center_x: float, center_y: float):
+    tile, dx, dy = _centered_tile(text, center_x, center_y)
+    image.paste(color, (origin_x + dx, origin_y + dy, origin_x + dx + tile.width, origin_y + dy + tile.height), tile)
+
+
+def render_room_grid(rows: int, cols: int, door_cells=(), window_cells=()) -> Image.Image:
+    """
+    Room grid image with labels: gray "wall" cells around the border, white interior, red "door"
+    and "window" cells, black grid lines, and row/column indexes in the top and left margins.
+    Cells are filled as array slices and labels are stamped from cached glyph tiles.
+    """
+    offset = margin = CELL_SIZE
+    kinds = np.full((rows, cols), INTERIOR, dtype=np.uint8)
+    kinds[[0, -1], :] = WALL
+    kinds[:, [0, -1]] = WALL
+    for r, c in door_cells:
+        kinds[r, c] = DOOR
+    for r, c in window_cells:
+        kinds[r, c] = WINDOW
+
+    pixels = np.empty((rows * CELL_SIZE + offset, cols * CELL_SIZE + offset, 3), dtype=np.uint8)
+    pixels[:offset] = COLOR_INTERIOR
+    pixels[:, :offset] = COLOR_INTERIOR
+    # Every cell row is one strip of pixel colors broadcast over the cell height
+    strips = CELL_COLORS[kinds].repeat(CELL_SIZE, axis=1)
+    for r in range(rows):
+        pixels[offset + r * CELL_SIZE:offset + (r + 1) * CELL_SIZE, offset:] = strips[r]
+    # Grid lines on the top/left edge of every cell, the closing lines fall just outside the image
+    pixels[offset::CELL_SIZE, offset:] = COLOR_GRID
+    pixels[offset:, offset::CELL_SIZE] = COLOR_GRID
+    image = Image.fromarray(pixels)
+
+    half = CELL_SIZE / 2
+    for r, c in zip(*np.nonzero(kinds)):
+        text, color = CELL_LABELS[kinds[r, c]]
+        _stamp(image, text, color, offset + int(c) * CELL_SIZE, offset + int(r) * CELL_SIZE, half, half)
+
+    for c in range(cols):
+        _stamp(image, str(c), COLOR_GRID, offset + c * CELL_SIZE, 0, half, margin / 2)
+    for r in range(rows):
+        _stamp(image, str(r), COLOR_GRID, 0, offset + r * CELL_SIZE, margin / 2, half)
+    return image
+
+
+@lru_cache(maxsize=256)
+def room_grid_png(key: Tuple) -> bytes:
+    """PNG of the room grid with canonical geometry `key` (see grid_key), memoized per key"""
+    rows, cols, door_cells, window_cells = key
+    buffer = BytesIO()
+    render_room_grid(rows, cols, door_cells, window_cells).save(buffer, format="PNG")
+    return buffer.getvalue()
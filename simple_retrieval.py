@@ -7,34 +7,67 @@ from typing import Dict, List, Optional, Set, Tuple
 
 import faiss
 import numpy as np
-from openai import OpenAI, RateLimitError
-from sentence_transformers import SentenceTransformer
-
+from openai import RateLimitError
+from ann_index import ANN_EF_SEARCH, ANN_INDEX_TYPE, ANN_NPROBE, build_index as build_ann_index, configure_index, search_parameters
+from boolean_query import PostingIndex
+from caching import ResultCache, cache_key
+from catalog import open_catalog
 from designer import OPENAI_API_KEY
+from encoders import minilm_encoder
+from llm_client import INTERACTIVE, llm_client
+
+
+REWRITE_MODEL = "gpt-4o"
+# Bump whenever the rewrite prompt or its parsing changes, so cached rewrites are not reused
+REWRITE_PROMPT_VERSION = 1
+REWRITE_CACHE_FIELDS = ("user_query", "material", "style", "keywords")
+REWRITE_CACHE_TTL = float(os.environ.get("REWRITE_CACHE_TTL", 7 * 24 * 3600))
+
+# Shared by every retrieval system in the process
+rewrite_cache = ResultCache("query_rewrites", max_entries=4096, ttl_seconds=REWRITE_CACHE_TTL)
+
+# Filters selecting at most this many rows are scored exactly instead of through the FAISS index
+EXACT_FILTER_ROWS = 2048
 
 
 class SimpleRetrieval:
-    def __init__(self, index_file: str = 'new_inverse_index.json', embeddings_file: str = 'embeddings.npy', item_id_file: str = 'item_ids.npy'):
+    def __init__(self, index_file: str = 'new_inverse_index.json', embeddings_file: str = 'embeddings.npy', item_id_file: str = 'item_ids.npy',
+                 faiss_index_file: str = 'text_index.faiss', index_type: str = ANN_INDEX_TYPE,
+                 nprobe: int = ANN_NPROBE, ef_search: int = ANN_EF_SEARCH):
         self.index_file = index_file
         self.embeddings_file = embeddings_file
+        self.faiss_index_file = faiss_index_file
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
         self.index: Dict[str, Set[str]] = {}
         self.items: Dict[str, Dict] = {}
         self.faiss_index = None
         self.item_id_file = item_id_file
         self.item_ids = []
+        self.row_of: Dict[str, int] = {}
         self.embeddings = None
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.postings: Optional[PostingIndex] = None
+        self.llm = llm_client(OPENAI_API_KEY)
+        self.encoder = minilm_encoder()
+        self.rewrite_cache = rewrite_cache
 
-        with open("image_embedding_data.json", "r") as f:
-            data = json.load(f)
-            self.data_map = {item["item_id"]: item for item in data}
+        self.catalog = open_catalog()
+        self.data_map = self.catalog
 
         with open("mapping_3d_spins.json", "r") as f:
             self.image_mapping = json.load(f)
 
     async def process_query(self, query_object: Dict[str, str]) -> Tuple[str, str]:
-        """Process the query object and generate boolean query and description"""
+        """Process the query object and generate boolean query and description, reusing earlier rewrites"""
+        key = cache_key(*(query_object.get(field, "") for field in REWRITE_CACHE_FIELDS),
+                        REWRITE_PROMPT_VERSION, REWRITE_MODEL)
+        boolean_query, object_description = await self.rewrite_cache.get_or_compute(
+            key, lambda: self._rewrite_query(query_object))
+        return boolean_query, object_description
+
+    async def _rewrite_query(self, query_object: Dict[str, str]) -> Tuple[str, str]:
+        """Ask the LLM for the boolean query and description of the query object"""
         try:
             prompt = f"""
             You are an AI assistant that generates **Boolean search queries** and **object descriptions** for furniture items based on user requests. Given a user's natural language input and structured product data, your task is to:
@@ -72,16 +105,17 @@ class SimpleRetrieval:
             2. A detailed object description for ranking
             """
 
-            # Call OpenAI API to generate the query and description
-            response = await asyncio.to_thread(
-                self.client.chat.completions.create,
-                model="gpt-4o",
-                messages=[
+            # Call OpenAI API to generate the query and description, ahead of queued design calls
+            response = await self.llm.chat(
+                [
                     {"role": "system",
                      "content": "You are an AI assistant that generates Boolean search queries and object "
                                 "descriptions for furniture items."},
                     {"role": "user", "content": prompt}
                 ],
+                estimated_tokens=len(prompt) // 4 + 500,
+                priority=INTERACTIVE,
+                model=REWRITE_MODEL,
                 seed=42,
                 max_tokens=500,
                 temperature=0,
@@ -123,8 +157,7 @@ class SimpleRetrieval:
     async def get_embedding(self, text: str) -> np.ndarray:
         """Get embedding for the given text"""
         try:
-            embedding = self.model.encode(text)
-            return np.array(embedding)
+            return await self.encoder.encode(text)
         except RateLimitError as e:
             print(f"Rate limit reached: {e}")
             raise
@@ -132,22 +165,21 @@ class SimpleRetrieval:
             print(f"Error getting embedding: {e}")
             raise
 
+    def build_query_object(self, user_input: Dict[str, str]) -> Dict[str, str]:
+        """The rewrite query object of a request: its user query and the attributes of the selected item"""
+        item = self.data_map[user_input["selectedItemId"]]
+        return {
+            "user_query": user_input["user_query"],
+            "material": item["material"] if "material" in item else "",
+            "style": item["style"] if "style" in item else "",
+            "keywords": item["keywords"] if "keywords" in item else ""
+        }
+
     async def retrieve_with_query_object(self, user_input: Dict[str, str], k: int = 10) -> List[Dict[str, str]]:
         """Process query object and retrieve results"""
         try:
             # Generate boolean query and description
-            itemId = user_input["selectedItemId"]
-            material = self.data_map[itemId]["material"] if "material" in self.data_map[itemId] else ""
-            style = self.data_map[itemId]["style"] if "style" in self.data_map[itemId] else ""
-            keywords = self.data_map[itemId]["keywords"] if "keywords" in self.data_map[itemId] else ""
-
-            query_object = {
-                "user_query": user_input["user_query"],
-                "material": material,
-                "style": style,
-                "keywords": keywords
-            }
-            boolean_query, object_description = await self.process_query(query_object)
+            boolean_query, object_description = await self.process_query(self.build_query_object(user_input))
 
             # Get embedding for the description
             query_embedding = await self.get_embedding(object_description)
@@ -287,117 +319,66 @@ class SimpleRetrieval:
             data = json.load(f)
             self.index = {k: set(v) for k, v in data['index'].items()}
             self.items = data['items']
+        self.postings = None
 
-    def _evaluate_expression(self, terms: List[str]) -> Set[str]:
-        """Evaluate a boolean expression without parentheses"""
-        if not terms:
-            return set()
-
-        # Initialize result with first term's items
-        result = self.index.get(terms[0].lower(), set())
-
-        i = 1
-        while i < len(terms):
-            operator = terms[i].upper()
-            if i + 1 >= len(terms):
-                break
-
-            next_term = terms[i + 1].lower()
-            next_items = self.index.get(next_term, set())
-
-            if operator == 'AND':
-                result = result.intersection(next_items)
-            elif operator == 'OR':
-                result = result.union(next_items)
-            elif operator == 'NOT':
-                result = result.difference(next_items)
-
-            i += 2
-
-        return result
+    def build_posting_index(self):
+        """Compile the inverse index to row posting lists over the rows of the vector index"""
+        self.postings = PostingIndex(self.index, self.item_ids)
 
-    def _process_parentheses(self, query: str) -> str:
-        """Process parentheses in the query and evaluate sub-expressions"""
-        # Remove extra spaces and normalize operators
-        query = ' '.join(query.split())
-        query = query.replace('( ', '(').replace(' )', ')')
-
-        # Find the innermost parentheses
-        while '(' in query:
-            # Find the innermost parentheses
-            start = query.rfind('(')
-            end = query.find(')', start)
-
-            if start == -1 or end == -1:
-                break
-
-            # Extract the sub-expression
-            sub_expr = query[start + 1:end]
-
-            # Evaluate the sub-expression
-            sub_result = self._evaluate_expression(sub_expr.split())
-
-            # Replace the sub-expression with a temporary token
-            temp_token = f"__TEMP_{len(sub_result)}__"
-            query = query[:start] + temp_token + query[end + 1:]
-
-            # Store the result
-            self.index[temp_token] = sub_result
-
-        return query
+    def boolean_mask(self, query: str) -> np.ndarray:
+        """
+        Evaluate a boolean query with parentheses to a mask over the rows of the vector index
+        Query format: (word1 AND word2) OR (word3 AND NOT word4)
+        """
+        if self.postings is None or self.postings.num_rows != len(self.item_ids):
+            self.build_posting_index()
+        try:
+            return self.postings.mask(query)
+        except ValueError as e:
+            print(f"Error processing boolean query: {e}")
+            return np.zeros(len(self.item_ids), dtype=bool)
 
     def boolean_query(self, query: str) -> Set[str]:
         """
         Process a boolean query with parentheses and return matching item_ids
         Query format: (word1 AND word2) OR (word3 AND NOT word4)
         """
-        try:
-            # Convert query to lowercase and remove extra spaces
-            query = ' '.join(query.lower().split())
-
-            # Process parentheses
-            query = self._process_parentheses(query)
-
-            # Split query into terms
-            terms = query.split()
-
-            # Evaluate the final expression
-            result = self._evaluate_expression(terms)
-
-            # Clean up temporary tokens
-            for key in list(self.index.keys()):
-                if key.startswith('__TEMP_'):
-                    del self.index[key]
-
-            return result
-
-        except Exception as e:
-            print(f"Error processing boolean query: {e}")
-            return set()
+        return {str(self.item_ids[row]) for row in np.flatnonzero(self.boolean_mask(query))}
 
     def build_faiss_index(self, embeddings: np.ndarray, item_ids: List[str]):
         """Build FAISS index from embeddings"""
         dimension = embeddings.shape[1]
-        self.faiss_index = faiss.IndexFlatL2(dimension)
-        self.faiss_index.add(embeddings)
+        self.faiss_index = build_ann_index(embeddings, self.index_type)
+        configure_index(self.faiss_index, self.nprobe, self.ef_search)
         self.item_ids = item_ids
         self.embeddings = embeddings
+        self.row_of = {str(item_id): row for row, item_id in enumerate(item_ids)}
+        self.postings = None
 
         # Save embeddings for later use
         np.save(self.embeddings_file, embeddings)
         np.save(self.item_id_file, self.item_ids)
-        print(f"FAISS index built with {len(item_ids)} items and {dimension} dimensions")
+        faiss.write_index(self.faiss_index, self.faiss_index_file)
+        print(f"FAISS {self.index_type} index built with {len(item_ids)} items and {dimension} dimensions")
 
     def load_faiss_index(self):
-        """Load pre-built FAISS index"""
+        """Load pre-built FAISS index, falling back to an exact index built from the embeddings"""
         if not os.path.exists(self.embeddings_file):
             raise FileNotFoundError(f"Embeddings file {self.embeddings_file} not found")
 
-        self.embeddings = np.load(self.embeddings_file)
+        # Only the rows of small filtered searches are read from the embeddings, so they stay on disk
+        self.embeddings = np.load(self.embeddings_file, mmap_mode='r')
         dimension = self.embeddings.shape[1]
-        self.faiss_index = faiss.IndexFlatL2(dimension)
-        self.faiss_index.add(self.embeddings)
+        if os.path.exists(self.faiss_index_file):
+            self.faiss_index = faiss.read_index(self.faiss_index_file)
+            if self.faiss_index.ntotal != self.embeddings.shape[0]:
+                raise ValueError(f"Mismatch between FAISS index size ({self.faiss_index.ntotal}) and embeddings ({self.embeddings.shape[0]})")
+        else:
+            self.faiss_index = build_ann_index(self.embeddings, "flat")
+        configure_index(self.faiss_index, self.nprobe, self.ef_search)
         self.item_ids = np.load(self.item_id_file)
+        self.row_of = {str(item_id): row for row, item_id in enumerate(self.item_ids)}
+        self.build_posting_index()
         print(f"FAISS index loaded with {self.embeddings.shape[0]} items and {dimension} dimensions")
 
     def retrieve_similar(self, query_embedding: np.ndarray, k: int = 10) -> List[Tuple[str, float]]:
@@ -411,6 +392,35 @@ class SimpleRetrieval:
         distances, indices = self.faiss_index.search(query_embedding.reshape(1, -1), k)
         return [(self.item_ids[idx], float(dist)) for idx, dist in zip(indices[0], distances[0])]
 
+    def search_filtered(self, query_embedding: np.ndarray, mask: np.ndarray, k: int = 10) -> List[Tuple[int, float]]:
+        """
+        Search the resident FAISS index restricted to the rows selected by `mask`
+        Returns up to k (row, distance) tuples, closest first
+
+        Small selections are scored exactly against the gathered rows, larger ones are searched
+        in place through a FAISS bitmap selector, so no temporary index is ever built.
+        """
+        if self.faiss_index is None:
+            raise ValueError("FAISS index not initialized")
+
+        rows = np.flatnonzero(mask)
+        k = min(k, len(rows))
+        if k == 0:
+            return []
+        query = np.ascontiguousarray(query_embedding.reshape(1, -1), dtype=np.float32)
+
+        if len(rows) <= EXACT_FILTER_ROWS or not hasattr(faiss, "IDSelectorBitmap"):
+            distances = ((self.embeddings[rows] - query) ** 2).sum(axis=1)
+            best = np.argpartition(distances, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+            best = best[np.argsort(distances[best])]
+            return [(int(rows[idx]), float(distances[idx])) for idx in best]
+
+        # The packed bitmap must stay alive for as long as the selector is used
+        bitmap = np.packbits(mask.astype(bool), bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        distances, indices = self.faiss_index.search(query, k, params=search_parameters(self.faiss_index, selector))
+        return [(int(row), float(dist)) for row, dist in zip(indices[0], distances[0]) if row >= 0]
+
     def retrieve_with_boolean_and_similarity(self,
                                              boolean_query: str,
                                              query_embedding: np.ndarray,
@@ -419,27 +429,9 @@ class SimpleRetrieval:
         First apply boolean query to filter items, then rank by similarity
         Returns list of (item_id, distance) tuples
         """
-        # Get items matching boolean query
-        boolean_matches = self.boolean_query(boolean_query)
-
-        if not boolean_matches:
-            return []
-
-        # Create a temporary FAISS index with only matching items
-        matching_indices = [i for i, item_id in enumerate(self.item_ids) if item_id in boolean_matches]
-        if not matching_indices:
-            return []
-
-        temp_index = faiss.IndexFlatL2(query_embedding.shape[0])
-        temp_embeddings = self.embeddings[matching_indices]
-        temp_index.add(temp_embeddings)
-
-        # Search in the filtered index
-        distances, local_indices = temp_index.search(query_embedding.reshape(1, -1), min(k, len(matching_indices)))
-
-        # Map back to original item IDs
-        return [(self.item_ids[matching_indices[idx]], float(dist))
-                for idx, dist in zip(local_indices[0], distances[0])]
+        # Rank only the rows matching boolean query
+        hits = self.search_filtered(query_embedding, self.boolean_mask(boolean_query), k)
+        return [(self.item_ids[row], dist) for row, dist in hits]
 
 
 def build_index(data_file: str, index_file: str = 'new_inverse_index.json'):
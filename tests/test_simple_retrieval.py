@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("transformers")
+
+from simple_retrieval import SimpleRetrieval
+
+
+def test_load_faiss_index_without_index_file(tmp_path):
+    """Without a saved FAISS index, an exact one is built from the embeddings"""
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(20, 8)).astype(np.float32)
+    item_ids = np.array([f"item-{row}" for row in range(len(embeddings))])
+    np.save(tmp_path / "embeddings.npy", embeddings)
+    np.save(tmp_path / "item_ids.npy", item_ids)
+
+    # Skip __init__, which loads the encoder, the catalog and the LLM client
+    retrieval = SimpleRetrieval.__new__(SimpleRetrieval)
+    retrieval.embeddings_file = str(tmp_path / "embeddings.npy")
+    retrieval.item_id_file = str(tmp_path / "item_ids.npy")
+    retrieval.faiss_index_file = str(tmp_path / "missing.faiss")
+    retrieval.nprobe, retrieval.ef_search = 8, 64
+    retrieval.index = {"chair": {"item-3", "item-7"}}
+
+    retrieval.load_faiss_index()
+
+    assert retrieval.faiss_index.ntotal == len(embeddings)
+    assert retrieval.retrieve_similar(embeddings[5], k=1)[0][0] == "item-5"
+    assert [item_id for item_id, _ in retrieval.retrieve_with_boolean_and_similarity("chair", embeddings[7], k=2)] \
+        == ["item-7", "item-3"]
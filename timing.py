@@ -0,0 +1,41 @@
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class StageTimer:
+    """Wall-clock time spent in the named stages of a pipeline, summed over repeated entries"""
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {name: {"seconds": round(seconds, 4), "count": self.counts[name]}
+                for name, seconds in self.durations.items()}
+
+    def summary(self) -> str:
+        return ", ".join(f"{name} {seconds:.2f}s" + (f" (x{self.counts[name]})" if self.counts[name] > 1 else "")
+                         for name, seconds in self.durations.items())
+
+    def merge(self, other: "StageTimer"):
+        """Add the stages of another timer, e.g. of a pipeline run inside a request"""
+        for name, seconds in other.durations.items():
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + other.counts[name]
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.durations.items())